@@ -0,0 +1,134 @@
+import json
+import os
+from typing import Any, Dict, Optional
+
+from flask import Blueprint, Response, abort, jsonify, request, url_for
+
+from pdf_ocr_app.callbacks import check_callback_url, register_callback
+from pdf_ocr_app.compute import Document, OCRProcessingStep, PageRange, parse_page_range
+from pdf_ocr_app.config import get_config
+from pdf_ocr_app.db import (
+    artifact_exists,
+    copy_pdf,
+    dump_processing_step,
+    has_processing_step,
+    input_pdf_path,
+    is_document_complete,
+    load_nb_pages,
+    load_ocr_page_numbers,
+    load_page_alto_xml,
+    load_processing_step,
+    page_output_path,
+    read_artifact,
+    render_page_svg,
+    save_document_stream,
+)
+from pdf_ocr_app.process import start_simple_ocr_process
+from pdf_ocr_app.responses import conditional_response
+
+api = Blueprint('api', __name__, url_prefix='/api')
+
+_PDF_CONTENT_TYPES = ('application/pdf', 'application/octet-stream')
+_PAGE_FORMATS = {'alto': ('alto', 'application/xml'), 'hocr': ('hocr', 'text/html')}
+_MB = 1024 * 1024
+
+
+def _error(message: str, status: int) -> Response:
+    response = jsonify({'error': message})
+    response.status_code = status
+    return response
+
+
+def _server_side_path(path: str) -> str:
+    input_folder = os.path.realpath(get_config().api.input_folder)
+    real_path = os.path.realpath(path)
+    if os.path.commonpath([input_folder, real_path]) != input_folder:
+        raise ValueError(f'Server-side paths must be inside {input_folder}')
+    if not os.path.isfile(real_path):
+        raise ValueError(f'File not found: {path}')
+    return real_path
+
+
+def _submission_parameters() -> Dict[str, Any]:
+    if request.mimetype in _PDF_CONTENT_TYPES:
+        return request.args.to_dict()
+    return {**request.args.to_dict(), **(request.get_json(silent=True) or {})}
+
+
+def _priority_range(pages: Optional[str]) -> Optional[PageRange]:
+    return parse_page_range(pages) if pages else None
+
+
+@api.route('/documents', methods=['POST'])
+def submit_document():
+    parameters = _submission_parameters()
+    try:
+        priority_range = _priority_range(parameters.get('pages'))
+        callback_url = parameters.get('callback_url')
+        if callback_url:
+            check_callback_url(callback_url)
+        path = None if request.mimetype in _PDF_CONTENT_TYPES else _server_side_path(parameters.get('path') or '')
+    except ValueError as exc:
+        return _error(str(exc), 400)
+    max_size = get_config().api.max_upload_mb * _MB
+    if (request.content_length or 0) > max_size:
+        return _error(f'File is too large, expecting at most {get_config().api.max_upload_mb}MB', 413)
+    document_id = Document.new().document_id
+    if path:
+        copy_pdf(path, document_id)
+    else:
+        try:
+            save_document_stream(request.stream, document_id, max_size)
+        except ValueError as exc:
+            return _error(str(exc), 413)
+    if callback_url:
+        register_callback(document_id, callback_url)
+    dump_processing_step(OCRProcessingStep('OCR en cours.', 0.05, False), document_id)
+    start_simple_ocr_process(document_id, priority_range)
+    status_url = url_for('api.document_status', document_id=document_id)
+    response = jsonify({'document_id': document_id, 'status_url': status_url})
+    response.status_code = 202
+    response.headers['Location'] = status_url
+    return response
+
+
+def _ensure_document_exists(document_id: str) -> None:
+    if not document_id.isalpha() or not os.path.exists(input_pdf_path(document_id)):
+        abort(404)
+
+
+@api.route('/documents/<document_id>', methods=['GET'])
+def document_status(document_id: str):
+    _ensure_document_exists(document_id)
+    if not has_processing_step(document_id):
+        return _error('Document is not processed yet.', 404)
+    step = load_processing_step(document_id)
+    status = {
+        **step.to_payload(),
+        'nb_pages': load_nb_pages(document_id),
+        'ocr_pages': load_ocr_page_numbers(document_id) if step.done else [],
+    }
+    response = Response(json.dumps(status), mimetype='application/json')
+    return conditional_response(response, immutable=False)
+
+
+@api.route('/documents/<document_id>/pages/<int:page_nb>.<format_>', methods=['GET'])
+def document_page(document_id: str, page_nb: int, format_: str):
+    _ensure_document_exists(document_id)
+    if not artifact_exists(page_output_path(document_id, page_nb, 'alto')):
+        return _error(f'Page {page_nb} is not processed yet.', 404)
+    if format_ == 'svg':
+        response = Response(render_page_svg(load_page_alto_xml(document_id, page_nb)), mimetype='image/svg+xml')
+    elif format_ == 'txt':  # built from ALTO, like the document text, whatever the renderers
+        from pdf_ocr_app.layout import alto_page_text
+
+        response = Response(alto_page_text(load_page_alto_xml(document_id, page_nb)), mimetype='text/plain')
+    elif format_ in _PAGE_FORMATS:
+        renderer, mimetype = _PAGE_FORMATS[format_]
+        path = page_output_path(document_id, page_nb, renderer)
+        if not artifact_exists(path):
+            return _error(f'Format {format_} was not rendered for this document.', 404)
+        response = Response(read_artifact(path), mimetype=mimetype)
+    else:
+        return _error(f'Unknown format {format_}, expecting svg, txt or one of {list(_PAGE_FORMATS)}', 400)
+    return conditional_response(response, immutable=is_document_complete(document_id))
@@ -1,4 +1,3 @@
-import os
 from typing import Dict, Optional
 
 import dash
@@ -8,32 +7,16 @@ import dash_html_components as html
 from dash.dependencies import Input, Output
 from dash.development.base_component import Component
 
+from pdf_ocr_app.api import api
 from pdf_ocr_app.app.common_ids import DOCUMENT_ID
 from pdf_ocr_app.app.pages.output import page as output_page
 from pdf_ocr_app.app.pages.parse import page as parse_page
 from pdf_ocr_app.app.pages.temp_page import page as temp_page
 from pdf_ocr_app.app.routing import ROUTER, Endpoint, Page
-from pdf_ocr_app.config import CONFIG
-from pdf_ocr_app.db import download_document
+from pdf_ocr_app.janitor import start_janitor_thread
+from pdf_ocr_app.responses import compress_response
 from pdf_ocr_app.utils import safely_replace_path_suffix
 
-_TESSDATA_URL = CONFIG.tesseract.models_url_template.format(CONFIG.tesseract.lang)
-_TESSDATA_PREFIX = CONFIG.tesseract.tessdata_location
-
-
-def _suffix(text: str) -> str:
-    return text.split('/')[-1]
-
-
-def _download_tessdata_if_inexistent():
-    filename = os.path.join(_TESSDATA_PREFIX, _suffix(_TESSDATA_URL))
-    if not os.path.exists(filename):
-        print(f'Downloading {_TESSDATA_URL} to {filename}')
-        download_document(_TESSDATA_URL, filename)
-
-
-_download_tessdata_if_inexistent()
-
 
 def _header_link(content: str, href: str, target: Optional[str] = None) -> Component:
     style = {'color': 'grey', 'display': 'inline-block'}
@@ -113,6 +96,9 @@ for _, _add_callbacks in _ENDPOINT_TO_PAGE.values():
         _add_callbacks(app)
 
 APP = app.server  # for gunicorn deployment
+APP.before_first_request(start_janitor_thread)
+APP.register_blueprint(api)
+APP.after_request(compress_response)
 
 if __name__ == '__main__':
     app.run_server(debug=True)
@@ -2,8 +2,11 @@ from typing import Callable, List
 
 import alto
 import dash_html_components as html
+import numpy as np
 from dash.development.base_component import Component
 
+from pdf_ocr_app.layout import reading_order
+
 Sizer = Callable[[float, bool], str]
 
 
@@ -118,10 +121,19 @@ def alto_page_to_grouped_lines(page: alto.Page) -> Component:
     )
 
 
+def _line_text(line: alto.TextLine) -> str:
+    return ' '.join([string.content for string in line.strings if isinstance(string, alto.String)])
+
+
+def _ordered_paragraphs(blocks: List[alto.TextBlock]) -> List[str]:
+    lines = [(block_id, line) for block_id, block in enumerate(blocks) for line in block.text_lines]
+    boxes = np.array([[line.hpos, line.vpos, line.width, line.height] for _, line in lines], dtype=float)
+    block_ids = np.array([block_id for block_id, _ in lines], dtype=int)
+    return [' '.join(_line_text(lines[i][1]) for i in paragraph) for paragraph in reading_order(boxes, block_ids)]
+
+
 def _extract_block_text(block: alto.TextBlock) -> str:
-    return ' '.join(
-        [string.content for line in block.text_lines for string in line.strings if isinstance(string, alto.String)]
-    )
+    return ' '.join(_ordered_paragraphs([block]))
 
 
 def _text_block_to_component(block: alto.TextBlock, sizer: Sizer) -> Component:
@@ -148,5 +160,5 @@ def alto_page_to_grouped_paragraphs(page: alto.Page) -> Component:
 
 
 def alto_pages_to_paragraphs(pages: List[alto.Page]) -> Component:
-    paragraphs = [_extract_block_text(block) for page in pages for block in page.extract_text_blocks()]
+    paragraphs = [paragraph for page in pages for paragraph in _ordered_paragraphs(page.extract_text_blocks())]
     return html.Div([html.P(paragraph) for paragraph in paragraphs])
@@ -3,11 +3,12 @@ from typing import List
 import alto
 import dash
 import dash_bootstrap_components as dbc
+import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 from dash.development.base_component import Component
 from dash.exceptions import PreventUpdate
-from flask.helpers import send_file
+from flask import abort
 
 from pdf_ocr_app.app.alto_to_html import (
     alto_page_to_grouped_lines,
@@ -18,9 +19,29 @@ from pdf_ocr_app.app.alto_to_html import (
 from pdf_ocr_app.app.common_ids import DOCUMENT_ID
 from pdf_ocr_app.app.routing import Page
 from pdf_ocr_app.app.utils import generate_id
-from pdf_ocr_app.db import load_alto_pages, svg_path
+from pdf_ocr_app.compute import parse_page_range
+from pdf_ocr_app.db import (
+    RENDERER_EXTENSIONS,
+    artifact_exists,
+    is_document_complete,
+    load_alto_pages,
+    load_nb_pages,
+    load_ocr_page_numbers,
+    page_output_path,
+    searchable_pdf_path,
+    svg_path,
+    text_path,
+    touch_document,
+)
+from pdf_ocr_app.process import start_simple_ocr_process
+from pdf_ocr_app.profiling import profiled_callback
+from pdf_ocr_app.responses import send_artifact
+from pdf_ocr_app.tiling import is_tiled_page
 
 _OCR_OUTPUT = generate_id(__file__, 'ocr-output')
+_PAGE_RANGE = generate_id(__file__, 'page-range')
+_PAGE_RANGE_BUTTON = generate_id(__file__, 'page-range-button')
+_PAGE_RANGE_MESSAGE = generate_id(__file__, 'page-range-message')
 
 
 def _explain_word_confidence() -> Component:
@@ -75,29 +96,98 @@ def _tabs(pages: List[alto.Page]) -> Component:
     )
 
 
+def _download_button(text: str, href: str) -> Component:
+    return html.A(html.Button(text, className='btn btn-link'), href=href)
+
+
 def _buttons(document_id: str) -> Component:
-    button = html.Button('Télécharger au format SVG', className='btn btn-link')
-    return html.A(button, href=f'/download_svg/{document_id}')
+    buttons = [_download_button('Télécharger au format SVG', f'/download_svg/{document_id}')]
+    if artifact_exists(searchable_pdf_path(document_id)):
+        buttons.append(_download_button('Télécharger le PDF avec texte', f'/download_pdf/{document_id}'))
+        tiled_pages = [
+            str(page_nb + 1) for page_nb in load_ocr_page_numbers(document_id) if is_tiled_page(document_id, page_nb)
+        ]
+        if tiled_pages:
+            buttons.append(html.Small(f'(sans couche texte pour les pages {", ".join(tiled_pages)}, OCR par tuiles)'))
+    if artifact_exists(text_path(document_id)):
+        buttons.append(_download_button('Télécharger le texte brut', f'/download_txt/{document_id}'))
+    return html.Div(buttons)
+
+
+def _page_range_form(page_nbs: List[int], nb_pages: int) -> Component:
+    pages = ', '.join(str(page_nb + 1) for page_nb in page_nbs) if len(page_nbs) <= 20 else f'{len(page_nbs)} pages'
+    return html.Div(
+        [
+            html.P(f'Pages traitées : {pages} (sur {nb_pages}). Les autres pages sont traitées en arrière-plan.'),
+            html.Div(
+                [
+                    dcc.Input(id=_PAGE_RANGE, placeholder='Pages à traiter en priorité, ex: 12-20', className='mr-2'),
+                    html.Button('Lancer', id=_PAGE_RANGE_BUTTON, className='btn btn-primary btn-sm'),
+                ]
+            ),
+            html.Div(id=_PAGE_RANGE_MESSAGE, className='mt-2'),
+        ],
+        className='mb-3',
+    )
 
 
 def _load_and_display_alto(document_id: str) -> Component:
     pages = load_alto_pages(document_id)
     children = []
     children.append(_buttons(document_id))
+    nb_pages = load_nb_pages(document_id)
+    if nb_pages and len(pages) < nb_pages:
+        children.append(_page_range_form(load_ocr_page_numbers(document_id), nb_pages))
     children.append(_tabs(pages))
     return html.Div(children)
 
 
 def _add_callbacks(app: dash.Dash):
     @app.callback(Output(_OCR_OUTPUT, 'children'), Input(DOCUMENT_ID, 'data'))
+    @profiled_callback('load_result', 0)
     def load_result(document_id: str) -> Component:
         if not document_id:
             raise PreventUpdate
         return _load_and_display_alto(document_id)
 
+    @app.callback(
+        Output(_PAGE_RANGE_MESSAGE, 'children'),
+        Input(_PAGE_RANGE_BUTTON, 'n_clicks'),
+        State(_PAGE_RANGE, 'value'),
+        State(DOCUMENT_ID, 'data'),
+        prevent_initial_call=True,
+    )
+    def request_page_range(_, page_range: str, document_id: str) -> Component:
+        try:
+            range_ = parse_page_range(page_range or '')
+        except ValueError as exc:
+            return dbc.Alert(str(exc), color='warning')
+        start_simple_ocr_process(document_id, range_)
+        return dbc.Alert('Traitement lancé, rechargez la page dans quelques instants.', color='info')
+
+    def _send_document_artifact(document_id: str, path: str):
+        if not document_id.isalpha() or not artifact_exists(path):
+            abort(404)
+        touch_document(document_id)
+        return send_artifact(path, immutable=is_document_complete(document_id), as_attachment=True)
+
     @app.server.route('/download_svg/<document_id>')
     def _download(document_id: str):
-        return send_file(svg_path(document_id), as_attachment=True)
+        return _send_document_artifact(document_id, svg_path(document_id))
+
+    @app.server.route('/download_pdf/<document_id>')
+    def _download_pdf(document_id: str):
+        return _send_document_artifact(document_id, searchable_pdf_path(document_id))
+
+    @app.server.route('/download_txt/<document_id>')
+    def _download_txt(document_id: str):
+        return _send_document_artifact(document_id, text_path(document_id))
+
+    @app.server.route('/download_page/<document_id>/<int:page_nb>/<renderer>')
+    def _download_page(document_id: str, page_nb: int, renderer: str):
+        if renderer not in RENDERER_EXTENSIONS:
+            abort(404)
+        return _send_document_artifact(document_id, page_output_path(document_id, page_nb, renderer))
 
 
 def _page() -> Component:
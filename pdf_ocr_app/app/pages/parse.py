@@ -14,7 +14,7 @@ from pdf_ocr_app.app.common_ids import DOCUMENT_ID
 from pdf_ocr_app.app.components.upload_row import upload_row
 from pdf_ocr_app.app.routing import Endpoint, Page
 from pdf_ocr_app.app.utils import generate_id
-from pdf_ocr_app.compute import Document, OCRProcessingStep
+from pdf_ocr_app.compute import Document, OCRProcessingStep, PageRange, parse_page_range
 from pdf_ocr_app.db import (
     copy_pdf,
     dump_processing_step,
@@ -34,6 +34,8 @@ _PROGRESS_BAR_WRAPPER = generate_id(__file__, 'progress-bar-wrapper')
 _LOADER = generate_id(__file__, 'loader')
 _DROPDOWN = generate_id(__file__, 'dropdown')
 _OCR_OUTPUT = generate_id(__file__, 'ocr-output')
+_PAGE_RANGE = generate_id(__file__, 'page-range')
+_PAGE_RANGE_MESSAGE = generate_id(__file__, 'page-range-message')
 
 
 def _progress() -> Component:
@@ -41,10 +43,17 @@ def _progress() -> Component:
     return html.Div(progress, hidden=True, id=_PROGRESS_BAR_WRAPPER, className='mt-3 mb-3')
 
 
+def _page_range_input() -> Component:
+    input_ = dcc.Input(id=_PAGE_RANGE, placeholder='ex: 1-10 (optionnel)', className='ml-2')
+    message = html.Div(id=_PAGE_RANGE_MESSAGE, className='mt-2')
+    return html.Div([html.Label('Pages à traiter en priorité'), input_, message], className='mb-3')
+
+
 def _page() -> Component:
     return html.Div(
         [
             html.H1('Convertisseur'),
+            _page_range_input(),
             upload_row(_UPLOAD, _DROPDOWN, load_sample_documents()),
             _progress(),
             dcc.Store(id=_DOCUMENT_ID),
@@ -86,7 +95,25 @@ def _job_is_done(document_id: str) -> bool:
     return _load_or_init_step(document_id).done
 
 
+def _priority_range(page_range: Optional[str]) -> Optional[PageRange]:
+    return parse_page_range(page_range) if page_range else None
+
+
 def _add_callbacks(app: dash.Dash):
+    @app.callback(
+        Output(_PAGE_RANGE_MESSAGE, 'children'),
+        Output(_UPLOAD, 'disabled'),
+        Output(_DROPDOWN, 'disabled'),
+        Input(_PAGE_RANGE, 'value'),
+    )
+    def check_page_range(page_range: Optional[str]):
+        # Documents cannot be chosen while the range is invalid, rather than processing them in page order.
+        try:
+            _priority_range(page_range)
+        except ValueError as exc:
+            return dbc.Alert(str(exc), color='warning'), True, True
+        return html.Div(), False, False
+
     @app.callback(
         Output(_DOCUMENT_ID, 'data'),
         Input(_UPLOAD, 'contents'),
@@ -118,14 +145,19 @@ def _add_callbacks(app: dash.Dash):
         Input(_INTERVAL, 'n_intervals'),
         Input(_DOCUMENT_ID, 'data'),
         State(_PROGRESS_BAR_WRAPPER, 'hidden'),
+        State(_PAGE_RANGE, 'value'),
         prevent_initial_call=True,
     )
-    def _process_file(_, filename, progress_is_hidden):
+    def _process_file(_, filename, progress_is_hidden, page_range):
         ctx = dash.callback_context
         filename_trigger = _filename_trigger(ctx.triggered)
         if filename_trigger and progress_is_hidden:
             if not _job_is_done(filename):
-                start_simple_ocr_process(filename)
+                try:
+                    priority_range = _priority_range(page_range)
+                except ValueError:
+                    raise PreventUpdate  # edited after the upload, check_page_range displays the error
+                start_simple_ocr_process(filename, priority_range)
             return dash.no_update, 'OCR en cours....', 5, False
         if not filename_trigger and not progress_is_hidden:
             step = _load_or_init_step(filename)
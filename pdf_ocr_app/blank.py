@@ -0,0 +1,87 @@
+# Blank and near-blank pages detection (separator sheets, back sides with bleed-through), run on the rasterized page
+# before tesseract. Blank pages get tesseract-shaped empty outputs with the page dimensions.
+import os
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+from scipy import ndimage
+
+from pdf_ocr_app.config import BlankConfig
+from pdf_ocr_app.db import RENDERER_EXTENSIONS, extract_page_pdf, page_output_base, write_file
+
+_INK_LEVEL = 128  # bleed-through and scanner noise are lighter than that
+_MARGIN_RATIO = 0.05  # scanner borders and punch holes
+
+_ALTO_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
+<alto xmlns="http://www.loc.gov/standards/alto/ns-v3#" xmlns:xlink="http://www.w3.org/1999/xlink">
+<Description><MeasurementUnit>pixel</MeasurementUnit><OCRProcessing ID="OCR_0"><ocrProcessingStep>
+<processingSoftware><softwareName>blank page detection</softwareName></processingSoftware></ocrProcessingStep>
+</OCRProcessing></Description>
+<Layout><Page WIDTH="{width}" HEIGHT="{height}" PHYSICAL_IMG_NR="0" ID="page_0">
+<PrintSpace HPOS="0" VPOS="0" WIDTH="{width}" HEIGHT="{height}"></PrintSpace>
+</Page></Layout>
+</alto>
+'''
+_HOCR_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN"
+"http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">
+<head><title></title><meta http-equiv="Content-Type" content="text/html;charset=utf-8"/>
+<meta name="ocr-system" content="blank page detection"/></head>
+<body><div class="ocr_page" id="page_1" title="bbox 0 0 {width} {height}; ppageno 0"></div></body>
+</html>
+'''
+_TSV_TEMPLATE = '''level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext
+1\t1\t0\t0\t0\t0\t0\t0\t{width}\t{height}\t-1\t
+'''
+
+
+@dataclass
+class PageInk:
+    ink_ratio: float
+    nb_components: int
+
+
+def _downscale(pixels: np.ndarray, factor: int) -> np.ndarray:
+    # Min-pooling: thin strokes would fade into the background with an average.
+    height, width = pixels.shape[0] // factor * factor, pixels.shape[1] // factor * factor
+    return pixels[:height, :width].reshape(height // factor, factor, width // factor, factor).min(axis=(1, 3))
+
+
+def page_ink(pixels: np.ndarray, factor: int, min_component_pixels: int) -> PageInk:
+    small = _downscale(np.asarray(pixels), max(factor, 1))
+    margin_y, margin_x = int(small.shape[0] * _MARGIN_RATIO), int(small.shape[1] * _MARGIN_RATIO)
+    ink = small[margin_y : small.shape[0] - margin_y, margin_x : small.shape[1] - margin_x] < _INK_LEVEL
+    if not ink.any():
+        return PageInk(0.0, 0)
+    labels, _ = ndimage.label(ink)
+    component_sizes = np.bincount(labels.ravel())[1:]
+    return PageInk(float(ink.mean()), int((component_sizes >= min_component_pixels).sum()))
+
+
+def is_blank(pixels: np.ndarray, dpi: int, config: BlankConfig) -> bool:
+    ink = page_ink(pixels, dpi // config.dpi, config.min_component_pixels)
+    return ink.ink_ratio <= config.max_ink_ratio and ink.nb_components <= config.max_components
+
+
+def blank_marker_path(document_id: str, page_nb: int) -> str:
+    return page_output_base(document_id, page_nb) + '.blank'
+
+
+def is_blank_page(document_id: str, page_nb: int) -> bool:
+    return os.path.exists(blank_marker_path(document_id, page_nb))
+
+
+def write_blank_page(
+    document_id: str, page_nb: int, width: int, height: int, output_base: str, renderers: List[str]
+) -> None:
+    templates = {'alto': _ALTO_TEMPLATE, 'hocr': _HOCR_TEMPLATE, 'tsv': _TSV_TEMPLATE, 'txt': ''}
+    if output_base == page_output_base(document_id, page_nb):
+        write_file('', blank_marker_path(document_id, page_nb))
+    for renderer in sorted(renderers, key=lambda renderer: renderer == 'alto'):  # ALTO last: marks the page as done
+        path = f'{output_base}.{RENDERER_EXTENSIONS[renderer]}'
+        if renderer == 'pdf':  # the input page, it has no text to add a layer for
+            extract_page_pdf(document_id, page_nb, path)
+        else:
+            write_file(templates[renderer].format(width=width, height=height), path)
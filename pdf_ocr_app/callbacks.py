@@ -0,0 +1,97 @@
+import ipaddress
+import json
+import os
+import socket
+import time
+import traceback
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+from pdf_ocr_app.config import EnvironmentType, get_config
+from pdf_ocr_app.db import callback_path, load_ocr_page_numbers
+from pdf_ocr_app.index import DocumentStatus
+from pdf_ocr_app.utils import write_json
+
+_NB_ATTEMPTS = 3
+
+
+def _allowed_schemes() -> Tuple[str, ...]:
+    if get_config().environment.type == EnvironmentType.DEV.value:
+        return ('http', 'https', 'file')
+    return ('http', 'https')
+
+
+def _check_public_host(url: str) -> None:
+    # Callbacks are posted from the server: internal services and cloud metadata endpoints must not be reachable.
+    # Local hosts are only allowed in dev environments.
+    if get_config().environment.type == EnvironmentType.DEV.value:
+        return
+    host = urlparse(url).hostname
+    if not host:
+        raise ValueError(f'Missing host in callback url {url}')
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except socket.gaierror:
+        raise ValueError(f'Cannot resolve callback host {host}')
+    if not all(ipaddress.ip_address(address.split('%')[0]).is_global for address in addresses):
+        raise ValueError(f'Callback host {host} is not a public address')
+
+
+def check_callback_url(url: str) -> None:
+    scheme = urlparse(url).scheme
+    if scheme not in _allowed_schemes():
+        raise ValueError(f'Unsupported callback url {url}, expecting a scheme in {_allowed_schemes()}')
+    if scheme in ('http', 'https'):
+        _check_public_host(url)
+
+
+def register_callback(document_id: str, url: str) -> None:
+    check_callback_url(url)
+    write_json({'url': url}, callback_path(document_id))
+
+
+def registered_callback(document_id: str) -> Optional[str]:
+    if not os.path.exists(callback_path(document_id)):
+        return None
+    with open(callback_path(document_id)) as file_:
+        return json.load(file_)['url']
+
+
+def _post(url: str, payload: Dict[str, Any]) -> None:
+    import requests
+
+    _check_public_host(url)  # again: the host may resolve differently than when the callback was registered
+    for attempt in range(_NB_ATTEMPTS):
+        try:
+            requests.post(url, json=payload, timeout=10, allow_redirects=False).raise_for_status()
+            return
+        except requests.RequestException:
+            if attempt == _NB_ATTEMPTS - 1:
+                raise
+            time.sleep(2**attempt)
+
+
+def _append_to_file(path: str, payload: Dict[str, Any]) -> None:
+    # Local stand-in for webhooks, only allowed in dev environments (tests, local runs).
+    with open(path, 'a') as file_:
+        file_.write(json.dumps(payload) + '\n')
+
+
+def send_callback(url: str, payload: Dict[str, Any]) -> None:
+    parsed = urlparse(url)
+    if parsed.scheme == 'file':
+        _append_to_file(parsed.path, payload)
+    else:
+        _post(url, payload)
+
+
+def notify_callback(document_id: str, status: DocumentStatus, step: Dict[str, Any]) -> None:
+    url = registered_callback(document_id)
+    if not url:
+        return
+    pages = load_ocr_page_numbers(document_id)
+    payload = {'document_id': document_id, 'status': status.value, 'step': step, 'pages': pages}
+    try:
+        send_callback(url, payload)
+    except Exception:
+        print(f'Callback to {url} failed:\n{traceback.format_exc()}')
@@ -1,21 +1,31 @@
 import random
 import string
 from dataclasses import asdict, dataclass
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
+
+PageRange = Tuple[int, int]  # (first page, last page excluded), 0-indexed
 
 
 @dataclass
 class OCRProcessingStep:
     messsage: Optional[str]
     advancement: float
-    done: bool
+    done: bool  # results can be displayed
+    complete: bool = True  # every page is processed, done steps may only cover the priority pages
 
     def __post_init__(self) -> None:
         assert 0 <= self.advancement <= 1
+        self.complete = self.done and self.complete
 
     def to_dict(self) -> Dict[str, Any]:
         return asdict(self)
 
+    def to_payload(self) -> Dict[str, Any]:
+        # Stored steps keep the `messsage` key, API clients and callbacks get the correct spelling.
+        payload = self.to_dict()
+        payload['message'] = payload.pop('messsage')
+        return payload
+
     @classmethod
     def from_dict(cls, dict_: Dict[str, Any]) -> 'OCRProcessingStep':
         return cls(**dict_)
@@ -33,3 +43,14 @@ class Document:
     @classmethod
     def new(cls) -> 'Document':
         return cls(document_id=_generate_id(), ocr_processing_step=OCRProcessingStep(None, 0, False))
+
+
+def parse_page_range(text: str) -> PageRange:
+    # User input is 1-indexed and inclusive, e.g. '3-10' or '7'
+    bounds = [bound.strip() for bound in text.split('-')]
+    if len(bounds) not in (1, 2) or not all(bound.isdigit() for bound in bounds):
+        raise ValueError(f'Expecting a page range like 3-10, got {text}')
+    first, last = int(bounds[0]), int(bounds[-1])
+    if first < 1 or last < first:
+        raise ValueError(f'Expecting 1 <= first page <= last page, got {text}')
+    return first - 1, last
@@ -3,9 +3,7 @@ from configparser import ConfigParser
 from dataclasses import dataclass
 from enum import Enum
 from functools import lru_cache
-from typing import Type, TypeVar
-
-from pdf_ocr_app.utils import create_folder_if_inexistent
+from typing import Any, Type, TypeVar
 
 
 class _ConfigError(Exception):
@@ -37,21 +35,46 @@ def _class_name_to_key(class_name: str) -> str:
 T = TypeVar('T')
 
 
+def _cast(value: str, type_: Any) -> Any:
+    if type_ is int:
+        return int(value)
+    if type_ is float:
+        return float(value)
+    if type_ is bool:
+        return value.lower() in ('1', 'true', 'yes')
+    return value
+
+
 def _default_load(cls: Type[T]) -> T:
     name = _class_name_to_key(cls.__name__)
-    kwargs = {key: _get_var(name, key) for key in cls.__dataclass_fields__}  # type: ignore
+    fields = cls.__dataclass_fields__.items()  # type: ignore
+    kwargs = {key: _cast(_get_var(name, key), field.type) for key, field in fields}
     return cls(**kwargs)  # type: ignore
 
 
+class OCRBackend(Enum):
+    TESSERACT = 'tesseract'
+    STUB = 'stub'
+
+
 @dataclass
 class TesseractConfig:
     tessdata_location: str
     models_url_template: str
     lang: str
+    candidate_langs: str
+    detect_language: bool
+    renderers: str
+    backend: str
 
     @classmethod
     def default_load(cls) -> 'TesseractConfig':
-        return _default_load(cls)
+        res = _default_load(cls)
+        values = {x.value for x in OCRBackend}
+        assert (
+            res.backend in values
+        ), f'Unexpecting value {res.backend} for tesseract.backend (expecting value in {values})'
+        return res
 
 
 class EnvironmentType(Enum):
@@ -74,12 +97,135 @@ class EnvironmentConfig:
 @dataclass
 class StorageConfig:
     documents_folder: str
+    local_index_folder: str
 
     @classmethod
     def default_load(cls) -> 'StorageConfig':
         return _default_load(cls)
 
 
+@dataclass
+class JanitorConfig:
+    quota_mb: int
+    ttl_hours: float
+    compress_after_hours: float
+    interval_seconds: int
+
+    @classmethod
+    def default_load(cls) -> 'JanitorConfig':
+        return _default_load(cls)
+
+
+@dataclass
+class PipelineConfig:
+    memory_budget_mb: int
+    ocr_threads: int
+    tesseract_processes: int  # at once per OCR job, shared by pipeline pages, tiles and re-OCR
+
+    @classmethod
+    def default_load(cls) -> 'PipelineConfig':
+        res = _default_load(cls)
+        assert res.tesseract_processes >= res.ocr_threads, 'Expecting pipeline.tesseract_processes >= ocr_threads'
+        return res
+
+
+@dataclass
+class TilingConfig:
+    max_pixels: int
+    tile_size: int
+    overlap: int
+
+    @classmethod
+    def default_load(cls) -> 'TilingConfig':
+        res = _default_load(cls)
+        assert res.overlap < res.tile_size, f'tiling.overlap ({res.overlap}) must be lower than tiling.tile_size'
+        return res
+
+
+@dataclass
+class BlankConfig:
+    enabled: bool
+    dpi: int
+    max_ink_ratio: float
+    max_components: int
+    min_component_pixels: int
+
+    @classmethod
+    def default_load(cls) -> 'BlankConfig':
+        return _default_load(cls)
+
+
+@dataclass
+class ReocrConfig:
+    confidence_threshold: float
+    max_workers: int
+
+    @classmethod
+    def default_load(cls) -> 'ReocrConfig':
+        return _default_load(cls)
+
+
+@dataclass
+class DedupConfig:
+    enabled: bool
+    max_hash_distance: int
+    min_text_similarity: float
+    max_pixel_difference: float
+
+    @classmethod
+    def default_load(cls) -> 'DedupConfig':
+        return _default_load(cls)
+
+
+class ProfilingMode(Enum):
+    OFF = 'off'
+    SAMPLING = 'sampling'
+    CPROFILE = 'cprofile'
+
+
+@dataclass
+class ProfilingConfig:
+    mode: str
+    sampling_interval_ms: float
+
+    @classmethod
+    def default_load(cls) -> 'ProfilingConfig':
+        res = _default_load(cls)
+        values = {x.value for x in ProfilingMode}
+        assert res.mode in values, f'Unexpecting value {res.mode} for profiling.mode (expecting value in {values})'
+        return res
+
+
+class WorkersMode(Enum):
+    LOCAL = 'local'
+    SHARED = 'shared'
+
+
+@dataclass
+class WorkersConfig:
+    mode: str
+    pages_per_task: int
+    lease_seconds: float
+    poll_seconds: float
+
+    @classmethod
+    def default_load(cls) -> 'WorkersConfig':
+        res = _default_load(cls)
+        values = {x.value for x in WorkersMode}
+        assert res.mode in values, f'Unexpecting value {res.mode} for workers.mode (expecting value in {values})'
+        return res
+
+
+@dataclass
+class ApiConfig:
+    input_folder: str
+    max_upload_mb: int
+
+    @classmethod
+    def default_load(cls) -> 'ApiConfig':
+        return _default_load(cls)
+
+
 @dataclass
 class AppConfig:
     assets_folder: str
@@ -94,6 +240,15 @@ class Config:
     tesseract: TesseractConfig
     environment: EnvironmentConfig
     storage: StorageConfig
+    janitor: JanitorConfig
+    workers: WorkersConfig
+    pipeline: PipelineConfig
+    blank: BlankConfig
+    tiling: TilingConfig
+    reocr: ReocrConfig
+    dedup: DedupConfig
+    profiling: ProfilingConfig
+    api: ApiConfig
     app: AppConfig
 
     @classmethod
@@ -111,7 +266,6 @@ def load_config() -> ConfigParser:
     return parser
 
 
-CONFIG = Config.default_load()
-
-
-create_folder_if_inexistent(CONFIG.storage.documents_folder)
+@lru_cache
+def get_config() -> Config:
+    return Config.default_load()
@@ -1,21 +1,47 @@
+import gzip
+import hashlib
 import json
 import os
+import re
 import shutil
-from typing import List, Union
+import subprocess
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from typing import IO, TYPE_CHECKING, Iterable, List, Optional, Union
+
+from pdf_ocr_app import index
+from pdf_ocr_app.compute import OCRProcessingStep, PageRange
+from pdf_ocr_app.config import get_config
+from pdf_ocr_app.index import DocumentStatus
+from pdf_ocr_app.utils import create_folder_if_inexistent, safely_replace_path_suffix, write_json
 
-import alto
-import requests
-from ocr_utils.alto_to_svg import alto_pages_and_cells_to_svg
+if TYPE_CHECKING:
+    import alto
 
-from pdf_ocr_app.compute import OCRProcessingStep
-from pdf_ocr_app.config import CONFIG
-from pdf_ocr_app.utils import create_folder_if_inexistent, safely_replace_path_suffix, write_json
+RENDERER_EXTENSIONS = {'alto': 'xml', 'hocr': 'hocr', 'tsv': 'tsv', 'txt': 'txt', 'pdf': 'pdf'}
+_COMPRESSIBLE_EXTENSIONS = ('.xml', '.svg', '.txt', '.hocr', '.tsv')
+_COMPRESSED_SUFFIX = '.gz'
+_SHARD_LENGTH = 2
+_SHARD_DEPTH = 2
+_PDFUNITE_BATCH_SIZE = 200  # pdfunite keeps every input open, and argv is bounded
+
+
+def documents_folder() -> str:
+    return get_config().storage.documents_folder
 
-_DOCS_FOLDER = CONFIG.storage.documents_folder
+
+def _shards(document_id: str) -> List[str]:
+    return [document_id[i * _SHARD_LENGTH : (i + 1) * _SHARD_LENGTH] for i in range(_SHARD_DEPTH)]
 
 
 def _document_folder(document_id: str) -> str:
-    return os.path.join(_DOCS_FOLDER, document_id)
+    return os.path.join(documents_folder(), *_shards(document_id), document_id)
+
+
+def _create_document_folder(document_id: str) -> None:
+    create_folder_if_inexistent(pages_folder(document_id))
+    create_folder_if_inexistent(leases_folder(document_id))
 
 
 def _step_path(document_id: str) -> str:
@@ -30,10 +56,220 @@ def alto_xml_path(document_id: str) -> str:
     return os.path.join(_document_folder(document_id), 'out.xml')
 
 
+def _ocr_page_numbers_path(document_id: str) -> str:
+    return os.path.join(_document_folder(document_id), 'pages.json')
+
+
+def _nb_pages_path(document_id: str) -> str:
+    return os.path.join(_document_folder(document_id), 'nb_pages')
+
+
+def callback_path(document_id: str) -> str:
+    return os.path.join(_document_folder(document_id), 'callback.json')
+
+
 def svg_path(document_id: str) -> str:
     return os.path.join(_document_folder(document_id), 'out.svg')
 
 
+def text_path(document_id: str) -> str:
+    return os.path.join(_document_folder(document_id), 'out.txt')
+
+
+def searchable_pdf_path(document_id: str) -> str:
+    return os.path.join(_document_folder(document_id), 'out.pdf')
+
+
+def pages_folder(document_id: str) -> str:
+    return os.path.join(_document_folder(document_id), 'pages')
+
+
+def page_output_base(document_id: str, page_nb: int) -> str:
+    return os.path.join(pages_folder(document_id), str(page_nb))
+
+
+def page_output_path(document_id: str, page_nb: int, renderer: str) -> str:
+    if renderer not in RENDERER_EXTENSIONS:
+        raise ValueError(f'Unknown renderer {renderer}, expecting one of {list(RENDERER_EXTENSIONS)}')
+    return page_output_base(document_id, page_nb) + '.' + RENDERER_EXTENSIONS[renderer]
+
+
+def leases_folder(document_id: str) -> str:
+    return os.path.join(_document_folder(document_id), 'leases')
+
+
+def background_lease_path(document_id: str) -> str:
+    return os.path.join(leases_folder(document_id), 'background.lease')
+
+
+def profiles_folder(document_id: str) -> str:
+    return os.path.join(_document_folder(document_id), 'profiles')
+
+
+def _queue_folder() -> str:
+    return os.path.join(documents_folder(), '_queue')
+
+
+def enqueue_document(document_id: str, priority_range: Optional[PageRange] = None) -> None:
+    # The queue file holds the pages to OCR first, if any, as `first-last`.
+    create_folder_if_inexistent(_queue_folder())
+    content = f'{priority_range[0]}-{priority_range[1]}' if priority_range else ''
+    write_file(content, os.path.join(_queue_folder(), document_id))
+
+
+def queued_priority_range(document_id: str) -> Optional[PageRange]:
+    try:
+        with open(os.path.join(_queue_folder(), document_id)) as file_:
+            content = file_.read()
+    except FileNotFoundError:
+        return None
+    if not content:
+        return None
+    first, last = content.split('-')
+    return int(first), int(last)
+
+
+def dequeue_document(document_id: str) -> None:
+    try:
+        os.remove(os.path.join(_queue_folder(), document_id))
+    except FileNotFoundError:
+        pass
+
+
+def queued_document_ids() -> List[str]:
+    if not os.path.exists(_queue_folder()):
+        return []
+    return sorted(os.listdir(_queue_folder()))
+
+
+def _access_path(document_id: str) -> str:
+    return os.path.join(_document_folder(document_id), 'access')
+
+
+def touch_document(document_id: str) -> None:
+    path = _access_path(document_id)
+    with open(path, 'a'):
+        os.utime(path, None)
+    with index.transaction() as connection:
+        index.update_document(connection, document_id, last_access=os.path.getmtime(path))
+
+
+def _subfolders(folder: str) -> List[str]:
+    if not os.path.exists(folder):
+        return []
+    return [name for name in os.listdir(folder) if os.path.isdir(os.path.join(folder, name))]
+
+
+def _list_sharded_folders(folder: str, depth: int) -> List[str]:
+    if depth == 0:
+        return _subfolders(folder)
+    shards = [name for name in _subfolders(folder) if len(name) == _SHARD_LENGTH]
+    return [name for shard in shards for name in _list_sharded_folders(os.path.join(folder, shard), depth - 1)]
+
+
+def list_document_ids() -> List[str]:
+    return _list_sharded_folders(documents_folder(), _SHARD_DEPTH)
+
+
+def _document_files(document_id: str) -> List[str]:
+    return [
+        os.path.join(root, filename)
+        for root, _, filenames in os.walk(_document_folder(document_id))
+        for filename in filenames
+    ]
+
+
+def document_size(document_id: str) -> int:
+    return sum(os.path.getsize(path) for path in _document_files(document_id) if os.path.exists(path))
+
+
+def document_last_access(document_id: str) -> float:
+    # Not the folder mtime: compressing or rewriting outputs would make the document look recently used.
+    paths = [input_pdf_path(document_id), _access_path(document_id), _step_path(document_id)]
+    return max([os.path.getmtime(path) for path in paths if os.path.exists(path)], default=0.0)
+
+
+def update_document_size(document_id: str) -> int:
+    size = document_size(document_id)
+    with index.transaction() as connection:
+        index.update_document(connection, document_id, size=size)
+    return size
+
+
+def delete_document(document_id: str) -> None:
+    # The index lock is not held while removing files: the document is unknown once the row is deleted.
+    with index.transaction() as connection:
+        index.delete_document(connection, document_id)
+    shutil.rmtree(_document_folder(document_id), ignore_errors=True)
+
+
+def _compress_file(path: str) -> None:
+    tmp_path = f'{path}{_COMPRESSED_SUFFIX}.{uuid.uuid4().hex}.tmp'
+    with open(path, 'rb') as input_, gzip.open(tmp_path, 'wb') as output:
+        shutil.copyfileobj(input_, output)
+    os.replace(tmp_path, path + _COMPRESSED_SUFFIX)
+    os.remove(path)
+
+
+def compress_artifacts(document_id: str) -> int:
+    to_compress = [path for path in _document_files(document_id) if path.endswith(_COMPRESSIBLE_EXTENSIONS)]
+    for path in to_compress:
+        _compress_file(path)
+    return len(to_compress)
+
+
+def compressed_artifact_path(path: str) -> Optional[str]:
+    # The uncompressed file, if any, is the up-to-date one: outputs are rewritten uncompressed.
+    if os.path.exists(path) or not os.path.exists(path + _COMPRESSED_SUFFIX):
+        return None
+    return path + _COMPRESSED_SUFFIX
+
+
+def read_artifact(path: str) -> bytes:
+    # Without decompressing it on disk, for request handlers.
+    compressed_path = compressed_artifact_path(path)
+    if not compressed_path:
+        with open(path, 'rb') as file_:
+            return file_.read()
+    with gzip.open(compressed_path, 'rb') as compressed_file:
+        return compressed_file.read()
+
+
+def artifact_exists(path: str) -> bool:
+    return os.path.exists(path) or os.path.exists(path + _COMPRESSED_SUFFIX)
+
+
+def copy_artifact(source: str, destination: str) -> None:
+    for suffix in ('', _COMPRESSED_SUFFIX):
+        if os.path.exists(source + suffix):
+            tmp_path = f'{destination}{suffix}.{os.getpid()}.tmp'
+            shutil.copyfile(source + suffix, tmp_path)
+            os.replace(tmp_path, destination + suffix)
+            return
+    raise FileNotFoundError(source)
+
+
+def decompress_if_needed(path: str) -> str:
+    compressed_path = path + _COMPRESSED_SUFFIX
+    if os.path.exists(path) or not os.path.exists(compressed_path):
+        return path
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'  # requests and workers may decompress the same file concurrently
+    try:
+        with gzip.open(compressed_path, 'rb') as input_, open(tmp_path, 'wb') as output:
+            shutil.copyfileobj(input_, output)
+    except FileNotFoundError:
+        # Decompressed by someone else, who removed the compressed file once done, or compressed again meanwhile.
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return decompress_if_needed(path)
+    os.replace(tmp_path, path)
+    try:
+        os.remove(compressed_path)
+    except FileNotFoundError:
+        pass
+    return path
+
+
 def _load_json(path: str):
     with open(path, 'r') as file_:
         return json.load(file_)
@@ -48,36 +284,191 @@ def has_processing_step(document_id: str) -> bool:
 
 
 def dump_processing_step(step: OCRProcessingStep, document_id: str):
-    return write_json(step.to_dict(), _step_path(document_id))
+    # Processing counts as an access: the janitor must not evict documents being worked on.
+    size = document_size(document_id) if step.complete else None  # walks the folder, out of the index lock
+    with index.transaction() as connection:
+        if step.complete:
+            index.update_document(
+                connection, document_id, status=DocumentStatus.DONE, size=size, last_access=time.time()
+            )
+        else:
+            index.update_document(connection, document_id, status=DocumentStatus.PROCESSING, last_access=time.time())
+        return write_json(step.to_dict(), _step_path(document_id))
+
+
+def mark_document_failed(document_id: str, message: str) -> None:
+    from pdf_ocr_app.callbacks import notify_callback  # callbacks read the document folder through this module
+
+    # Not processing anymore for the janitor, and never done: no outputs to show.
+    step = OCRProcessingStep(message, 1.0, False)
+    with index.transaction() as connection:
+        index.update_document(connection, document_id, status=DocumentStatus.FAILED)
+        write_json(step.to_dict(), _step_path(document_id))
+    notify_callback(document_id, DocumentStatus.FAILED, step.to_payload())
+
+
+def record_nb_pages(document_id: str, nb_pages: int) -> None:
+    # Also in the document folder: with shared workers, the index of the node counting pages is not the API's one.
+    write_file(str(nb_pages), _nb_pages_path(document_id))
+    with index.transaction() as connection:
+        index.update_document(connection, document_id, nb_pages=nb_pages)
+
+
+def load_nb_pages(document_id: str) -> Optional[int]:
+    metadata = index.get_document(document_id)
+    if metadata and metadata.nb_pages:
+        return metadata.nb_pages
+    if not os.path.exists(_nb_pages_path(document_id)):
+        return None
+    with open(_nb_pages_path(document_id)) as file_:
+        return int(file_.read())
+
+
+def is_document_complete(document_id: str) -> bool:
+    # Outputs of complete documents are not rewritten anymore.
+    if not has_processing_step(document_id) or not load_processing_step(document_id).complete:
+        return False
+    nb_pages = load_nb_pages(document_id)
+    return bool(nb_pages and len(load_ocr_page_numbers(document_id)) == nb_pages)
 
 
 def load_alto_pages_xml(document_id: str) -> List[str]:
-    return _load_json(alto_xml_path(document_id))
+    return _load_json(decompress_if_needed(alto_xml_path(document_id)))
+
+
+def has_page_alto_xml(document_id: str, page_nb: int) -> bool:
+    return artifact_exists(page_output_path(document_id, page_nb, 'alto'))
+
+
+def load_ocr_page_numbers(document_id: str) -> List[int]:
+    if not os.path.exists(_ocr_page_numbers_path(document_id)):
+        if not artifact_exists(alto_xml_path(document_id)):
+            return []  # not processed yet, or failed
+        return list(range(len(load_alto_pages_xml(document_id))))
+    return _load_json(_ocr_page_numbers_path(document_id))
+
+
+def dump_ocr_page_numbers(page_nbs: List[int], document_id: str) -> None:
+    write_json(page_nbs, _ocr_page_numbers_path(document_id))
 
 
-def dump_alto_pages_xml(xml: List[str], document_id: str) -> None:
-    write_json(xml, alto_xml_path(document_id))
+def load_page_alto_xml(document_id: str, page_nb: int) -> str:
+    with open(decompress_if_needed(page_output_path(document_id, page_nb, 'alto'))) as file_:
+        return file_.read()
 
 
-def dump_svg(xml: List[str], document_id: str) -> None:
-    alto_pages_and_cells_to_svg(xml, [[]]).saveas(svg_path(document_id))
+def dump_alto_pages_xml(xml: Iterable[str], document_id: str) -> None:
+    # Written page by page so that large documents are never held in memory at once.
+    path = alto_xml_path(document_id)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as file_:
+        file_.write('[')
+        for page_index, page in enumerate(xml):
+            file_.write((',\n' if page_index else '\n') + json.dumps(page))
+        file_.write('\n]')
+    os.replace(tmp_path, path)
 
 
-def _ensure_one_page_and_get_it(alto_file: alto.Alto) -> alto.Page:
+def render_page_svg(alto_xml: str) -> str:
+    from ocr_utils.alto_to_svg import alto_pages_and_cells_to_svg
+
+    return alto_pages_and_cells_to_svg([alto_xml], [[]]).tostring()
+
+
+def _svg_length(value: Optional[str]) -> float:
+    match = re.match(r'[\d.]+', value or '')
+    return float(match.group()) if match else 0.0
+
+
+def dump_svg(xml: Iterable[str], document_id: str) -> None:
+    # Pages are rendered one at a time and stacked vertically; the body is spooled to disk because the
+    # document size, needed in the root element, is only known once every page is rendered.
+    path = svg_path(document_id)
+    body_path = f'{path}.{os.getpid()}.body'
+    width, height = 0.0, 0.0
+    with open(body_path, 'w') as body:
+        for page in xml:
+            page_svg = re.sub(r'^<\?xml[^>]*\?>\s*', '', render_page_svg(page))
+            root = ET.fromstring(page_svg)
+            body.write(f'<g transform="translate(0,{height:g})">{page_svg}</g>\n')
+            width, height = max(width, _svg_length(root.get('width'))), height + _svg_length(root.get('height'))
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as output, open(body_path) as body:
+        output.write('<?xml version="1.0" encoding="utf-8" ?>\n')
+        output.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:g}" height="{height:g}">\n')
+        shutil.copyfileobj(body, output)
+        output.write('</svg>\n')
+    os.remove(body_path)
+    os.replace(tmp_path, path)
+
+
+def dump_text(document_id: str, page_nbs: List[int]) -> None:
+    from pdf_ocr_app.layout import alto_page_text
+
+    # Built from ALTO rather than tesseract text outputs, which interleave columns.
+    with open(text_path(document_id), 'w') as output:
+        for page_nb in page_nbs:
+            output.write(alto_page_text(load_page_alto_xml(document_id, page_nb)))
+
+
+def _pdfunite(paths: List[str], output_path: str) -> None:
+    if len(paths) == 1:
+        shutil.copyfile(paths[0], output_path)
+    else:
+        subprocess.run(['pdfunite', *paths, output_path], check=True)
+
+
+def _unite_pdfs(paths: List[str], output_path: str) -> None:
+    # Large documents are merged by batches, then batches are merged, and so on.
+    tmp_paths: List[str] = []
+    try:
+        while len(paths) > _PDFUNITE_BATCH_SIZE:
+            batches = [
+                paths[start : start + _PDFUNITE_BATCH_SIZE] for start in range(0, len(paths), _PDFUNITE_BATCH_SIZE)
+            ]
+            paths = [f'{output_path}.{len(tmp_paths) + batch_nb}.tmp' for batch_nb in range(len(batches))]
+            tmp_paths += paths
+            for batch, batch_path in zip(batches, paths):
+                _pdfunite(batch, batch_path)
+        _pdfunite(paths, output_path)
+    finally:
+        for tmp_path in tmp_paths:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def dump_searchable_pdf(document_id: str, page_nbs: List[int]) -> None:
+    path = searchable_pdf_path(document_id)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    _unite_pdfs([page_output_path(document_id, page_nb, 'pdf') for page_nb in page_nbs], tmp_path)
+    os.replace(tmp_path, path)
+
+
+def extract_page_pdf(document_id: str, page_nb: int, path: str) -> None:
+    cmd = ['pdfseparate', '-f', str(page_nb + 1), '-l', str(page_nb + 1), input_pdf_path(document_id), path]
+    subprocess.run(cmd, check=True, capture_output=True)
+
+
+def _ensure_one_page_and_get_it(alto_file: 'alto.Alto') -> 'alto.Page':
     if len(alto_file.layout.pages) != 1:
         raise ValueError(f'Expecting exactly one page, got {len(alto_file.layout.pages)}')
     return alto_file.layout.pages[0]
 
 
-def load_alto_pages(document_id: str) -> List[alto.Page]:
+def load_alto_pages(document_id: str) -> List['alto.Page']:
+    import alto
+
     step = load_processing_step(document_id)
     if not step.done:
         raise ValueError(f'Cannot load alto pages: processing not done yet. (OCRProcessingStep={step})')
+    touch_document(document_id)
     pages = load_alto_pages_xml(document_id)
     return [_ensure_one_page_and_get_it(alto.parse(page)) for page in pages]
 
 
 def download_document(url: str, output_filename: str) -> None:
+    import requests
+
     req = requests.get(url, stream=True)
     if req.status_code == 200:
         with open(output_filename, 'wb') as f:
@@ -99,21 +490,83 @@ def load_sample_documents() -> List[str]:
 
 
 def write_file(content: Union[bytes, str], path: str) -> None:
+    # Readers never see a partially written file. Threads of a process share the pid, hence the uuid.
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
     if isinstance(content, str):
-        with open(path, 'w') as file_:
+        with open(tmp_path, 'w') as file_:
             file_.write(content)
-        return
-    with open(path, 'wb') as file_b_:
-        file_b_.write(content)
+    else:
+        with open(tmp_path, 'wb') as file_b_:
+            file_b_.write(content)
+    os.replace(tmp_path, path)
+
+
+def _copy_and_hash(input_: IO[bytes], output: IO[bytes], max_size: Optional[int] = None) -> str:
+    hash_ = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: input_.read(1024 * 1024), b''):
+        size += len(chunk)
+        if max_size is not None and size > max_size:
+            raise ValueError(f'File is too large, expecting at most {max_size} bytes')
+        hash_.update(chunk)
+        output.write(chunk)
+    return hash_.hexdigest()
+
+
+def file_sha256(path: str) -> str:
+    with open(path, 'rb') as input_, open(os.devnull, 'wb') as output:
+        return _copy_and_hash(input_, output)
+
+
+def _index_new_document(document_id: str, sha256: str) -> None:
+    with index.transaction() as connection:
+        index.upsert_document(connection, document_id, DocumentStatus.UPLOADED, sha256, document_size(document_id))
 
 
 def save_document(content: Union[bytes, str], document_id: str) -> None:
-    create_folder_if_inexistent(_document_folder(document_id))
+    _create_document_folder(document_id)
     path = input_pdf_path(document_id)
     write_file(content, path)
+    content_bytes = content.encode() if isinstance(content, str) else content
+    _index_new_document(document_id, hashlib.sha256(content_bytes).hexdigest())
+
+
+def save_document_stream(stream: IO[bytes], document_id: str, max_size: Optional[int] = None) -> None:
+    # Request bodies may be chunked, without a Content-Length to check beforehand.
+    _create_document_folder(document_id)
+    try:
+        with open(input_pdf_path(document_id), 'wb') as output:
+            sha256 = _copy_and_hash(stream, output, max_size)
+    except ValueError:
+        shutil.rmtree(_document_folder(document_id), ignore_errors=True)
+        raise
+    _index_new_document(document_id, sha256)
 
 
 def copy_pdf(input_path: str, document_id: str) -> None:
-    create_folder_if_inexistent(_document_folder(document_id))
+    _create_document_folder(document_id)
     dest_path = input_pdf_path(document_id)
-    shutil.copyfile(input_path, dest_path)
+    with open(input_path, 'rb') as input_, open(dest_path, 'wb') as output:
+        sha256 = _copy_and_hash(input_, output)
+    _index_new_document(document_id, sha256)
+
+
+def _status_from_folder(document_id: str) -> DocumentStatus:
+    if not has_processing_step(document_id):
+        return DocumentStatus.UPLOADED
+    return DocumentStatus.DONE if load_processing_step(document_id).complete else DocumentStatus.PROCESSING
+
+
+def migrate_flat_folders() -> List[str]:
+    root = documents_folder()
+    flat_ids = [name for name in _subfolders(root) if len(name) > _SHARD_LENGTH and name.isalpha()]
+    for document_id in flat_ids:
+        create_folder_if_inexistent(os.path.dirname(_document_folder(document_id)))
+        os.rename(os.path.join(root, document_id), _document_folder(document_id))
+        input_path = input_pdf_path(document_id)
+        sha256 = file_sha256(input_path) if os.path.exists(input_path) else None
+        created_at = os.path.getmtime(_document_folder(document_id))
+        with index.transaction() as connection:
+            status, size = _status_from_folder(document_id), document_size(document_id)
+            index.upsert_document(connection, document_id, status, sha256, size, created_at)
+    return flat_ids
@@ -0,0 +1,248 @@
+# Near-duplicate pages detection before OCR. Pages are fingerprinted (dHash of a thumbnail, MinHash of the text
+# layer) and indexed by LSH bands in the SQLite index, so that finding candidates is an indexed lookup whatever the
+# size of the store. Candidates are verified before their OCR outputs are copied. Blank pages are left out of the
+# index: they all look alike, and the blank page detection handles them without OCR anyway.
+import re
+import subprocess
+import zlib
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy import ndimage
+
+from pdf_ocr_app import index
+from pdf_ocr_app.blank import is_blank
+from pdf_ocr_app.config import get_config
+from pdf_ocr_app.db import (
+    RENDERER_EXTENSIONS,
+    artifact_exists,
+    copy_artifact,
+    has_page_alto_xml,
+    input_pdf_path,
+    page_output_base,
+    page_output_path,
+)
+
+_THUMBNAIL_DPI = 30
+_VERIFICATION_DPI = 100
+_MAX_SHIFT = 2  # rescans are rarely registered to the pixel
+_CHUNK_SIZE = 50
+_MAX_CANDIDATES = 10
+_DHASH_SHAPE = (8, 9)
+_DHASH_CHUNK_BITS = 16  # any two hashes within 3 bits share one of the 4 chunks
+_NB_PERMUTATIONS = 64
+_ROWS_PER_BAND = 4
+_SHINGLE_SIZE = 3
+_MIN_SHINGLES = 20
+_MINHASH_PREFILTER_MARGIN = 0.1
+_PRIME = (1 << 61) - 1
+_RANDOM = np.random.RandomState(0)  # permutations must be stable across processes and releases
+_PERMUTATION_A = _RANDOM.randint(1, 1 << 29, _NB_PERMUTATIONS).astype(np.int64)
+_PERMUTATION_B = _RANDOM.randint(0, 1 << 29, _NB_PERMUTATIONS).astype(np.int64)
+_WORD = re.compile(r'\w+')
+_EXTRA_SUFFIXES = ('lang', 'reviewed', 'blank', 'tiled')
+
+PageRef = Tuple[str, int]
+
+
+@dataclass
+class PageFingerprint:
+    page_nb: int
+    dhash: int
+    minhash: Optional[np.ndarray]
+    text: str
+    blank: bool = False
+
+
+def _grid_means(pixels: np.ndarray, nb_rows: int, nb_columns: int) -> np.ndarray:
+    row_starts = np.linspace(0, pixels.shape[0], nb_rows, endpoint=False).astype(int)
+    column_starts = np.linspace(0, pixels.shape[1], nb_columns, endpoint=False).astype(int)
+    sums = np.add.reduceat(np.add.reduceat(pixels, row_starts, axis=0), column_starts, axis=1)
+    row_sizes = np.diff(np.append(row_starts, pixels.shape[0]))
+    column_sizes = np.diff(np.append(column_starts, pixels.shape[1]))
+    return sums / np.outer(row_sizes, column_sizes)
+
+
+def dhash(pixels: np.ndarray) -> int:
+    grid = _grid_means(np.asarray(pixels, dtype=float), *_DHASH_SHAPE)
+    bits = grid[:, 1:] > grid[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def _shingles(text: str) -> List[str]:
+    words = _WORD.findall(text.lower())
+    return [' '.join(words[i : i + _SHINGLE_SIZE]) for i in range(len(words) - _SHINGLE_SIZE + 1)]
+
+
+def minhash(text: str) -> Optional[np.ndarray]:
+    shingles = set(_shingles(text))
+    if len(shingles) < _MIN_SHINGLES:
+        return None
+    hashes = np.array([zlib.crc32(shingle.encode()) for shingle in shingles], dtype=np.int64)
+    return ((np.outer(hashes, _PERMUTATION_A) + _PERMUTATION_B) % _PRIME).min(axis=0)
+
+
+def bands(fingerprint: PageFingerprint) -> List[str]:
+    mask = (1 << _DHASH_CHUNK_BITS) - 1
+    keys = [f'd{i}:{(fingerprint.dhash >> (_DHASH_CHUNK_BITS * i)) & mask:04x}' for i in range(64 // _DHASH_CHUNK_BITS)]
+    if fingerprint.minhash is not None:
+        rows = fingerprint.minhash.reshape(-1, _ROWS_PER_BAND)
+        keys += [f'm{i}:{zlib.crc32(row.tobytes()):08x}' for i, row in enumerate(rows)]
+    return keys
+
+
+def _text_layer(pdf_path: str, first_page: int, last_page: int) -> List[str]:
+    cmd = ['pdftotext', '-f', str(first_page + 1), '-l', str(last_page), pdf_path, '-']
+    pages = subprocess.run(cmd, capture_output=True, text=True).stdout.split('\f')
+    nb_pages = last_page - first_page
+    return (pages + [''] * nb_pages)[:nb_pages]
+
+
+def _thumbnails(pdf_path: str, first_page: int, last_page: int, dpi: int) -> List[np.ndarray]:
+    from pdf2image import convert_from_path
+
+    images = convert_from_path(pdf_path, dpi=dpi, first_page=first_page + 1, last_page=last_page, grayscale=True)
+    return [np.asarray(image, dtype=float) for image in images]
+
+
+def _fingerprint(page_nb: int, thumbnail: np.ndarray, text: str) -> PageFingerprint:
+    signature = minhash(text)
+    blank = signature is None and is_blank(thumbnail, _THUMBNAIL_DPI, get_config().blank)
+    return PageFingerprint(page_nb, dhash(thumbnail), signature, text, blank)
+
+
+def fingerprint_pages(document_id: str, first_page: int, last_page: int) -> List[PageFingerprint]:
+    pdf_path = input_pdf_path(document_id)
+    thumbnails = _thumbnails(pdf_path, first_page, last_page, _THUMBNAIL_DPI)
+    texts = _text_layer(pdf_path, first_page, last_page)
+    return [
+        _fingerprint(page_nb, thumbnail, text)
+        for page_nb, thumbnail, text in zip(range(first_page, last_page), thumbnails, texts)
+    ]
+
+
+def _has_outputs(page: PageRef, renderers: List[str]) -> bool:
+    return all(artifact_exists(page_output_path(*page, renderer)) for renderer in renderers)
+
+
+def _similar_texts(text: str, page: PageRef) -> bool:
+    import textdistance
+
+    other_text = _text_layer(input_pdf_path(page[0]), page[1], page[1] + 1)[0]
+    similarity = textdistance.jaccard.normalized_similarity(_shingles(text), _shingles(other_text))
+    return similarity >= get_config().dedup.min_text_similarity
+
+
+def _aligned(ink: np.ndarray, other_ink: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    height, width = ink.shape
+    cropped = other_ink[_MAX_SHIFT : height - _MAX_SHIFT, _MAX_SHIFT : width - _MAX_SHIFT]
+    shifted = (
+        ink[_MAX_SHIFT + dy : height - _MAX_SHIFT + dy, _MAX_SHIFT + dx : width - _MAX_SHIFT + dx]
+        for dy in range(-_MAX_SHIFT, _MAX_SHIFT + 1)
+        for dx in range(-_MAX_SHIFT, _MAX_SHIFT + 1)
+    )
+    return min(shifted, key=lambda candidate: np.count_nonzero(candidate != cropped)), cropped
+
+
+def pixel_difference(pixels: np.ndarray, other_pixels: np.ndarray) -> float:
+    # Share of ink pixels without ink nearby in the other page, once pages are aligned. Rescans differ by stroke
+    # weight, speckles and edges flipped by sensor noise, which the tolerance and the opening remove; a changed
+    # date or amount leaves blobs of several pixels.
+    ink, other_ink = _aligned(np.asarray(pixels) < 128, np.asarray(other_pixels) < 128)
+    difference = (ink & ~ndimage.binary_dilation(other_ink)) | (other_ink & ~ndimage.binary_dilation(ink))
+    return float(ndimage.binary_opening(difference, np.ones((2, 2), bool)).mean())
+
+
+def _same_pixels(page: PageRef, other_page: PageRef) -> bool:
+    pixels, other_pixels = [
+        _thumbnails(input_pdf_path(document_id), page_nb, page_nb + 1, _VERIFICATION_DPI)[0]
+        for document_id, page_nb in (page, other_page)
+    ]
+    if pixels.shape != other_pixels.shape:
+        return False
+    return pixel_difference(pixels, other_pixels) <= get_config().dedup.max_pixel_difference
+
+
+def _is_duplicate(document_id: str, fingerprint: PageFingerprint, candidate, renderers: List[str]) -> bool:
+    config = get_config().dedup
+    page = (candidate['document_id'], candidate['page_nb'])
+    if bin(fingerprint.dhash ^ int(candidate['dhash'], 16)).count('1') > config.max_hash_distance:
+        return False
+    if (fingerprint.minhash is None) != (candidate['minhash'] is None):
+        return False  # only one of the pages has a text layer
+    if fingerprint.minhash is not None:
+        estimate = float(np.mean(fingerprint.minhash == np.frombuffer(candidate['minhash'], dtype=np.int64)))
+        if estimate < config.min_text_similarity - _MINHASH_PREFILTER_MARGIN:
+            return False
+        if not _similar_texts(fingerprint.text, page):
+            return False
+    # Thumbnails and text layers match; only rendered pixels tell if e.g. a date was changed in a scan.
+    return _has_outputs(page, renderers) and _same_pixels((document_id, fingerprint.page_nb), page)
+
+
+def _copy_page_outputs(source: PageRef, destination: PageRef) -> bool:
+    source_base, destination_base = page_output_base(*source), page_output_base(*destination)
+    extensions = [extension for renderer, extension in RENDERER_EXTENSIONS.items() if renderer != 'alto']
+    extensions += [*_EXTRA_SUFFIXES, RENDERER_EXTENSIONS['alto']]  # ALTO last: it marks the page as processed
+    try:
+        for extension in extensions:
+            if artifact_exists(f'{source_base}.{extension}'):
+                copy_artifact(f'{source_base}.{extension}', f'{destination_base}.{extension}')
+    except FileNotFoundError:  # source document deleted in the meantime
+        return False
+    return True
+
+
+def _index_and_find_candidates(document_id: str, fingerprints: List[PageFingerprint]) -> Dict[int, List]:
+    with index.transaction() as connection:
+        candidates = {
+            fingerprint.page_nb: index.find_candidate_pages(
+                connection, bands(fingerprint), document_id, _MAX_CANDIDATES
+            )
+            for fingerprint in fingerprints
+        }
+        for fingerprint in fingerprints:
+            minhash_bytes = fingerprint.minhash.tobytes() if fingerprint.minhash is not None else None
+            dhash_hex = f'{fingerprint.dhash:016x}'
+            index.upsert_page_fingerprint(
+                connection, document_id, fingerprint.page_nb, dhash_hex, minhash_bytes, bands(fingerprint)
+            )
+    return candidates
+
+
+def _reuse_page(
+    document_id: str, fingerprint: PageFingerprint, candidates: List, renderers: List[str]
+) -> Optional[PageRef]:
+    for candidate in candidates:
+        source = (candidate['document_id'], candidate['page_nb'])
+        if not _is_duplicate(document_id, fingerprint, candidate, renderers):
+            continue
+        if _copy_page_outputs(source, (document_id, fingerprint.page_nb)):
+            return source
+    return None
+
+
+def _page_chunks(page_nbs: List[int]) -> List[Tuple[int, int]]:
+    # Runs of consecutive pages, pdftoppm and pdftotext take page ranges.
+    chunks: List[List[int]] = []
+    for page_nb in sorted(set(page_nbs)):
+        if chunks and chunks[-1][1] == page_nb and page_nb - chunks[-1][0] < _CHUNK_SIZE:
+            chunks[-1][1] = page_nb + 1
+        else:
+            chunks.append([page_nb, page_nb + 1])
+    return [(first_page, last_page) for first_page, last_page in chunks]
+
+
+def reuse_duplicate_pages(document_id: str, page_nbs: List[int], renderers: List[str]) -> Dict[int, PageRef]:
+    # Pages already processed were fingerprinted before their OCR, or reused.
+    reused: Dict[int, PageRef] = {}
+    to_process = [page_nb for page_nb in page_nbs if not has_page_alto_xml(document_id, page_nb)]
+    for first_page, last_page in _page_chunks(to_process):
+        fingerprints = [x for x in fingerprint_pages(document_id, first_page, last_page) if not x.blank]
+        candidates = _index_and_find_candidates(document_id, fingerprints)
+        for fingerprint in fingerprints:
+            source = _reuse_page(document_id, fingerprint, candidates[fingerprint.page_nb], renderers)
+            if source:
+                reused[fingerprint.page_nb] = source
+    return reused
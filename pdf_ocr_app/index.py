@@ -0,0 +1,208 @@
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from enum import Enum
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional
+
+from pdf_ocr_app.config import WorkersMode, get_config
+from pdf_ocr_app.utils import create_folder_if_inexistent
+
+_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS documents (
+        document_id TEXT PRIMARY KEY,
+        sha256 TEXT,
+        nb_pages INTEGER,
+        status TEXT NOT NULL,
+        size INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        last_access REAL NOT NULL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS documents_status ON documents (status, updated_at)',
+    'CREATE INDEX IF NOT EXISTS documents_created_at ON documents (created_at)',
+    'CREATE INDEX IF NOT EXISTS documents_sha256 ON documents (sha256)',
+    'CREATE INDEX IF NOT EXISTS documents_last_access ON documents (last_access)',
+    '''
+    CREATE TABLE IF NOT EXISTS page_fingerprints (
+        document_id TEXT NOT NULL,
+        page_nb INTEGER NOT NULL,
+        dhash TEXT NOT NULL,
+        minhash BLOB,
+        PRIMARY KEY (document_id, page_nb)
+    )
+    ''',
+    'CREATE TABLE IF NOT EXISTS page_bands (band TEXT NOT NULL, document_id TEXT NOT NULL, page_nb INTEGER NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS page_bands_band ON page_bands (band)',
+    'CREATE INDEX IF NOT EXISTS page_bands_document ON page_bands (document_id)',
+]
+_UPDATABLE_FIELDS = {'sha256', 'nb_pages', 'status', 'size', 'last_access'}
+
+
+class DocumentStatus(Enum):
+    UPLOADED = 'uploaded'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+
+
+@dataclass
+class DocumentMetadata:
+    document_id: str
+    sha256: Optional[str]
+    nb_pages: Optional[int]
+    status: DocumentStatus
+    size: int
+    created_at: float
+    updated_at: float
+    last_access: float
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> 'DocumentMetadata':
+        dict_ = dict(row)
+        dict_['status'] = DocumentStatus(dict_['status'])
+        return cls(**dict_)
+
+
+def _index_folder() -> str:
+    # SQLite locking is unreliable over NFS: with shared workers, each node keeps its own index on a local disk and
+    # what other nodes need is read from the document folders.
+    config = get_config()
+    if config.workers.mode == WorkersMode.SHARED.value:
+        return config.storage.local_index_folder
+    return config.storage.documents_folder
+
+
+def index_path() -> str:
+    return os.path.join(_index_folder(), 'index.sqlite3')
+
+
+@lru_cache
+def _create_schema(path: str) -> None:
+    connection = sqlite3.connect(path, timeout=30)
+    try:
+        with connection:
+            for statement in _SCHEMA:
+                connection.execute(statement)
+    finally:
+        connection.close()
+
+
+@contextmanager
+def transaction() -> Iterator[sqlite3.Connection]:
+    create_folder_if_inexistent(_index_folder())
+    _create_schema(index_path())
+    connection = sqlite3.connect(index_path(), timeout=30)
+    connection.row_factory = sqlite3.Row
+    try:
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def upsert_document(
+    connection: sqlite3.Connection,
+    document_id: str,
+    status: DocumentStatus,
+    sha256: Optional[str] = None,
+    size: int = 0,
+    created_at: Optional[float] = None,
+) -> None:
+    now = time.time()
+    created_at = created_at or now
+    connection.execute(
+        '''
+        INSERT INTO documents (document_id, sha256, status, size, created_at, updated_at, last_access)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (document_id) DO UPDATE SET
+            sha256 = excluded.sha256, status = excluded.status, size = excluded.size, updated_at = excluded.updated_at
+        ''',
+        (document_id, sha256, status.value, size, created_at, now, now),
+    )
+
+
+def update_document(connection: sqlite3.Connection, document_id: str, **fields: Any) -> None:
+    unknown = set(fields) - _UPDATABLE_FIELDS
+    if unknown:
+        raise ValueError(f'Cannot update fields {unknown}, expecting fields in {_UPDATABLE_FIELDS}')
+    values: Dict[str, Any] = {k: v.value if isinstance(v, DocumentStatus) else v for k, v in fields.items()}
+    values['updated_at'] = time.time()
+    assignments = ', '.join(f'{key} = ?' for key in values)
+    connection.execute(f'UPDATE documents SET {assignments} WHERE document_id = ?', (*values.values(), document_id))
+
+
+def delete_document(connection: sqlite3.Connection, document_id: str) -> None:
+    connection.execute('DELETE FROM documents WHERE document_id = ?', (document_id,))
+    connection.execute('DELETE FROM page_fingerprints WHERE document_id = ?', (document_id,))
+    connection.execute('DELETE FROM page_bands WHERE document_id = ?', (document_id,))
+
+
+def upsert_page_fingerprint(
+    connection: sqlite3.Connection,
+    document_id: str,
+    page_nb: int,
+    dhash: str,
+    minhash: Optional[bytes],
+    bands: List[str],
+) -> None:
+    connection.execute(
+        'INSERT OR REPLACE INTO page_fingerprints (document_id, page_nb, dhash, minhash) VALUES (?, ?, ?, ?)',
+        (document_id, page_nb, dhash, minhash),
+    )
+    connection.execute('DELETE FROM page_bands WHERE document_id = ? AND page_nb = ?', (document_id, page_nb))
+    connection.executemany(
+        'INSERT INTO page_bands (band, document_id, page_nb) VALUES (?, ?, ?)',
+        [(band, document_id, page_nb) for band in bands],
+    )
+
+
+def find_candidate_pages(
+    connection: sqlite3.Connection, bands: List[str], excluded_document_id: str, limit: int
+) -> List[sqlite3.Row]:
+    # Pages sharing at least one band, most shared bands first: an indexed lookup, whatever the number of pages.
+    placeholders = ', '.join('?' for _ in bands)
+    query = f'''
+        SELECT fingerprints.*, COUNT(*) AS nb_bands FROM page_bands AS bands
+        JOIN page_fingerprints AS fingerprints
+            ON fingerprints.document_id = bands.document_id AND fingerprints.page_nb = bands.page_nb
+        WHERE bands.band IN ({placeholders}) AND bands.document_id != ?
+        GROUP BY fingerprints.document_id, fingerprints.page_nb
+        ORDER BY nb_bands DESC
+        LIMIT ?
+    '''
+    return connection.execute(query, (*bands, excluded_document_id, limit)).fetchall()
+
+
+def get_document(document_id: str) -> Optional[DocumentMetadata]:
+    with transaction() as connection:
+        row = connection.execute('SELECT * FROM documents WHERE document_id = ?', (document_id,)).fetchone()
+    return DocumentMetadata.from_row(row) if row else None
+
+
+def list_documents(
+    status: Optional[DocumentStatus] = None, created_after: Optional[float] = None, limit: int = 100
+) -> List[DocumentMetadata]:
+    conditions, parameters = [], []
+    if status:
+        conditions.append('status = ?')
+        parameters.append(status.value)
+    if created_after:
+        conditions.append('created_at > ?')
+        parameters.append(created_after)
+    where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+    query = f'SELECT * FROM documents {where} ORDER BY created_at DESC LIMIT ?'
+    with transaction() as connection:
+        rows = connection.execute(query, (*parameters, limit)).fetchall()
+    return [DocumentMetadata.from_row(row) for row in rows]
+
+
+def list_documents_by_last_access() -> List[DocumentMetadata]:
+    # Least recently used first, what the janitor needs to apply TTL and quota without walking document folders.
+    with transaction() as connection:
+        rows = connection.execute('SELECT * FROM documents ORDER BY last_access').fetchall()
+    return [DocumentMetadata.from_row(row) for row in rows]
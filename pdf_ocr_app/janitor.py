@@ -0,0 +1,167 @@
+import argparse
+import fcntl
+import os
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from typing import List, Optional
+
+from pdf_ocr_app.config import WorkersMode, get_config
+from pdf_ocr_app.db import (
+    alto_xml_path,
+    background_lease_path,
+    compress_artifacts,
+    delete_document,
+    document_last_access,
+    document_size,
+    documents_folder,
+    has_processing_step,
+    list_document_ids,
+    load_processing_step,
+    update_document_size,
+)
+from pdf_ocr_app.index import DocumentStatus, list_documents_by_last_access
+from pdf_ocr_app.leases import is_held
+from pdf_ocr_app.utils import create_folder_if_inexistent
+
+_HOUR = 3600
+_MB = 1024 * 1024
+
+
+@dataclass
+class DocumentUsage:
+    document_id: str
+    size: int
+    last_access: float
+    in_progress: bool
+
+
+@dataclass
+class JanitorReport:
+    nb_documents: int
+    nb_evicted: int
+    nb_compressed: int
+    total_size: int
+
+
+def _in_progress(document_id: str, processing: bool) -> bool:
+    # Documents with partial results are still processing, and so are the ones a background pass is completing.
+    return processing or is_held(background_lease_path(document_id), get_config().workers.lease_seconds)
+
+
+def _is_processing(document_id: str) -> bool:
+    return has_processing_step(document_id) and not load_processing_step(document_id).complete
+
+
+def _scan_usages() -> List[DocumentUsage]:
+    # The index of a node does not know the documents of the other nodes sharing the folder.
+    usages = [
+        DocumentUsage(
+            document_id,
+            document_size(document_id),
+            document_last_access(document_id),
+            _in_progress(document_id, _is_processing(document_id)),
+        )
+        for document_id in list_document_ids()
+    ]
+    return sorted(usages, key=lambda usage: usage.last_access)
+
+
+def _load_usages() -> List[DocumentUsage]:
+    if get_config().workers.mode == WorkersMode.SHARED.value:
+        return _scan_usages()
+    # Read from the index, least recently used first: folders are only visited to delete or compress them.
+    return [
+        DocumentUsage(
+            metadata.document_id,
+            metadata.size,
+            metadata.last_access,
+            _in_progress(metadata.document_id, metadata.status == DocumentStatus.PROCESSING),
+        )
+        for metadata in list_documents_by_last_access()
+    ]
+
+
+def _is_expired(usage: DocumentUsage, now: float, ttl_seconds: float) -> bool:
+    return now - usage.last_access > ttl_seconds
+
+
+def _has_uncompressed_outputs(document_id: str) -> bool:
+    # out.xml is rewritten uncompressed whenever outputs are, and decompressed when read.
+    return os.path.exists(alto_xml_path(document_id))
+
+
+def run_janitor_once(now: Optional[float] = None) -> JanitorReport:
+    config = get_config().janitor
+    now = now or time.time()
+    usages = _load_usages()
+    nb_documents = len(usages)
+    kept: List[DocumentUsage] = []
+    nb_evicted = 0
+    for usage in usages:
+        # Unfinished documents are only evicted once their worker has stopped updating them for a whole TTL.
+        if _is_expired(usage, now, config.ttl_hours * _HOUR):
+            delete_document(usage.document_id)
+            nb_evicted += 1
+        else:
+            kept.append(usage)
+    nb_compressed = 0
+    for usage in kept:
+        if usage.in_progress or not _is_expired(usage, now, config.compress_after_hours * _HOUR):
+            continue
+        if _has_uncompressed_outputs(usage.document_id) and compress_artifacts(usage.document_id):
+            nb_compressed += 1
+            usage.size = update_document_size(usage.document_id)
+    total_size = sum(usage.size for usage in kept)
+    for usage in kept:
+        if total_size <= config.quota_mb * _MB:
+            break
+        if usage.in_progress:
+            continue
+        delete_document(usage.document_id)
+        total_size -= usage.size
+        nb_evicted += 1
+    return JanitorReport(nb_documents, nb_evicted, nb_compressed, total_size)
+
+
+def _lock_path() -> str:
+    return os.path.join(documents_folder(), 'janitor.lock')
+
+
+def _run_if_lock_is_free() -> Optional[JanitorReport]:
+    create_folder_if_inexistent(documents_folder())
+    with open(_lock_path(), 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None  # another process is already cleaning
+        try:
+            return run_janitor_once()
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _loop() -> None:
+    while True:
+        try:
+            _run_if_lock_is_free()
+        except Exception:
+            print(traceback.format_exc())
+        time.sleep(get_config().janitor.interval_seconds)
+
+
+_THREAD: Optional[threading.Thread] = None
+
+
+def start_janitor_thread() -> None:
+    global _THREAD
+    if _THREAD is None:
+        _THREAD = threading.Thread(target=_loop, name='janitor', daemon=True)
+        _THREAD.start()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evicts and compresses documents to keep storage under quota.')
+    parser.parse_args()
+    print(_run_if_lock_is_free())
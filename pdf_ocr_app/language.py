@@ -0,0 +1,79 @@
+import os
+import re
+import subprocess
+from collections import Counter
+from typing import Dict, List
+
+from pdf_ocr_app.config import get_config
+from pdf_ocr_app.db import input_pdf_path, page_output_base, write_file
+
+_DETECTION_DPI = 100
+_MIN_WORDS_IN_TEXT_LAYER = 20
+_MIN_STOPWORD_HITS = 3
+_STOPWORDS: Dict[str, List[str]] = {
+    'fra': 'le la les des du un une et est dans pour par sur au aux que qui ne pas sont il ce cette avec'.split(),
+    'eng': 'the of and to in is that for on with as are be by this it from at or which an not shall'.split(),
+    'deu': 'der die das und ist nicht mit von zu den dem des ein eine im auf für sich auch werden wird'.split(),
+    'ita': 'il lo gli della delle dei di che non per con una sono nel alla questo essere anche'.split(),
+    'spa': 'el los las del que y en por con para una es no se al lo como más pero sus'.split(),
+}
+_WORD = re.compile(r'\w+')
+
+
+def candidate_langs() -> List[str]:
+    # Detection is opt-in (tesseract.detect_language): it costs a pdftotext call, or a quick OCR pass, per page.
+    config = get_config().tesseract
+    if not config.detect_language:
+        return [config.lang]
+    candidates = [lang.strip() for lang in config.candidate_langs.split(',') if lang.strip()]
+    return candidates or [config.lang]
+
+
+def detect_language(text: str, candidates: List[str], default: str) -> str:
+    words = Counter(_WORD.findall(text.lower()))
+    hits = {lang: sum(words[word] for word in _STOPWORDS.get(lang, [])) for lang in candidates}
+    ranked = sorted(hits.items(), key=lambda item: item[1], reverse=True)
+    if not ranked or ranked[0][1] < _MIN_STOPWORD_HITS:
+        return default
+    if len(ranked) > 1 and ranked[0][1] == ranked[1][1]:
+        return default
+    return ranked[0][0]
+
+
+def _text_layer(pdf_path: str, page_nb: int) -> str:
+    cmd = ['pdftotext', '-f', str(page_nb + 1), '-l', str(page_nb + 1), pdf_path, '-']
+    return subprocess.run(cmd, capture_output=True, text=True).stdout
+
+
+def _quick_ocr(pdf_path: str, page_nb: int, lang: str) -> str:
+    import pytesseract
+    from pdf2image import convert_from_path
+
+    page = convert_from_path(pdf_path, dpi=_DETECTION_DPI, first_page=page_nb + 1, last_page=page_nb + 1)[0]
+    return pytesseract.image_to_string(page, lang=lang)
+
+
+def _language_path(document_id: str, page_nb: int) -> str:
+    return page_output_base(document_id, page_nb) + '.lang'
+
+
+def _detect_page_language(document_id: str, page_nb: int, candidates: List[str], default: str) -> str:
+    pdf_path = input_pdf_path(document_id)
+    text = _text_layer(pdf_path, page_nb)
+    if len(_WORD.findall(text)) < _MIN_WORDS_IN_TEXT_LAYER:
+        text = _quick_ocr(pdf_path, page_nb, default)
+    return detect_language(text, candidates, default)
+
+
+def page_language(document_id: str, page_nb: int) -> str:
+    candidates = candidate_langs()
+    default = get_config().tesseract.lang
+    if len(candidates) == 1:
+        return candidates[0]
+    path = _language_path(document_id, page_nb)
+    if os.path.exists(path):
+        with open(path) as file_:
+            return file_.read()
+    lang = _detect_page_language(document_id, page_nb, candidates, default)
+    write_file(lang, path)
+    return lang
@@ -0,0 +1,84 @@
+# Column-aware reading order computed from text line boxes (hpos, vpos, width, height): columns are separated by
+# vertical gutters of the horizontal occupancy profile, lines spanning several columns (titles) split the page in
+# horizontal bands, and each band is read column by column.
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+from typing import List, Tuple
+
+import numpy as np
+from scipy import ndimage
+
+_NB_BINS = 200  # resolution of the horizontal occupancy profile, relative to the text width
+_MIN_GUTTER_BINS = 2
+_MAX_LINE_RATIO = 0.6  # wider lines are not used to find gutters, they may span several columns
+_GUTTER_NOISE_RATIO = 0.02  # a few stray lines (page numbers, notes) may cross a gutter
+_CACHE_SIZE = 4096
+_BOX_ATTRIBUTES = ('HPOS', 'VPOS', 'WIDTH', 'HEIGHT')
+
+Paragraphs = Tuple[Tuple[int, ...], ...]
+
+
+def column_boundaries(boxes: np.ndarray) -> np.ndarray:
+    if not len(boxes):
+        return np.empty(0)
+    starts, ends = boxes[:, 0], boxes[:, 0] + boxes[:, 2]
+    left = starts.min()
+    text_width = max(ends.max() - left, 1.0)
+    narrow = boxes[:, 2] < _MAX_LINE_RATIO * text_width
+    scale = _NB_BINS / text_width
+    first_bins = np.clip(((starts[narrow] - left) * scale).astype(int), 0, _NB_BINS)
+    last_bins = np.clip(np.ceil((ends[narrow] - left) * scale).astype(int), 0, _NB_BINS)
+    coverage = np.bincount(first_bins, minlength=_NB_BINS + 1) - np.bincount(last_bins, minlength=_NB_BINS + 1)
+    profile = np.cumsum(coverage)[:_NB_BINS]
+    gutters, _ = ndimage.label(profile <= int(_GUTTER_NOISE_RATIO * narrow.sum()))
+    centers = [
+        (gutter.start + gutter.stop) / 2
+        for (gutter,) in ndimage.find_objects(gutters)
+        if gutter.stop - gutter.start >= _MIN_GUTTER_BINS and gutter.start > 0 and gutter.stop < _NB_BINS
+    ]
+    return left + np.array(centers) / scale
+
+
+def _reading_order(boxes: np.ndarray, block_ids: np.ndarray) -> Paragraphs:
+    starts, ends, middles = boxes[:, 0], boxes[:, 0] + boxes[:, 2], boxes[:, 1] + boxes[:, 3] / 2
+    boundaries = column_boundaries(boxes)
+    spanning = ((starts[:, None] < boundaries) & (ends[:, None] > boundaries)).any(axis=1)
+    columns = np.where(spanning, 0, np.searchsorted(boundaries, (starts + ends) / 2))
+    # Band 2k holds the lines below k spanning lines, band 2k + 1 the k-th spanning line itself.
+    spanning_lines_above = np.searchsorted(np.sort(middles[spanning]), middles)
+    bands = 2 * spanning_lines_above + spanning
+    order = np.lexsort((starts, middles, columns, bands))
+    keys = np.stack([block_ids[order], columns[order], bands[order]])
+    breaks = np.flatnonzero((np.diff(keys, axis=1) != 0).any(axis=0)) + 1
+    return tuple(tuple(paragraph.tolist()) for paragraph in np.split(order, breaks))
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def _cached_reading_order(lines: bytes) -> Paragraphs:
+    array = np.frombuffer(lines, dtype=float).reshape(-1, 5)
+    return _reading_order(array[:, :4], array[:, 4].astype(int))
+
+
+def reading_order(boxes: np.ndarray, block_ids: np.ndarray) -> Paragraphs:
+    # Paragraphs (consecutive lines of a block within a column) as line indexes, in reading order.
+    if not len(boxes):
+        return ()
+    lines = np.column_stack([np.asarray(boxes, dtype=float), np.asarray(block_ids, dtype=float)])
+    return _cached_reading_order(lines.tobytes())
+
+
+def _alto_lines(alto_xml: str) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    boxes, block_ids, texts = [], [], []
+    root = ET.fromstring(alto_xml.encode())
+    for block_id, block in enumerate(root.iterfind('.//{*}TextBlock')):
+        for line in block.iterfind('{*}TextLine'):
+            boxes.append([float(line.get(attribute, 0)) for attribute in _BOX_ATTRIBUTES])
+            block_ids.append(block_id)
+            texts.append(' '.join(string.get('CONTENT', '') for string in line.iterfind('{*}String')))
+    return np.array(boxes, dtype=float).reshape(-1, 4), np.array(block_ids, dtype=int), texts
+
+
+def alto_page_text(alto_xml: str) -> str:
+    boxes, block_ids, texts = _alto_lines(alto_xml)
+    paragraphs = ['\n'.join(texts[line] for line in paragraph) for paragraph in reading_order(boxes, block_ids)]
+    return '\n\n'.join(paragraphs) + '\n\f'
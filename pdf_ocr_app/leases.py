@@ -0,0 +1,127 @@
+# File leases shared by processes on several machines through NFS. A lease is a file created with O_EXCL
+# containing its owner id; it stays alive while its owner touches it more often than every `duration` seconds.
+# Lease ages are measured with the clock of the file server (the mtime of a probe file), not the local one.
+import os
+import socket
+import tempfile
+import threading
+import uuid
+from dataclasses import dataclass
+from typing import List, Optional
+
+
+@dataclass
+class Lease:
+    path: str
+    owner: str
+    duration: float
+
+
+def local_owner() -> str:
+    # Pids are only unique on a machine, and the threads of a process share theirs.
+    return f'{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}'
+
+
+def _read_owner(path: str) -> Optional[str]:
+    try:
+        with open(path) as file_:
+            return file_.read()
+    except FileNotFoundError:
+        return None
+
+
+def _filesystem_time(folder: str) -> float:
+    with tempfile.NamedTemporaryFile(dir=folder, prefix='.clock-') as probe:
+        return os.fstat(probe.fileno()).st_mtime
+
+
+def _is_expired(path: str, duration: float) -> bool:
+    try:
+        return _filesystem_time(os.path.dirname(path)) - os.path.getmtime(path) > duration
+    except FileNotFoundError:
+        return True
+
+
+def _create(path: str, owner: str) -> bool:
+    try:
+        descriptor = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(descriptor, 'w') as file_:
+        file_.write(owner)
+    return True
+
+
+def _break_expired(path: str, duration: float) -> None:
+    if not _is_expired(path, duration):
+        return
+    stale_path = f'{path}.stale.{uuid.uuid4().hex}'
+    try:
+        os.rename(path, stale_path)  # atomic: only one contender breaks a given lease
+    except FileNotFoundError:
+        return
+    if not _is_expired(stale_path, duration):
+        # Another contender re-acquired it between our check and the rename: put it back.
+        try:
+            os.link(stale_path, path)
+        except FileExistsError:
+            pass
+    os.remove(stale_path)
+
+
+def try_acquire(path: str, owner: str, duration: float) -> Optional[Lease]:
+    if os.path.exists(path):
+        _break_expired(path, duration)
+    if _create(path, owner):
+        return Lease(path, owner, duration)
+    return None
+
+
+def is_held(path: str, duration: float) -> bool:
+    return os.path.exists(path) and not _is_expired(path, duration)
+
+
+def renew(lease: Lease) -> bool:
+    if _read_owner(lease.path) != lease.owner:
+        return False
+    os.utime(lease.path, None)
+    return True
+
+
+def release(lease: Lease) -> None:
+    if _read_owner(lease.path) == lease.owner:
+        try:
+            os.remove(lease.path)
+        except FileNotFoundError:
+            pass
+
+
+class Heartbeat:
+    # Renews leases in the background. `lost` is set once a lease was broken or taken over by another process:
+    # the work done under it must not be committed.
+    def __init__(self, leases: List[Lease]) -> None:
+        self.leases = leases
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _renew(self, lease: Lease) -> bool:
+        try:
+            return renew(lease)
+        except OSError:  # removed between the owner check and the touch, or a stale NFS handle
+            return False
+
+    def _run(self) -> None:
+        interval = min(lease.duration for lease in self.leases) / 3
+        while not self._stop.wait(interval):
+            if not all([self._renew(lease) for lease in self.leases]):
+                self.lost = True
+                return
+
+    def __enter__(self) -> 'Heartbeat':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self._stop.set()
+        self._thread.join()
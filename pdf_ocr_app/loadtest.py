@@ -0,0 +1,387 @@
+import argparse
+import base64
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from collections import defaultdict
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from pdf_ocr_app.config import OCRBackend
+from pdf_ocr_app.db import load_sample_documents
+
+# Component ids built by generate_id in app/pages, duplicated to keep this tool free of dash imports.
+_UPLOAD = 'parse-upload-data'
+_DROPDOWN = 'parse-dropdown'
+_PARSE_DOCUMENT_ID = 'parse-document-id'
+_INTERVAL = 'parse-interval'
+_PAGE_RANGE = 'parse-page-range'
+_PROCESSING_DONE = 'parse-processing-done'
+_PROGRESS_BAR = 'parse-progress-bar'
+_PROGRESS_BAR_WRAPPER = 'parse-progress-bar-wrapper'
+_OUTPUT = 'output-ocr-output'
+_DOCUMENT_ID = 'common-document-id'
+
+_PERCENTILES = (50, 90, 99)
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+@dataclass
+class RequestRecord:
+    operation: str
+    seconds: float
+    ok: bool
+
+
+@dataclass
+class ServerSample:
+    cpu_percent: float
+    rss_mb: float
+
+
+@dataclass
+class OperationStats:
+    count: int
+    error_rate: float
+    percentiles: Dict[str, float]
+    max: float
+
+
+@dataclass
+class LoadTestReport:
+    users: int
+    duration_seconds: float
+    documents_done: int
+    operations: Dict[str, OperationStats]
+    server_cpu_percent: Dict[str, float] = field(default_factory=dict)
+    server_rss_mb: Dict[str, float] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    def format(self) -> str:
+        lines = [f'{self.users} users, {self.duration_seconds:.1f}s, {self.documents_done} documents processed']
+        lines.append(
+            f'{"operation":<16}{"count":>7}{"errors":>8}'
+            + ''.join(f'{f"p{q}":>9}' for q in _PERCENTILES)
+            + f'{"max":>9}'
+        )
+        for name, stats in sorted(self.operations.items()):
+            values = ''.join(f'{stats.percentiles[f"p{q}"]:>9.3f}' for q in _PERCENTILES)
+            lines.append(f'{name:<16}{stats.count:>7}{stats.error_rate:>8.1%}{values}{stats.max:>9.3f}')
+        if self.server_cpu_percent:
+            lines.append(f'server cpu %: {_format_dict(self.server_cpu_percent)}')
+            lines.append(f'server rss MB: {_format_dict(self.server_rss_mb)}')
+        return '\n'.join(lines)
+
+
+def _format_dict(values: Dict[str, float]) -> str:
+    return ' '.join(f'{key}={value:.1f}' for key, value in values.items())
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(q / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def operation_stats(records: List[RequestRecord]) -> Dict[str, OperationStats]:
+    by_operation: Dict[str, List[RequestRecord]] = defaultdict(list)
+    for record in records:
+        by_operation[record.operation].append(record)
+    result = {}
+    for name, operation_records in by_operation.items():
+        latencies = sorted(record.seconds for record in operation_records)
+        errors = sum(not record.ok for record in operation_records)
+        percentiles = {f'p{q}': percentile(latencies, q) for q in _PERCENTILES}
+        result[name] = OperationStats(len(latencies), errors / len(latencies), percentiles, latencies[-1])
+    return result
+
+
+def _process_tree(root_pid: int) -> List[int]:
+    # gunicorn workers and the OCR subprocesses they spawn are descendants of the server process.
+    children: Dict[int, List[int]] = defaultdict(list)
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            stat = _read_stat(int(name))
+            if stat:
+                children[int(stat[1])].append(int(name))
+    pids, to_visit = [], [root_pid]
+    while to_visit:
+        pid = to_visit.pop()
+        pids.append(pid)
+        to_visit.extend(children.get(pid, []))
+    return pids
+
+
+def _read_stat(pid: int) -> Optional[List[str]]:
+    try:
+        with open(f'/proc/{pid}/stat') as file_:
+            content = file_.read()
+    except (FileNotFoundError, ProcessLookupError):
+        return None
+    return content[content.rindex(')') + 2 :].split()  # fields after "pid (comm)", comm may contain spaces
+
+
+def _cpu_ticks_and_rss(pids: List[int]) -> Tuple[int, int]:
+    ticks, rss_pages = 0, 0
+    for pid in pids:
+        stat = _read_stat(pid)
+        if stat:  # utime, stime and rss are fields 14, 15 and 24 of /proc/pid/stat
+            ticks += int(stat[11]) + int(stat[12])
+            rss_pages += int(stat[21])
+    return ticks, rss_pages * _PAGE_SIZE
+
+
+class ServerMonitor:
+    def __init__(self, pid: int, interval: float = 1.0) -> None:
+        self.pid = pid
+        self.interval = interval
+        self.samples: List[ServerSample] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        previous_ticks, _ = _cpu_ticks_and_rss(_process_tree(self.pid))
+        previous_time = time.monotonic()
+        while not self._stop.wait(self.interval):
+            ticks, rss = _cpu_ticks_and_rss(_process_tree(self.pid))
+            now = time.monotonic()
+            # Ticks of processes that exited in between are lost: short OCR subprocesses are underestimated.
+            cpu = max(ticks - previous_ticks, 0) / _CLOCK_TICKS / (now - previous_time) * 100
+            self.samples.append(ServerSample(cpu, rss / 2**20))
+            previous_ticks, previous_time = ticks, now
+
+    def __enter__(self) -> 'ServerMonitor':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self) -> Tuple[Dict[str, float], Dict[str, float]]:
+        cpus = sorted(sample.cpu_percent for sample in self.samples)
+        rss = sorted(sample.rss_mb for sample in self.samples)
+        if not cpus:
+            return {}, {}
+        return (
+            {'mean': sum(cpus) / len(cpus), 'p90': percentile(cpus, 90), 'max': cpus[-1]},
+            {'mean': sum(rss) / len(rss), 'max': rss[-1]},
+        )
+
+
+def dash_payload(
+    outputs: List[Tuple[str, str]],
+    inputs: List[Tuple[str, str, Any]],
+    state: List[Tuple[str, str, Any]],
+    changed: str,
+) -> Dict[str, Any]:
+    output_specs = [{'id': id_, 'property': property_} for id_, property_ in outputs]
+    multi = len(outputs) > 1
+    output = '..' + '...'.join(f'{id_}.{prop}' for id_, prop in outputs) + '..' if multi else '.'.join(outputs[0])
+    return {
+        'output': output,
+        'outputs': output_specs if multi else output_specs[0],
+        'inputs': [{'id': id_, 'property': property_, 'value': value} for id_, property_, value in inputs],
+        'state': [{'id': id_, 'property': property_, 'value': value} for id_, property_, value in state],
+        'changedPropIds': [changed],
+    }
+
+
+def _output_value(body: Dict[str, Any], id_: str, property_: str) -> Any:
+    return body.get('response', {}).get(id_, {}).get(property_)
+
+
+class SimulatedUser:
+    def __init__(
+        self, base_url: str, pdf_path: str, poll_seconds: float, timeout: float, records: List[RequestRecord]
+    ) -> None:
+        import requests
+
+        self.base_url = base_url.rstrip('/')
+        self.pdf_path = pdf_path
+        self.poll_seconds = poll_seconds
+        self.timeout = timeout
+        self.records = records
+        self.session = requests.Session()
+
+    def _request(self, operation: str, method: str, path: str, **kwargs) -> Optional[Any]:
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+            ok = response.status_code < 400
+        except Exception:
+            response, ok = None, False
+        self.records.append(RequestRecord(operation, time.perf_counter() - start, ok))
+        return response if ok else None
+
+    def _callback(self, operation: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        response = self._request(operation, 'POST', '/_dash-update-component', json=payload)
+        if response is None or response.status_code == 204:  # 204: PreventUpdate
+            return {}
+        return response.json()
+
+    def upload(self) -> Optional[str]:
+        with open(self.pdf_path, 'rb') as file_:
+            contents = 'data:application/pdf;base64,' + base64.b64encode(file_.read()).decode()
+        payload = dash_payload(
+            [(_PARSE_DOCUMENT_ID, 'data')],
+            [(_UPLOAD, 'contents', contents), (_DROPDOWN, 'value', None)],
+            [],
+            f'{_UPLOAD}.contents',
+        )
+        return _output_value(self._callback('upload', payload), _PARSE_DOCUMENT_ID, 'data')
+
+    def _process_file(self, operation: str, document_id: str, n_intervals: int, hidden: bool) -> Dict[str, Any]:
+        outputs = [
+            (_PROCESSING_DONE, 'data'),
+            (_PROGRESS_BAR, 'children'),
+            (_PROGRESS_BAR, 'value'),
+            (_PROGRESS_BAR_WRAPPER, 'hidden'),
+        ]
+        inputs = [(_INTERVAL, 'n_intervals', n_intervals), (_PARSE_DOCUMENT_ID, 'data', document_id)]
+        state = [(_PROGRESS_BAR_WRAPPER, 'hidden', hidden), (_PAGE_RANGE, 'value', None)]
+        changed = f'{_PARSE_DOCUMENT_ID}.data' if hidden else f'{_INTERVAL}.n_intervals'
+        return self._callback(operation, dash_payload(outputs, inputs, state, changed))
+
+    def wait_for_ocr(self, document_id: str, deadline: float) -> bool:
+        self._process_file('start_ocr', document_id, 0, True)
+        n_intervals = 0
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_seconds)
+            n_intervals += 1
+            body = self._process_file('poll', document_id, n_intervals, False)
+            if _output_value(body, _PROCESSING_DONE, 'data') == document_id:
+                return True
+        return False
+
+    def open_output(self, document_id: str) -> None:
+        payload = dash_payload(
+            [(_OUTPUT, 'children')], [(_DOCUMENT_ID, 'data', document_id)], [], f'{_DOCUMENT_ID}.data'
+        )
+        self._callback('output_view', payload)
+        self._request('download_svg', 'GET', f'/download_svg/{document_id}')
+        self._request('download_txt', 'GET', f'/download_txt/{document_id}')
+
+    def run(self, nb_output_views: int, deadline: float) -> bool:
+        document_id = self.upload()
+        if not document_id or not self.wait_for_ocr(document_id, deadline):
+            return False
+        for _ in range(nb_output_views):
+            self.open_output(document_id)
+        return True
+
+
+def _run_user(user: SimulatedUser, nb_output_views: int, deadline: float, done: List[bool]) -> None:
+    try:
+        done.append(user.run(nb_output_views, deadline))
+    except Exception:
+        print(f'User crashed:\n{traceback.format_exc()}')
+        done.append(False)
+
+
+def run_load_test(
+    base_url: str,
+    pdf_paths: List[str],
+    nb_users: int,
+    server_pid: Optional[int] = None,
+    poll_seconds: float = 2.0,
+    nb_output_views: int = 3,
+    timeout: float = 600.0,
+    ramp_up_seconds: float = 0.0,
+) -> LoadTestReport:
+    records: List[RequestRecord] = []
+    done: List[bool] = []
+    start = time.monotonic()
+    deadline = start + timeout
+    users = [SimulatedUser(base_url, random.choice(pdf_paths), poll_seconds, timeout, records) for _ in range(nb_users)]
+    threads = [threading.Thread(target=_run_user, args=(user, nb_output_views, deadline, done)) for user in users]
+    with ServerMonitor(server_pid) if server_pid else nullcontext() as monitor:
+        for thread in threads:
+            thread.start()
+            time.sleep(ramp_up_seconds / max(nb_users, 1))
+        for thread in threads:
+            thread.join()
+    report = LoadTestReport(nb_users, time.monotonic() - start, sum(done), operation_stats(records))
+    if monitor:
+        report.server_cpu_percent, report.server_rss_mb = monitor.summary()
+    return report
+
+
+def _start_server(port: int, nb_workers: int, stub_ocr: bool) -> subprocess.Popen:
+    env = os.environ.copy()
+    if stub_ocr:
+        env['tesseract_backend'] = OCRBackend.STUB.value
+    cmd = ['gunicorn', 'pdf_ocr_app.app:APP', '--preload', '-b', f'127.0.0.1:{port}', '-w', str(nb_workers)]
+    return subprocess.Popen(cmd, env=env)
+
+
+def _wait_until_up(base_url: str, timeout: float = 60) -> None:
+    import requests
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(base_url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.5)
+    raise TimeoutError(f'Server at {base_url} did not start within {timeout}s')
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description='Simulates users uploading PDFs, polling progress and opening outputs against a running server.'
+    )
+    parser.add_argument('pdfs', nargs='*', help='Documents to upload, defaults to sample documents.')
+    parser.add_argument('--url', default='http://127.0.0.1:8050')
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--ramp-up', type=float, default=0.0, help='Seconds over which users are started.')
+    parser.add_argument('--output-views', type=int, default=3, help='Output page loads per user once OCR is done.')
+    parser.add_argument('--poll-seconds', type=float, default=2.0, help='Progress polling interval of the parse page.')
+    parser.add_argument('--timeout', type=float, default=600.0)
+    parser.add_argument('--server-pid', type=int, help='Pid of the server to sample CPU/RSS from /proc.')
+    parser.add_argument('--start-server', action='store_true', help='Starts gunicorn on the --url port.')
+    parser.add_argument('--server-workers', type=int, default=1, help='gunicorn workers when using --start-server.')
+    parser.add_argument('--stub-ocr', action='store_true', help='Uses the stub OCR backend when using --start-server.')
+    parser.add_argument('--json', help='Also writes the report as JSON to this path.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = _parse_args()
+    server = None
+    server_pid: Optional[int] = args.server_pid
+    if args.start_server:
+        server = _start_server(int(args.url.rsplit(':', 1)[1].strip('/')), args.server_workers, args.stub_ocr)
+        server_pid = server.pid
+        _wait_until_up(args.url)
+    try:
+        report = run_load_test(
+            args.url,
+            args.pdfs or load_sample_documents(),
+            args.users,
+            server_pid,
+            args.poll_seconds,
+            args.output_views,
+            args.timeout,
+            args.ramp_up,
+        )
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+    print(report.format())
+    if args.json:
+        with open(args.json, 'w') as file_:
+            json.dump(report.to_dict(), file_, indent=4)
+    sys.exit(0 if report.documents_done == args.users else 1)
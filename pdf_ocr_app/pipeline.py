@@ -0,0 +1,109 @@
+# Bounded multi-threaded pipeline: stages are connected by queues of at most `queue_size` items, so a slow stage
+# blocks the stages upstream (backpressure) instead of letting in-flight items, e.g. rasterized pages, pile up.
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Iterator, List
+
+_END = object()
+_POLL_SECONDS = 0.1
+
+
+@dataclass
+class Stage:
+    name: str
+    function: Callable[[Any], Any]
+    nb_threads: int = 1
+
+
+class _Run:
+    def __init__(self, stages: List[Stage], queue_size: int) -> None:
+        self.stages = stages
+        self.queues: List[queue.Queue] = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+        self.stop = threading.Event()
+        self.errors: List[BaseException] = []
+        self._lock = threading.Lock()
+        self._running = [stage.nb_threads for stage in stages]
+
+    def _fail(self, exc: BaseException) -> None:
+        self.errors.append(exc)
+        self.stop.set()
+
+    def _nb_readers(self, queue_index: int) -> int:
+        return self.stages[queue_index].nb_threads if queue_index < len(self.stages) else 1
+
+    def put(self, queue_index: int, item: Any) -> bool:
+        while not self.stop.is_set():
+            try:
+                self.queues[queue_index].put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(self, queue_index: int) -> Any:
+        while not self.stop.is_set():
+            try:
+                return self.queues[queue_index].get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _close(self, queue_index: int) -> None:
+        for _ in range(self._nb_readers(queue_index)):
+            self.put(queue_index, _END)
+
+    def feed(self, items: Iterable[Any]) -> None:
+        try:
+            for item in items:
+                if not self.put(0, item):
+                    return
+        except BaseException as exc:
+            self._fail(exc)
+            return
+        self._close(0)
+
+    def work(self, stage_index: int) -> None:
+        function = self.stages[stage_index].function
+        while True:
+            item = self.get(stage_index)
+            if item is _END:
+                break
+            try:
+                result = function(item)
+            except BaseException as exc:
+                self._fail(exc)
+                return
+            if not self.put(stage_index + 1, result):
+                return
+        with self._lock:
+            self._running[stage_index] -= 1
+            is_last = self._running[stage_index] == 0
+        if is_last:
+            self._close(stage_index + 1)
+
+
+def run_pipeline(items: Iterable[Any], stages: List[Stage], queue_size: int) -> Iterator[Any]:
+    run = _Run(stages, max(queue_size, 1))
+    # Named after the calling thread, profiling samples the threads of the profiled job only.
+    parent = threading.current_thread().name
+    threads = [threading.Thread(target=run.feed, args=(items,), name=f'{parent}/feed', daemon=True)]
+    for stage_index, stage in enumerate(stages):
+        threads += [
+            threading.Thread(target=run.work, args=(stage_index,), name=f'{parent}/{stage.name}', daemon=True)
+            for _ in range(stage.nb_threads)
+        ]
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            item = run.get(len(stages))
+            if item is _END:
+                break
+            yield item
+    finally:
+        run.stop.set()  # also unblocks the stages when the consumer stops early
+        for thread in threads:
+            thread.join()
+    if run.errors:
+        raise run.errors[0]
@@ -1,92 +1,411 @@
 import argparse
+import functools
 import os
 import random
+import re
 import string
 import subprocess
-from typing import Any, Callable, List, Union
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator, List, Optional, Tuple
 
-import pytesseract
-from pdf2image import convert_from_path, pdfinfo_from_path
-from tqdm import tqdm
-
-from pdf_ocr_app.compute import OCRProcessingStep
-from pdf_ocr_app.config import CONFIG
-from pdf_ocr_app.db import dump_alto_pages_xml, dump_processing_step, dump_svg, input_pdf_path
-from pdf_ocr_app.utils import safely_replace_path_suffix
+from pdf_ocr_app.callbacks import notify_callback
+from pdf_ocr_app.compute import OCRProcessingStep, PageRange
+from pdf_ocr_app.config import OCRBackend, WorkersMode, get_config
+from pdf_ocr_app.db import (
+    RENDERER_EXTENSIONS,
+    background_lease_path,
+    dump_alto_pages_xml,
+    dump_ocr_page_numbers,
+    dump_processing_step,
+    dump_searchable_pdf,
+    dump_svg,
+    dump_text,
+    enqueue_document,
+    has_page_alto_xml,
+    input_pdf_path,
+    leases_folder,
+    load_page_alto_xml,
+    mark_document_failed,
+    page_output_base,
+    record_nb_pages,
+)
+from pdf_ocr_app.index import DocumentStatus
+from pdf_ocr_app.language import page_language
+from pdf_ocr_app.leases import Heartbeat, local_owner, release, try_acquire
+from pdf_ocr_app.pipeline import Stage, run_pipeline
+from pdf_ocr_app.profiling import profile_job
+from pdf_ocr_app.provision import ensure_tessdata
+from pdf_ocr_app.utils import create_folder_if_inexistent, safely_replace_path_suffix
 
 _SIMPLE_OCR = 'simple_ocr'
+_A4_POINTS = (595.0, 842.0)
+_PAGE_SIZE = re.compile(r'^Page\s+\d+\s+size:\s+([\d.]+) x ([\d.]+)', re.MULTILINE)
+_REOCR_CHUNK_SIZE = 50
+
+
+def _renderers() -> List[str]:
+    renderers = [renderer.strip() for renderer in get_config().tesseract.renderers.split(',') if renderer.strip()]
+    unknown = [renderer for renderer in renderers if renderer not in RENDERER_EXTENSIONS]
+    if unknown:
+        raise ValueError(f'Unknown renderers {unknown}, expecting values in {list(RENDERER_EXTENSIONS)}')
+    return ['alto'] + [renderer for renderer in renderers if renderer != 'alto']
+
 
+@dataclass(frozen=True)
+class OCRSettings:
+    dpi: int = 200
+    psm: Optional[int] = None
+    binarize: bool = False
+    lang: Optional[str] = None
 
-def _decode(content: Union[str, bytes]) -> str:
-    return content.decode() if isinstance(content, bytes) else content
 
+def _tesseract(
+    image_path: str, output_base: str, settings: OCRSettings, lang: str, renderers: Optional[List[str]] = None
+) -> None:
+    import pytesseract
 
-def _tesseract(page: Any) -> str:
-    return _decode(pytesseract.image_to_alto_xml(page, lang=CONFIG.tesseract.lang))
+    psm = ['--psm', str(settings.psm)] if settings.psm is not None else []
+    renderers = renderers or _renderers()
+    # PNG rasters carry no resolution: without --dpi, Tesseract guesses it and sizes the searchable PDF pages wrongly.
+    dpi = ['--dpi', str(settings.dpi)]
+    cmd = [pytesseract.pytesseract.tesseract_cmd, image_path, output_base, '-l', lang, *dpi, *psm, *renderers]
+    with _tesseract_slots(get_config().pipeline.tesseract_processes):
+        subprocess.run(cmd, check=True, capture_output=True)
+
+
+@functools.lru_cache(maxsize=None)
+def _tesseract_slots(nb_slots: int) -> threading.BoundedSemaphore:
+    # Pipeline pages, the tiles of oversized pages and re-OCR alternatives share the slots: with the default single
+    # OCR thread, tiles and alternatives still run in parallel. A thread waiting for the tiles of its page does not
+    # hold a slot.
+    return threading.BoundedSemaphore(nb_slots)
 
 
 def _build_tmp_file() -> str:
     return '/tmp/' + ''.join([random.choice(string.ascii_letters) for _ in range(10)])
 
 
-def _ocr_page(path: str, page_nb: int) -> str:
-    page = convert_from_path(path, first_page=page_nb + 1, last_page=page_nb + 1)[0]
+def _binarize(page: Any) -> Any:
+    import cv2
+    import numpy as np
+    from PIL import Image
+
+    gray = cv2.cvtColor(np.array(page.convert('RGB')), cv2.COLOR_RGB2GRAY)
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return Image.fromarray(binary)
+
+
+def _rasterize(document_id: str, page_nb: int, settings: OCRSettings) -> Any:
+    from pdf2image import convert_from_path
+
+    path = input_pdf_path(document_id)
+    page = convert_from_path(path, dpi=settings.dpi, first_page=page_nb + 1, last_page=page_nb + 1)[0]
+    return _binarize(page) if settings.binarize else page
+
+
+def _ocr_tile(tile: Any, settings: OCRSettings, lang: str) -> str:
+    base = _build_tmp_file()
+    tile.save(base + '.png')
+    try:
+        _tesseract(base + '.png', base, settings, lang, ['alto'])
+        with open(f'{base}.{RENDERER_EXTENSIONS["alto"]}') as file_:
+            return file_.read()
+    finally:
+        for path in (base + '.png', f'{base}.{RENDERER_EXTENSIONS["alto"]}'):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _skip_if_blank(document_id: str, page_nb: int, page: Any, settings: OCRSettings, output_base: str) -> bool:
+    config = get_config().blank
+    if not config.enabled:
+        return False
+    import numpy as np
+
+    from pdf_ocr_app import blank
+
+    if not blank.is_blank(np.asarray(page.convert('L')), settings.dpi, config):
+        return False
+    blank.write_blank_page(document_id, page_nb, *page.size, output_base, _renderers())
+    return True
+
+
+def report_blank_pages(document_id: str, page_nbs: List[int]) -> None:
+    if not get_config().blank.enabled or not page_nbs:
+        return
+    from pdf_ocr_app.blank import is_blank_page
+
+    nb_blank = sum(is_blank_page(document_id, page_nb) for page_nb in page_nbs)
+    print(f'Skipped OCR of {nb_blank}/{len(page_nbs)} blank pages ({nb_blank / len(page_nbs):.0%})')
+
+
+def _ocr_image(document_id: str, page_nb: int, page: Any, settings: OCRSettings, output_base: Optional[str]) -> None:
+    output_base = output_base or page_output_base(document_id, page_nb)
+    if _skip_if_blank(document_id, page_nb, page, settings, output_base):
+        return
+    if get_config().tesseract.backend == OCRBackend.STUB.value:
+        from pdf_ocr_app.stub_ocr import stub_ocr_page
+
+        stub_ocr_page(document_id, page_nb, *page.size, output_base, _renderers())
+        return
+    lang = settings.lang or page_language(document_id, page_nb)
+    if page.size[0] * page.size[1] > get_config().tiling.max_pixels:
+        from pdf_ocr_app.tiling import ocr_tiled_page
+
+        ocr_tile = functools.partial(_ocr_tile, settings=settings, lang=lang)
+        ocr_tiled_page(document_id, page_nb, page, output_base, _renderers(), ocr_tile)
+        return
     file_ = _build_tmp_file() + '.png'
     page.save(file_)
-    page = _tesseract(file_)
+    _tesseract(file_, output_base, settings, lang)
     os.remove(file_)
-    return page
 
 
-def _nb_pages_in_pdf(filename: str) -> int:
+def ocr_page(
+    document_id: str, page_nb: int, settings: OCRSettings = OCRSettings(), output_base: Optional[str] = None
+) -> None:
+    _ocr_image(document_id, page_nb, _rasterize(document_id, page_nb, settings), settings, output_base)
+
+
+def nb_pages_in_pdf(filename: str) -> int:
+    from pdf2image import pdfinfo_from_path
+
     return pdfinfo_from_path(filename)['Pages']
 
 
+def _page_sizes(filename: str) -> List[Tuple[float, float]]:
+    cmd = ['pdfinfo', '-f', '1', '-l', str(nb_pages_in_pdf(filename)), filename]
+    output = subprocess.run(cmd, capture_output=True, text=True).stdout
+    return [(float(width), float(height)) for width, height in _PAGE_SIZE.findall(output)]
+
+
+def _raster_megabytes(filename: str, dpi: int) -> float:
+    # The largest page sets the budget, a single plan among A4 pages would exceed it otherwise. A4 if unknown.
+    width, height = max(_page_sizes(filename), key=lambda size: size[0] * size[1], default=_A4_POINTS)
+    return (width / 72 * dpi) * (height / 72 * dpi) * 3 / 2**20
+
+
 def _ocr_step_callback(document_id: str) -> Callable[[OCRProcessingStep], None]:
     def _func(step: OCRProcessingStep) -> None:
         dump_processing_step(step, document_id)
+        if step.complete:  # not for partial results, the background pass notifies once every page is processed
+            notify_callback(document_id, DocumentStatus.DONE, step.to_payload())
 
     return _func
 
 
-def simple_ocr_on_file(document_id: str) -> None:
+def _page_lease_path(document_id: str, page_nb: int) -> str:
+    return os.path.join(leases_folder(document_id), f'page-{page_nb}.lease')
+
+
+def _ocr_page_if_missing(document_id: str, page_nb: int) -> None:
+    # Several processes may target the same page (priority range and background pass): the lease avoids
+    # running tesseract twice on it, the loop waits for the other process or takes over if it died.
+    lease_seconds = get_config().workers.lease_seconds
+    while not has_page_alto_xml(document_id, page_nb):
+        lease = try_acquire(_page_lease_path(document_id, page_nb), local_owner(), lease_seconds)
+        if not lease:
+            time.sleep(get_config().workers.poll_seconds)
+            continue
+        try:
+            with Heartbeat([lease]):
+                if not has_page_alto_xml(document_id, page_nb):
+                    ocr_page(document_id, page_nb)
+        finally:
+            release(lease)
+
+
+def _rasterize_if_missing(document_id: str, page_nb: int, settings: OCRSettings) -> Tuple[int, Any]:
+    return page_nb, None if has_page_alto_xml(document_id, page_nb) else _rasterize(document_id, page_nb, settings)
+
+
+def _ocr_leased_page(document_id: str, page_nb: int, page: Any, settings: OCRSettings) -> int:
+    if page is None:
+        return page_nb
+    lease = try_acquire(_page_lease_path(document_id, page_nb), local_owner(), get_config().workers.lease_seconds)
+    if not lease:
+        return page_nb  # another process is on it, _ocr_pages waits for it afterwards
+    try:
+        with Heartbeat([lease]):
+            if not has_page_alto_xml(document_id, page_nb):
+                _ocr_image(document_id, page_nb, page, settings, None)
+    finally:
+        release(lease)
+    return page_nb
+
+
+def _pipeline_queue_size(document_id: str, settings: OCRSettings) -> int:
+    config = get_config().pipeline
+    page_megabytes = _raster_megabytes(input_pdf_path(document_id), settings.dpi)
+    # Rasterized pages in flight: one per queue slot, one per OCR thread and one being rasterized.
+    return max(int(config.memory_budget_mb // page_megabytes) - config.ocr_threads - 1, 1)
+
+
+def _ocr_pages(document_id: str, page_nbs: List[int]) -> Iterator[int]:
+    settings = OCRSettings()
+    stages = [
+        Stage('rasterize', lambda page_nb: _rasterize_if_missing(document_id, page_nb, settings)),
+        Stage(
+            'ocr',
+            lambda item: _ocr_leased_page(document_id, *item, settings),
+            get_config().pipeline.ocr_threads,
+        ),
+    ]
+    yield from run_pipeline(page_nbs, stages, _pipeline_queue_size(document_id, settings))
+    for page_nb in page_nbs:
+        _ocr_page_if_missing(document_id, page_nb)
+    report_blank_pages(document_id, page_nbs)
+
+
+def reuse_duplicate_pages(document_id: str, page_nbs: List[int]) -> None:
+    if not get_config().dedup.enabled or not page_nbs:
+        return
+    from pdf_ocr_app import dedup
+
+    reused = dedup.reuse_duplicate_pages(document_id, page_nbs, _renderers())
+    if reused:
+        sources = sorted({source_document_id for source_document_id, _ in reused.values()})
+        print(f'Reused OCR of {len(reused)}/{len(page_nbs)} pages from near-duplicate documents {sources}')
+
+
+def improve_weak_pages(document_id: str, page_nbs: List[int]) -> None:
+    if get_config().reocr.confidence_threshold <= 0 or not page_nbs:
+        return
+    from pdf_ocr_app import reocr
+
+    for start in range(0, len(page_nbs), _REOCR_CHUNK_SIZE):  # bounds the number of ALTO pages in memory
+        improvements = reocr.improve_weak_pages(document_id, page_nbs[start : start + _REOCR_CHUNK_SIZE])
+        for improvement in improvements:
+            print(f'Page {improvement.page_nb}: confidence {improvement.before:.2f} -> {improvement.after:.2f}')
+
+
+def _available_pages(document_id: str, nb_pages: int) -> List[int]:
+    return [page_nb for page_nb in range(nb_pages) if has_page_alto_xml(document_id, page_nb)]
+
+
+def _priority_pages(nb_pages: int, priority_range: Optional[PageRange]) -> List[int]:
+    first, last = priority_range or (0, nb_pages)
+    return list(range(min(first, nb_pages), min(last, nb_pages)))
+
+
+def simple_ocr_on_file(document_id: str, priority_range: Optional[PageRange] = None) -> None:
+    from tqdm import tqdm
+
     if not os.path.exists(input_pdf_path(document_id)):
         raise ValueError(f'Input pdf not found at path {input_pdf_path(document_id)}.')
     _ocr_step_callback(document_id)(OCRProcessingStep('OCR en cours.', 0.05, False))
+    ensure_tessdata()
+    create_folder_if_inexistent(leases_folder(document_id))
     input_path = input_pdf_path(document_id)
-    nb_pages = _nb_pages_in_pdf(input_path)
-    result: List[str] = []
-    for page_nb in tqdm(range(nb_pages), 'Performing OCR.'):
-        result.append(_ocr_page(input_path, page_nb))
-        msg = f'OCR en cours de la page {page_nb + 1}/{nb_pages}'
-        adv = min(0.1 + 0.9 * (page_nb + 1) / nb_pages, 1.0)
+    nb_pages = nb_pages_in_pdf(input_path)
+    record_nb_pages(document_id, nb_pages)
+    priority_pages = _priority_pages(nb_pages, priority_range)
+    reuse_duplicate_pages(document_id, priority_pages)  # the other pages are looked up by the background pass
+    ocr_pages = tqdm(_ocr_pages(document_id, priority_pages), 'Performing OCR.', len(priority_pages))
+    for index, page_nb in enumerate(ocr_pages):
+        msg = f'OCR en cours de la page {page_nb + 1} ({index + 1}/{len(priority_pages)})'
+        adv = min(0.1 + 0.9 * (index + 1) / len(priority_pages), 1.0)
         _ocr_step_callback(document_id)(OCRProcessingStep(msg, adv, False))
-    dump_alto_pages_xml(result, document_id)
-    dump_svg(result, document_id)
-    _ocr_step_callback(document_id)(OCRProcessingStep(None, 1.0, True))
+    improve_weak_pages(document_id, priority_pages)
+    dump_ocr_outputs(_available_pages(document_id, nb_pages), document_id, nb_pages)
+    priority_page_set = set(priority_pages)
+    remaining_pages = [page_nb for page_nb in range(nb_pages) if page_nb not in priority_page_set]
+    if remaining_pages:
+        _ocr_remaining_pages_in_background(document_id, nb_pages, remaining_pages)
+
+
+def _ocr_remaining_pages_in_background(document_id: str, nb_pages: int, page_nbs: List[int]) -> None:
+    lease = try_acquire(background_lease_path(document_id), local_owner(), get_config().workers.lease_seconds)
+    if not lease:
+        return  # another process is already completing the document
+    os.nice(10)  # leave CPU to interactive requests
+    try:
+        with Heartbeat([lease]):
+            reuse_duplicate_pages(document_id, page_nbs)
+            for _ in _ocr_pages(document_id, page_nbs):
+                pass
+            improve_weak_pages(document_id, page_nbs)
+            dump_ocr_outputs(_available_pages(document_id, nb_pages), document_id, nb_pages)
+    finally:
+        release(lease)
+
+
+def _alto_pages(document_id: str, page_nbs: List[int]) -> Iterator[str]:
+    return (load_page_alto_xml(document_id, page_nb) for page_nb in page_nbs)
+
+
+def _tiled_pages_note(document_id: str, page_nbs: List[int]) -> Optional[str]:
+    if 'pdf' not in _renderers():
+        return None
+    from pdf_ocr_app.tiling import is_tiled_page
+
+    tiled_pages = [str(page_nb + 1) for page_nb in page_nbs if is_tiled_page(document_id, page_nb)]
+    if not tiled_pages:
+        return None
+    return f'Pages sans couche texte dans le PDF (OCR par tuiles) : {", ".join(tiled_pages)}.'
+
+
+def dump_ocr_outputs(page_nbs: List[int], document_id: str, nb_pages: int) -> None:
+    dump_alto_pages_xml(_alto_pages(document_id, page_nbs), document_id)
+    dump_ocr_page_numbers(page_nbs, document_id)
+    dump_svg(_alto_pages(document_id, page_nbs), document_id)
+    dump_text(document_id, page_nbs)
+    if 'pdf' in _renderers():
+        dump_searchable_pdf(document_id, page_nbs)
+    note = _tiled_pages_note(document_id, page_nbs)
+    if len(page_nbs) == nb_pages:
+        step = OCRProcessingStep(note, 1.0, True)
+    else:  # results of the priority pages can be displayed, the other pages are still being processed
+        msg = f'Résultats partiels disponibles ({len(page_nbs)}/{nb_pages} pages), OCR des autres pages en cours.'
+        msg = f'{msg} {note}' if note else msg
+        step = OCRProcessingStep(msg, len(page_nbs) / nb_pages, True, complete=False)
+    _ocr_step_callback(document_id)(step)
 
 
 def _get_src_file() -> str:
     return safely_replace_path_suffix(__file__, '/pdf_ocr_app/process.py', '')
 
 
-def _start_process(document_id: str, mode: str) -> None:
+def _start_process(document_id: str, mode: str, priority_range: Optional[PageRange] = None) -> None:
     cmd = ['python3', __file__, '--doc', document_id, '--mode', mode]
+    if priority_range:
+        cmd += ['--first-page', str(priority_range[0]), '--last-page', str(priority_range[1])]
     env = os.environ.copy()
     env['PYTHONPATH'] = _get_src_file() + ':' + env['PYTHONPATH']
     subprocess.Popen(cmd, env=env)
 
 
-def start_simple_ocr_process(document_id: str) -> None:
-    _start_process(document_id, _SIMPLE_OCR)
+def start_simple_ocr_process(document_id: str, priority_range: Optional[PageRange] = None) -> None:
+    if get_config().workers.mode == WorkersMode.SHARED.value:
+        _ocr_step_callback(document_id)(OCRProcessingStep('En attente d\'un worker OCR.', 0.05, False))
+        enqueue_document(document_id, priority_range)
+        return
+    _start_process(document_id, _SIMPLE_OCR, priority_range)
+
+
+def run_simple_ocr_job(document_id: str, priority_range: Optional[PageRange] = None) -> None:
+    # The job runs in its own process: if it dies, nobody else would ever tell that the document failed.
+    try:
+        with profile_job(document_id, _SIMPLE_OCR):
+            simple_ocr_on_file(document_id, priority_range)
+    except Exception:
+        print(f'Error while processing document {document_id}:\n{traceback.format_exc()}')
+        mark_document_failed(document_id, 'Échec de l\'OCR.')
+        raise
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--doc', required=True)
     parser.add_argument('--mode', required=True)
+    parser.add_argument('--first-page', type=int, help='0-indexed first page to OCR in priority.')
+    parser.add_argument('--last-page', type=int, help='0-indexed excluded last page to OCR in priority.')
     args = parser.parse_args()
     if args.mode == _SIMPLE_OCR:
-        simple_ocr_on_file(args.doc)
+        range_ = (args.first_page, args.last_page) if args.first_page is not None else None
+        run_simple_ocr_job(args.doc, range_)
     else:
         raise NotImplementedError(args.mode)
@@ -0,0 +1,220 @@
+# Opt-in per-job profiling (profiling.mode). Profiles are written in the document folder:
+# - {job}-{time}-{pid}.folded: collapsed stacks of the job threads in sampling mode, for flamegraph.pl or speedscope;
+# - {job}-{time}-{pid}.prof: pstats dump of the calling thread (cprofile mode);
+# - {job}-{time}-{pid}.json: wall time of the job and of the subprocesses it spawned (pdftoppm, tesseract, ...).
+# Job threads are the calling thread and the pipeline threads it starts, named after it: other requests served by
+# the process are left out. When profiling is off, jobs and callbacks are run as is: nothing is patched, no thread
+# is started, and Popen is restored once the last profiled job is done.
+import functools
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, TypeVar
+
+from pdf_ocr_app.config import ProfilingMode, get_config
+from pdf_ocr_app.db import profiles_folder
+from pdf_ocr_app.utils import create_folder_if_inexistent, write_json
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+_ORIGINAL_POPEN = subprocess.Popen
+_RECORDERS: List['_SubprocessTimes'] = []
+_RECORDERS_LOCK = threading.Lock()
+_PATCHED_MODULES: List[Any] = []
+
+
+def _is_job_thread(thread_name: str, job_thread_name: str) -> bool:
+    return thread_name == job_thread_name or thread_name.startswith(f'{job_thread_name}/')
+
+
+class _SubprocessTimes:
+    def __init__(self) -> None:
+        self.durations: Dict[str, List[float]] = defaultdict(list)
+        self.thread_name = threading.current_thread().name
+
+    def __enter__(self) -> '_SubprocessTimes':
+        with _RECORDERS_LOCK:
+            if not _RECORDERS:
+                _install_timed_popen()
+            _RECORDERS.append(self)
+        return self
+
+    def __exit__(self, *_) -> None:
+        with _RECORDERS_LOCK:
+            _RECORDERS.remove(self)
+            if not _RECORDERS:
+                _uninstall_timed_popen()
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {
+            program: {'count': len(durations), 'total_seconds': sum(durations), 'max_seconds': max(durations)}
+            for program, durations in sorted(self.durations.items(), key=lambda item: -sum(item[1]))
+        }
+
+
+def _program_name(args: Any) -> str:
+    program = args if isinstance(args, (str, bytes, os.PathLike)) else args[0]
+    return os.path.basename(os.fsdecode(program).split()[0])
+
+
+def _record(args: Any, duration: float, thread_name: str) -> None:
+    with _RECORDERS_LOCK:
+        for recorder in _RECORDERS:
+            if _is_job_thread(thread_name, recorder.thread_name):
+                recorder.durations[_program_name(args)].append(duration)
+
+
+class _TimedPopen(_ORIGINAL_POPEN):  # type: ignore
+    def __init__(self, *args, **kwargs) -> None:
+        self._profiling_start = time.perf_counter()
+        self._profiling_thread_name = threading.current_thread().name
+        self._profiling_recorded = False
+        super().__init__(*args, **kwargs)
+
+    def wait(self, timeout=None):
+        returncode = super().wait(timeout)
+        if not self._profiling_recorded:  # run() and communicate() end with wait()
+            self._profiling_recorded = True
+            _record(self.args, time.perf_counter() - self._profiling_start, self._profiling_thread_name)
+        return returncode
+
+
+def _install_timed_popen() -> None:
+    # While jobs are profiled. Modules that imported Popen by name (pdf2image) are patched too, or pdftoppm calls
+    # would go unnoticed.
+    for module in list(sys.modules.values()):
+        if getattr(module, 'Popen', None) is _ORIGINAL_POPEN:
+            setattr(module, 'Popen', _TimedPopen)
+            _PATCHED_MODULES.append(module)
+
+
+def _uninstall_timed_popen() -> None:
+    for module in _PATCHED_MODULES:
+        if getattr(module, 'Popen', None) is _TimedPopen:
+            setattr(module, 'Popen', _ORIGINAL_POPEN)
+    _PATCHED_MODULES.clear()
+
+
+def _frame_name(code: Any) -> str:
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def _collapsed_stack(thread_name: str, frame: Any) -> str:
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    return ';'.join([thread_name, *reversed(names)])
+
+
+class _Sampler:
+    def __init__(self, interval_seconds: float) -> None:
+        self.stacks: Counter = Counter()
+        self._interval_seconds = interval_seconds
+        self._job_thread_name = threading.current_thread().name
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name='profiling-sampler', daemon=True)
+
+    def _sample(self) -> None:
+        while not self._stopped.wait(self._interval_seconds):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                name = names.get(thread_id, '')
+                if _is_job_thread(name, self._job_thread_name):
+                    self.stacks[_collapsed_stack(name, frame)] += 1
+
+    def __enter__(self) -> '_Sampler':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def dump(self, base_path: str) -> None:
+        with open(f'{base_path}.folded', 'w') as file_:
+            for stack, count in self.stacks.most_common():
+                file_.write(f'{stack} {count}\n')
+
+
+class _DeterministicProfiler:
+    def __init__(self) -> None:
+        import cProfile
+
+        self._profiler = cProfile.Profile()
+
+    def __enter__(self) -> '_DeterministicProfiler':
+        self._profiler.enable()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self._profiler.disable()
+
+    def dump(self, base_path: str) -> None:
+        self._profiler.dump_stats(f'{base_path}.prof')
+
+
+def _profile_base_path(document_id: str, job: str) -> str:
+    folder = profiles_folder(document_id)
+    create_folder_if_inexistent(folder)
+    return os.path.join(folder, f'{job}-{time.strftime("%Y%m%dT%H%M%S")}-{os.getpid()}')
+
+
+def _write_summary(base_path: str, summary: Dict[str, Any]) -> None:
+    write_json(summary, f'{base_path}.json')
+    subprocess_seconds = sum(times['total_seconds'] for times in summary['subprocesses'].values())
+    print(
+        f'Profiled {summary["job"]} on {summary["document_id"]}: {summary["wall_seconds"]:.2f}s, '
+        f'{subprocess_seconds:.2f}s in subprocesses, written to {base_path}.*'
+    )
+
+
+@contextmanager
+def _profile(document_id: str, job: str, mode: str, interval_seconds: float) -> Iterator[None]:
+    base_path = _profile_base_path(document_id, job)
+    profiler = _Sampler(interval_seconds) if mode == ProfilingMode.SAMPLING.value else _DeterministicProfiler()
+    start = time.perf_counter()
+    with _SubprocessTimes() as subprocess_times:
+        try:
+            with profiler:
+                yield
+        finally:  # slow jobs that end up failing are worth a look too
+            profiler.dump(base_path)
+            summary = {
+                'document_id': document_id,
+                'job': job,
+                'mode': mode,
+                'wall_seconds': time.perf_counter() - start,
+                'subprocesses': subprocess_times.summary(),
+            }
+            _write_summary(base_path, summary)
+
+
+def profile_job(document_id: str, job: str) -> ContextManager[None]:
+    config = get_config().profiling
+    if config.mode == ProfilingMode.OFF.value:
+        return nullcontext()
+    return _profile(document_id, job, config.mode, config.sampling_interval_ms / 1000)
+
+
+def profiled_callback(job: str, document_id_position: int) -> Callable[[F], F]:
+    # Decorator for Dash callbacks, profiling is read once, when callbacks are registered.
+    def _decorator(function: F) -> F:
+        if get_config().profiling.mode == ProfilingMode.OFF.value:
+            return function
+
+        @functools.wraps(function)
+        def _wrapper(*args, **kwargs):
+            document_id = args[document_id_position]
+            if not document_id:
+                return function(*args, **kwargs)
+            with profile_job(document_id, job):
+                return function(*args, **kwargs)
+
+        return _wrapper  # type: ignore
+
+    return _decorator
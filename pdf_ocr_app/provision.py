@@ -0,0 +1,45 @@
+import argparse
+import os
+
+from pdf_ocr_app.config import get_config
+from pdf_ocr_app.db import documents_folder, download_document, migrate_flat_folders
+from pdf_ocr_app.language import candidate_langs
+from pdf_ocr_app.utils import create_folder_if_inexistent
+
+
+def _suffix(text: str) -> str:
+    return text.split('/')[-1]
+
+
+def _tessdata_url(lang: str) -> str:
+    return get_config().tesseract.models_url_template.format(lang)
+
+
+def tessdata_path(lang: str) -> str:
+    return os.path.join(get_config().tesseract.tessdata_location, _suffix(_tessdata_url(lang)))
+
+
+def download_tessdata_if_inexistent(lang: str) -> None:
+    filename = tessdata_path(lang)
+    if not os.path.exists(filename):
+        print(f'Downloading {_tessdata_url(lang)} to {filename}')
+        download_document(_tessdata_url(lang), filename)
+
+
+def ensure_tessdata() -> None:
+    for lang in {get_config().tesseract.lang, *candidate_langs()}:
+        download_tessdata_if_inexistent(lang)
+
+
+def provision() -> None:
+    create_folder_if_inexistent(documents_folder())
+    migrated = migrate_flat_folders()
+    if migrated:
+        print(f'Migrated {len(migrated)} documents to sharded folders.')
+    ensure_tessdata()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Creates/migrates storage folders and downloads tesseract models.')
+    parser.parse_args()
+    provision()
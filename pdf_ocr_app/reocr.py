@@ -0,0 +1,212 @@
+import argparse
+import json
+import os
+import subprocess
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from pdf_ocr_app.compute import Document
+from pdf_ocr_app.config import get_config
+from pdf_ocr_app.db import (
+    RENDERER_EXTENSIONS,
+    copy_pdf,
+    delete_document,
+    load_page_alto_xml,
+    load_sample_documents,
+    page_output_base,
+    write_file,
+)
+from pdf_ocr_app.process import OCRSettings, nb_pages_in_pdf, ocr_page
+
+# Tried in parallel on weak pages, the best mean confidence wins: more pixels per glyph for small print, a single
+# uniform block (psm 6) for tables and forms the page segmentation splits badly, and binarization for stains, stamps
+# and low contrast scans. Compare with `python -m pdf_ocr_app.reocr --json report.json` before changing them.
+ALTERNATIVE_SETTINGS = [OCRSettings(dpi=300), OCRSettings(dpi=300, psm=6), OCRSettings(dpi=300, binarize=True)]
+_LOW_CONFIDENCE = 0.5
+_MAX_LOW_RATIO = 0.2  # a fair mean may hide a poorly read area, e.g. a stamp or a table
+
+
+@dataclass
+class PageConfidence:
+    page_nb: int
+    nb_words: int
+    mean: float
+    low_ratio: float
+
+
+@dataclass
+class PageImprovement:
+    page_nb: int
+    before: float
+    after: float
+    settings: OCRSettings
+
+
+def word_confidences(alto_xml: str) -> np.ndarray:
+    root = ET.fromstring(alto_xml.encode())
+    return np.array([float(string.get('WC', 'nan')) for string in root.iterfind('.//{*}String')], dtype=float)
+
+
+def page_confidences(alto_pages: Dict[int, str]) -> List[PageConfidence]:
+    arrays = [word_confidences(alto_xml) for alto_xml in alto_pages.values()]
+    nb_pages = len(arrays)
+    values = np.concatenate(arrays) if arrays else np.empty(0)
+    page_indexes = np.repeat(np.arange(nb_pages), [len(array) for array in arrays])
+    valid = ~np.isnan(values)
+    page_indexes, values = page_indexes[valid], values[valid]
+    counts = np.bincount(page_indexes, minlength=nb_pages)
+    sums = np.bincount(page_indexes, weights=values, minlength=nb_pages)
+    lows = np.bincount(page_indexes, weights=values < _LOW_CONFIDENCE, minlength=nb_pages)
+    denominators = np.maximum(counts, 1)
+    means = np.where(counts > 0, sums / denominators, 1.0)  # pages without words have nothing to improve
+    low_ratios = lows / denominators
+    return [
+        PageConfidence(page_nb, int(count), float(mean), float(low_ratio))
+        for page_nb, count, mean, low_ratio in zip(alto_pages, counts, means, low_ratios)
+    ]
+
+
+def is_weak(page: PageConfidence, confidence_threshold: float) -> bool:
+    return page.nb_words > 0 and (page.mean < confidence_threshold or page.low_ratio > _MAX_LOW_RATIO)
+
+
+def _alternative_base(document_id: str, page_nb: int, settings_index: int, run_id: str) -> str:
+    # Unique per run: the priority range and the background pass may review the same page at once.
+    return f'{page_output_base(document_id, page_nb)}.{run_id}.alt{settings_index}'
+
+
+def _reviewed_path(document_id: str, page_nb: int) -> str:
+    return page_output_base(document_id, page_nb) + '.reviewed'
+
+
+def _run_alternative(document_id: str, page_nb: int, settings_index: int, run_id: str) -> Optional[PageConfidence]:
+    base = _alternative_base(document_id, page_nb, settings_index, run_id)
+    try:
+        ocr_page(document_id, page_nb, ALTERNATIVE_SETTINGS[settings_index], base)
+    except subprocess.CalledProcessError:
+        return None
+    with open(base + '.' + RENDERER_EXTENSIONS['alto']) as file_:
+        return page_confidences({page_nb: file_.read()})[0]
+
+
+def _replace_page_outputs(document_id: str, page_nb: int, settings_index: int, run_id: str) -> None:
+    base = _alternative_base(document_id, page_nb, settings_index, run_id)
+    for extension in RENDERER_EXTENSIONS.values():
+        if os.path.exists(f'{base}.{extension}'):
+            os.replace(f'{base}.{extension}', f'{page_output_base(document_id, page_nb)}.{extension}')
+
+
+def _remove_alternatives(document_id: str, page_nb: int, run_id: str) -> None:
+    for settings_index in range(len(ALTERNATIVE_SETTINGS)):
+        base = _alternative_base(document_id, page_nb, settings_index, run_id)
+        for extension in RENDERER_EXTENSIONS.values():
+            if os.path.exists(f'{base}.{extension}'):
+                os.remove(f'{base}.{extension}')
+
+
+def _best_alternative(
+    weak_page: PageConfidence, results: Dict[Tuple[int, int], Optional[PageConfidence]]
+) -> Optional[Tuple[float, int]]:
+    candidates = [
+        (result.mean, settings_index)
+        for (page_nb, settings_index), result in results.items()
+        # an alternative dropping half of the words is not an improvement, whatever its confidence
+        if page_nb == weak_page.page_nb and result and result.nb_words >= weak_page.nb_words / 2
+    ]
+    best = max(candidates, default=None)
+    return best if best and best[0] > weak_page.mean else None
+
+
+def improve_weak_pages(document_id: str, page_nbs: List[int]) -> List[PageImprovement]:
+    config = get_config().reocr
+    to_review = [page_nb for page_nb in page_nbs if not os.path.exists(_reviewed_path(document_id, page_nb))]
+    confidences = page_confidences({page_nb: load_page_alto_xml(document_id, page_nb) for page_nb in to_review})
+    weak_pages = [page for page in confidences if is_weak(page, config.confidence_threshold)]
+    jobs = [(page.page_nb, index) for page in weak_pages for index in range(len(ALTERNATIVE_SETTINGS))]
+    run_id = uuid.uuid4().hex
+    # More threads would only hold 300 DPI rasters while waiting for a Tesseract slot.
+    max_workers = min(config.max_workers, get_config().pipeline.tesseract_processes)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        outputs = list(executor.map(lambda job: _run_alternative(document_id, *job, run_id), jobs))
+    results = dict(zip(jobs, outputs))
+    improvements: List[PageImprovement] = []
+    for page in weak_pages:
+        best = _best_alternative(page, results)
+        if best:
+            _replace_page_outputs(document_id, page.page_nb, best[1], run_id)
+            improvements.append(PageImprovement(page.page_nb, page.mean, best[0], ALTERNATIVE_SETTINGS[best[1]]))
+        _remove_alternatives(document_id, page.page_nb, run_id)
+    for page_nb in to_review:
+        write_file('', _reviewed_path(document_id, page_nb))
+    return improvements
+
+
+def _mean_confidence(document_id: str, page_nbs: List[int]) -> float:
+    pages = [word_confidences(load_page_alto_xml(document_id, page_nb)) for page_nb in page_nbs]
+    confidences = np.concatenate(pages) if pages else np.empty(0)
+    return float(np.nanmean(confidences)) if confidences.size else 1.0
+
+
+def _timed(function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def _benchmark_document(pdf_path: str) -> Dict[str, float]:
+    document_id = Document.new().document_id
+    copy_pdf(pdf_path, document_id)
+    try:
+        page_nbs = list(range(nb_pages_in_pdf(pdf_path)))
+        base_time = sum(_timed(ocr_page, document_id, page_nb) for page_nb in page_nbs)
+        base_confidence = _mean_confidence(document_id, page_nbs)
+        start = time.perf_counter()
+        improvements = improve_weak_pages(document_id, page_nbs)
+        adaptive_time = time.perf_counter() - start
+        adaptive_confidence = _mean_confidence(document_id, page_nbs)
+        high_dpi_time = sum(_timed(ocr_page, document_id, page_nb, OCRSettings(dpi=300)) for page_nb in page_nbs)
+        high_dpi_confidence = _mean_confidence(document_id, page_nbs)
+    finally:
+        delete_document(document_id)
+    return {
+        'pages': len(page_nbs),
+        'improved': len(improvements),
+        'base_conf': base_confidence,
+        'base_s': base_time,
+        'adaptive_conf': adaptive_confidence,
+        'adaptive_extra_s': adaptive_time,
+        '300dpi_conf': high_dpi_confidence,
+        '300dpi_s': high_dpi_time,
+    }
+
+
+def benchmark(pdf_paths: List[str]) -> Dict[str, Dict[str, float]]:
+    print(f'confidence_threshold={get_config().reocr.confidence_threshold}')
+    results = {}
+    for pdf_path in pdf_paths:
+        result = results[os.path.basename(pdf_path)] = _benchmark_document(pdf_path)
+        print(os.path.basename(pdf_path), ' '.join(f'{key}={value:.3g}' for key, value in result.items()))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compares baseline OCR, adaptive re-OCR of weak pages and 300 DPI OCR of every page.'
+    )
+    parser.add_argument('pdfs', nargs='*', help='Benchmark documents, defaults to sample documents.')
+    parser.add_argument('--json', help='Also writes the report as JSON to this path.')
+    args = parser.parse_args()
+    report = {
+        'confidence_threshold': get_config().reocr.confidence_threshold,
+        'alternative_settings': [asdict(settings) for settings in ALTERNATIVE_SETTINGS],
+        'documents': benchmark(args.pdfs or load_sample_documents()),
+    }
+    if args.json:
+        with open(args.json, 'w') as file_:
+            json.dump(report, file_, indent=4)
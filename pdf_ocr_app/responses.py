@@ -0,0 +1,141 @@
+# HTTP helpers for heavy payloads: compression, strong ETags, Cache-Control and Range requests.
+import gzip
+import mimetypes
+import os
+import zlib
+from functools import lru_cache
+from importlib.util import find_spec
+from typing import IO, Iterator, Optional
+
+from flask import Response, request
+from werkzeug.wsgi import wrap_file
+
+from pdf_ocr_app.db import compressed_artifact_path, file_sha256
+
+_COMPRESSIBLE_MIMETYPES = ('application/json', 'application/xml', 'application/javascript', 'image/svg+xml')
+_COMPRESSIBLE_ARTIFACTS = ('.xml', '.svg', '.txt', '.hocr', '.tsv')  # compressed by the janitor
+_MIN_COMPRESSED_SIZE = 1024
+_GZIP_LEVEL = 6
+_GZIP_WBITS = 31  # deflate in a gzip container, whose header has no timestamp
+_STREAM_CHUNK_SIZE = 64 * 1024
+_IMMUTABLE = 'private, max-age=31536000, immutable'
+_REVALIDATE = 'no-cache'
+_HASH_CACHE_SIZE = 1024
+
+
+@lru_cache
+def _brotli_available() -> bool:
+    return find_spec('brotli') is not None
+
+
+def _accepts(encoding: str) -> bool:
+    return request.accept_encodings[encoding] > 0
+
+
+def _content_encoding() -> Optional[str]:
+    if _brotli_available() and _accepts('br'):
+        return 'br'
+    return 'gzip' if _accepts('gzip') else None
+
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        import brotli
+
+        return brotli.compress(data)
+    return gzip.compress(data, _GZIP_LEVEL, mtime=0)  # no timestamp, ETags must not change between requests
+
+
+def _is_compressible(response: Response) -> bool:
+    return response.mimetype.startswith('text/') or response.mimetype in _COMPRESSIBLE_MIMETYPES
+
+
+def _compress_body(response: Response) -> None:
+    if 'Content-Encoding' in response.headers or not _is_compressible(response):
+        return
+    if (response.content_length or 0) < _MIN_COMPRESSED_SIZE:
+        return
+    encoding = _content_encoding()
+    if encoding:
+        response.set_data(_compress(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+
+
+def compress_response(response: Response) -> Response:
+    # after_request hook for dynamic payloads (Dash callbacks and layouts). Responses with an ETag went through
+    # conditional_response, files are streamed.
+    if response.status_code != 200 or response.direct_passthrough or 'ETag' in response.headers:
+        return response
+    _compress_body(response)
+    return response
+
+
+def conditional_response(response: Response, immutable: bool) -> Response:
+    _compress_body(response)
+    response.add_etag()
+    response.headers['Cache-Control'] = _IMMUTABLE if immutable else _REVALIDATE
+    return response.make_conditional(request)
+
+
+@lru_cache(maxsize=_HASH_CACHE_SIZE)
+def _file_hash(path: str, mtime_ns: int, size: int) -> str:
+    return file_sha256(path)
+
+
+def _gzip_stream(file_: IO[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(_GZIP_LEVEL, zlib.DEFLATED, _GZIP_WBITS)
+    for chunk in iter(lambda: file_.read(_STREAM_CHUNK_SIZE), b''):
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def _compresses_on_the_fly(path: str, size: int) -> bool:
+    # Ranges refer to the stored bytes: they are served from the file, uncompressed.
+    if not path.endswith(_COMPRESSIBLE_ARTIFACTS) or size < _MIN_COMPRESSED_SIZE:
+        return False
+    return 'Range' not in request.headers and _accepts('gzip')
+
+
+def send_artifact(path: str, immutable: bool, as_attachment: bool = False) -> Response:
+    # Artifacts are sent as stored, storage is left to the janitor: gzipped files with Content-Encoding gzip, which
+    # keeps ETags strong and Range requests meaningful. Otherwise, gzip is applied or removed on the fly, without Range
+    # support and with a variant ETag: for clients not accepting gzip, and for artifacts not compressed yet.
+    compressed_path = compressed_artifact_path(path)
+    sent_path = compressed_path or path
+    stat = os.stat(sent_path)
+    etag = _file_hash(sent_path, stat.st_mtime_ns, stat.st_size)
+    decompressed = compressed_path is not None and not _accepts('gzip')
+    compressed = compressed_path is None and _compresses_on_the_fly(path, stat.st_size)
+    file_ = gzip.open(sent_path, 'rb') if decompressed else open(sent_path, 'rb')
+    try:
+        response = Response(
+            _gzip_stream(file_) if compressed else wrap_file(request.environ, file_),
+            mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream',
+            direct_passthrough=True,
+        )
+        if compressed:
+            response.call_on_close(file_.close)
+        if compressed_path or path.endswith(_COMPRESSIBLE_ARTIFACTS):
+            response.vary.add('Accept-Encoding')
+        if (compressed_path and not decompressed) or compressed:
+            response.headers['Content-Encoding'] = 'gzip'
+        if as_attachment:
+            response.headers['Content-Disposition'] = f'attachment; filename={os.path.basename(path)}'
+        response.last_modified = stat.st_mtime
+        response.headers['Cache-Control'] = _IMMUTABLE if immutable else _REVALIDATE
+        if decompressed or compressed:
+            response.set_etag(f'{etag}-identity' if decompressed else f'{etag}-gzip')
+            response = response.make_conditional(request)
+        else:
+            response.content_length = stat.st_size
+            response.set_etag(etag)
+            response = response.make_conditional(request, accept_ranges=True, complete_length=stat.st_size)
+    except BaseException:  # e.g. 416 Range Not Satisfiable, raised by make_conditional
+        file_.close()
+        raise
+    if response.status_code == 304:
+        file_.close()  # the body is dropped, not closed
+    return response
@@ -0,0 +1,59 @@
+# OCR backend used for load tests (tesseract.backend = stub): writes tesseract-shaped outputs in constant time so
+# that the app, storage and merge steps can be measured without the cost (and variance) of tesseract itself.
+import random
+import time
+from typing import List
+from xml.sax.saxutils import quoteattr
+
+from pdf_ocr_app.db import RENDERER_EXTENSIONS, extract_page_pdf, write_file
+
+SECONDS_PER_PAGE = 0.5
+_NB_LINES = 40
+_WORDS_PER_LINE = 10
+_WORDS = 'le rapport de la commission est publié dans les annexes du présent arrêté préfectoral'.split()
+
+_ALTO_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
+<alto xmlns="http://www.loc.gov/standards/alto/ns-v3#" xmlns:xlink="http://www.w3.org/1999/xlink">
+<Description><MeasurementUnit>pixel</MeasurementUnit><OCRProcessing ID="OCR_0"><ocrProcessingStep>
+<processingSoftware><softwareName>stub</softwareName></processingSoftware></ocrProcessingStep></OCRProcessing>
+</Description>
+<Layout><Page WIDTH="{width}" HEIGHT="{height}" PHYSICAL_IMG_NR="0" ID="page_0">
+<PrintSpace HPOS="0" VPOS="0" WIDTH="{width}" HEIGHT="{height}">
+<ComposedBlock ID="cblock_0" HPOS="0" VPOS="0" WIDTH="{width}" HEIGHT="{height}">
+<TextBlock ID="block_0" HPOS="0" VPOS="0" WIDTH="{width}" HEIGHT="{height}">
+{lines}
+</TextBlock></ComposedBlock></PrintSpace></Page></Layout>
+</alto>
+'''
+
+
+def _line(line_nb: int, words: List[str], width: int, height: int) -> str:
+    word_width, line_height = width // (len(words) + 1), height // (_NB_LINES + 1)
+    vpos = line_nb * line_height
+    strings = ''.join(
+        f'<String ID="string_{line_nb}_{word_nb}" HPOS="{word_nb * word_width}" VPOS="{vpos}" '
+        f'WIDTH="{word_width * 4 // 5}" HEIGHT="{line_height // 2}" WC="{random.uniform(0.5, 1):.2f}" '
+        f'CONTENT={quoteattr(word)}/>'
+        for word_nb, word in enumerate(words)
+    )
+    return (
+        f'<TextLine ID="line_{line_nb}" HPOS="0" VPOS="{vpos}" WIDTH="{width}" HEIGHT="{line_height // 2}">'
+        f'{strings}</TextLine>'
+    )
+
+
+def stub_ocr_page(
+    document_id: str, page_nb: int, width: int, height: int, output_base: str, renderers: List[str]
+) -> None:
+    time.sleep(SECONDS_PER_PAGE)
+    lines = [random.sample(_WORDS, _WORDS_PER_LINE) for _ in range(_NB_LINES)]
+    xml_lines = '\n'.join(_line(line_nb, words, width, height) for line_nb, words in enumerate(lines))
+    text = '\n'.join(' '.join(words) for words in lines) + '\n'
+    for renderer in renderers:
+        path = f'{output_base}.{RENDERER_EXTENSIONS[renderer]}'
+        if renderer == 'alto':
+            write_file(_ALTO_TEMPLATE.format(width=width, height=height, lines=xml_lines), path)
+        elif renderer == 'pdf':  # the input page without text layer, enough for the merge step
+            extract_page_pdf(document_id, page_nb, path)
+        else:
+            write_file(text if renderer == 'txt' else '', path)
@@ -0,0 +1,12 @@
+import pytest
+
+from pdf_ocr_app.config import get_config
+
+
+@pytest.fixture
+def documents_folder(tmp_path, monkeypatch):
+    monkeypatch.setenv('storage_documents_folder', str(tmp_path))
+    monkeypatch.setenv('storage_local_index_folder', str(tmp_path.with_name(tmp_path.name + '-index')))
+    get_config.cache_clear()
+    yield str(tmp_path)
+    get_config.cache_clear()
@@ -0,0 +1,145 @@
+import json
+import os
+
+import pytest
+from flask import Flask
+
+from pdf_ocr_app import api as api_module
+from pdf_ocr_app import process
+from pdf_ocr_app.compute import OCRProcessingStep
+from pdf_ocr_app.db import (
+    dump_ocr_page_numbers,
+    dump_processing_step,
+    input_pdf_path,
+    list_document_ids,
+    page_output_path,
+    pages_folder,
+    record_nb_pages,
+)
+from pdf_ocr_app.index import DocumentStatus, get_document
+from pdf_ocr_app.process import dump_ocr_outputs
+
+
+@pytest.fixture
+def client(documents_folder, monkeypatch):
+    monkeypatch.setenv('api_input_folder', documents_folder)
+    monkeypatch.setenv('environment_type', 'dev')
+    started = []
+    monkeypatch.setattr(api_module, 'start_simple_ocr_process', lambda *args: started.append(args))
+    app = Flask(__name__)
+    app.register_blueprint(api_module.api)
+    client = app.test_client()
+    client.started = started
+    return client
+
+
+def test_submit_streamed_pdf_and_poll_status(client):
+    response = client.post('/api/documents?pages=2-3', data=b'%PDF-1.4', content_type='application/pdf')
+    assert response.status_code == 202
+    document_id = response.get_json()['document_id']
+    assert client.started == [(document_id, (1, 3))]
+    with open(input_pdf_path(document_id), 'rb') as file_:
+        assert file_.read() == b'%PDF-1.4'
+
+    status = client.get(f'/api/documents/{document_id}')
+    assert status.status_code == 200 and status.get_json()['done'] is False
+    etag = status.headers['ETag']
+    assert client.get(f'/api/documents/{document_id}', headers={'If-None-Match': etag}).status_code == 304
+    record_nb_pages(document_id, 4)
+    dump_ocr_page_numbers([1, 2], document_id)
+    dump_processing_step(OCRProcessingStep('Résultats partiels', 0.5, True, complete=False), document_id)
+    partial = client.get(f'/api/documents/{document_id}', headers={'If-None-Match': etag})
+    assert partial.status_code == 200
+    assert partial.get_json() == {
+        'message': 'Résultats partiels',
+        'advancement': 0.5,
+        'done': True,
+        'complete': False,
+        'nb_pages': 4,
+        'ocr_pages': [1, 2],
+    }
+    assert client.get('/api/documents/unknownDocum').status_code == 404
+
+
+def test_submit_server_side_path_with_callback(client, documents_folder, monkeypatch):
+    monkeypatch.setattr('pdf_ocr_app.process.dump_svg', lambda *_: None)
+    monkeypatch.setenv('tesseract_renderers', 'alto')
+    input_path = os.path.join(documents_folder, 'input.pdf')
+    with open(input_path, 'wb') as file_:
+        file_.write(b'%PDF-1.4')
+    callback_file = os.path.join(documents_folder, 'callbacks.jsonl')
+    payload = {'path': input_path, 'callback_url': f'file://{callback_file}'}
+    response = client.post('/api/documents', json=payload)
+    assert response.status_code == 202
+    document_id = response.get_json()['document_id']
+
+    assert client.get(f'/api/documents/{document_id}/pages/0.alto').status_code == 404
+    os.makedirs(pages_folder(document_id), exist_ok=True)
+    with open(page_output_path(document_id, 0, 'alto'), 'w') as file_:
+        file_.write('<alto/>')
+    dump_ocr_outputs([0], document_id, 2)  # partial results are not notified
+    dump_ocr_outputs([0], document_id, 1)
+    page = client.get(f'/api/documents/{document_id}/pages/0.alto')
+    assert page.status_code == 200 and page.data == b'<alto/>'
+    text = client.get(f'/api/documents/{document_id}/pages/0.txt')  # built from ALTO, txt is not a renderer here
+    assert text.status_code == 200 and text.mimetype == 'text/plain'
+    assert client.get(f'/api/documents/{document_id}/pages/0.hocr').status_code == 404
+    with open(callback_file) as file_:
+        notifications = [json.loads(line) for line in file_]
+    assert notifications == [
+        {
+            'document_id': document_id,
+            'status': 'done',
+            'step': {'message': None, 'advancement': 1.0, 'done': True, 'complete': True},
+            'pages': [0],
+        }
+    ]
+
+
+def test_crashing_ocr_job_marks_the_document_failed(client, documents_folder, monkeypatch):
+    input_path = os.path.join(documents_folder, 'input.pdf')
+    with open(input_path, 'wb') as file_:
+        file_.write(b'%PDF-1.4')
+    callback_file = os.path.join(documents_folder, 'callbacks.jsonl')
+    payload = {'path': input_path, 'callback_url': f'file://{callback_file}'}
+    document_id = client.post('/api/documents', json=payload).get_json()['document_id']
+
+    def _crash(*_):
+        raise RuntimeError('pdftoppm was killed')
+
+    monkeypatch.setattr(process, 'simple_ocr_on_file', _crash)
+    with pytest.raises(RuntimeError):
+        process.run_simple_ocr_job(document_id)
+    status = client.get(f'/api/documents/{document_id}').get_json()
+    assert status['message'] == 'Échec de l\'OCR.' and not status['done']
+    assert get_document(document_id).status == DocumentStatus.FAILED  # type: ignore
+    with open(callback_file) as file_:
+        notifications = [json.loads(line) for line in file_]
+    assert [(notification['status'], notification['step']['done']) for notification in notifications] == [
+        ('failed', False)
+    ]
+
+
+def test_submit_rejects_paths_outside_input_folder(client):
+    assert client.post('/api/documents', json={'path': '/etc/passwd'}).status_code == 400
+    assert client.post('/api/documents', json={'path': '/tmp/x.pdf', 'callback_url': 'ftp://x'}).status_code == 400
+
+
+def test_submit_rejects_callbacks_to_private_hosts(client, documents_folder, monkeypatch):
+    monkeypatch.setenv('environment_type', 'prod')
+    input_path = os.path.join(documents_folder, 'input.pdf')
+    with open(input_path, 'wb') as file_:
+        file_.write(b'%PDF-1.4')
+    for url in ['http://127.0.0.1:8050/hook', 'http://10.1.2.3/hook', 'http://169.254.169.254/latest', 'http://[::1]/']:
+        response = client.post('/api/documents', json={'path': input_path, 'callback_url': url})
+        assert response.status_code == 400, url
+    assert client.post('/api/documents', json={'path': input_path, 'callback_url': 'file:///tmp/x'}).status_code == 400
+    public = client.post('/api/documents', json={'path': input_path, 'callback_url': 'https://93.184.216.34/hook'})
+    assert public.status_code == 202
+
+
+def test_submit_rejects_large_uploads(client, monkeypatch):
+    monkeypatch.setenv('api_max_upload_mb', '1')
+    large = b'%PDF-1.4' + b'0' * 2**20
+    assert client.post('/api/documents', data=large, content_type='application/pdf').status_code == 413
+    assert client.started == [] and list_document_ids() == []
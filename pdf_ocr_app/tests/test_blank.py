@@ -0,0 +1,69 @@
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from pdf_ocr_app import process
+from pdf_ocr_app.blank import is_blank, is_blank_page, page_ink
+from pdf_ocr_app.config import get_config
+from pdf_ocr_app.db import load_page_alto_xml, page_output_path, save_document
+
+_A4_200_DPI = (2339, 1654)
+
+
+def _white_page() -> np.ndarray:
+    return np.full(_A4_200_DPI, 245, dtype=np.uint8)
+
+
+def _text_line(pixels: np.ndarray) -> np.ndarray:
+    for letter in range(30):  # 30 letters of 10pt text
+        left = 300 + 25 * letter
+        pixels[400:430, left : left + 15] = 20
+    return pixels
+
+
+def test_blank_page_detection():
+    config = get_config().blank
+    noisy = _white_page()
+    random = np.random.RandomState(0)
+    noisy[random.randint(0, _A4_200_DPI[0], 200), random.randint(0, _A4_200_DPI[1], 200)] = 0  # dust
+    noisy[:, :40] = 0  # scanner border
+    noisy[1000:1600, 200:1400] = 190  # bleed-through
+    assert page_ink(_white_page(), 4, config.min_component_pixels).ink_ratio == 0
+    assert is_blank(_white_page(), 200, config)
+    assert is_blank(noisy, 200, config)
+    assert not is_blank(_text_line(_white_page()), 200, config)
+    hairline = _white_page()
+    hairline[1201, 200:1400] = 0
+    assert page_ink(hairline, 4, config.min_component_pixels).nb_components == 1  # not lost when downscaling
+
+
+class _Page:
+    def __init__(self, pixels):
+        self.pixels = pixels
+        self.size = (pixels.shape[1], pixels.shape[0])
+
+    def convert(self, mode):
+        return self.pixels
+
+    def save(self, path):
+        open(path, 'w').close()
+
+
+def test_blank_pages_skip_tesseract(documents_folder, monkeypatch):
+    monkeypatch.setenv('tesseract_renderers', 'alto,txt,tsv')
+    tesseract_calls = []
+    monkeypatch.setattr(process, '_tesseract', lambda *args: tesseract_calls.append(args))
+    save_document(b'%PDF-1.4', 'documentIdAA')
+    settings = process.OCRSettings(lang='fra')
+
+    process._ocr_image('documentIdAA', 0, _Page(_white_page()), settings, None)
+    process._ocr_image('documentIdAA', 1, _Page(_text_line(_white_page())), settings, None)
+
+    assert len(tesseract_calls) == 1
+    assert is_blank_page('documentIdAA', 0) and not is_blank_page('documentIdAA', 1)
+    (page,) = ET.fromstring(load_page_alto_xml('documentIdAA', 0)).iterfind('.//{*}Page')
+    assert (page.get('WIDTH'), page.get('HEIGHT')) == ('1654', '2339')
+    with open(page_output_path('documentIdAA', 0, 'txt')) as file_:
+        assert file_.read() == ''
+    with open(page_output_path('documentIdAA', 0, 'tsv')) as file_:
+        assert file_.read().splitlines()[1].split('\t')[8:10] == ['1654', '2339']
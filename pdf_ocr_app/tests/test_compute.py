@@ -0,0 +1,12 @@
+import pytest
+
+from pdf_ocr_app.compute import parse_page_range
+
+
+def test_parse_page_range():
+    assert parse_page_range('3-10') == (2, 10)
+    assert parse_page_range(' 7 ') == (6, 7)
+    assert parse_page_range('1 - 1') == (0, 1)
+    for invalid in ['', 'a-b', '0-3', '5-2', '1-2-3']:
+        with pytest.raises(ValueError):
+            parse_page_range(invalid)
@@ -1,13 +1,13 @@
 from configparser import ConfigParser
 
-from pdf_ocr_app.config import Config
+from pdf_ocr_app.config import Config, get_config
 from pdf_ocr_app.utils import safely_replace_path_suffix
 
 _CONFIG_TEMPLATE_FILE = safely_replace_path_suffix(__file__, 'pdf_ocr_app/tests/test_config.py', 'config_template.ini')
 
 
 def test_config_loads():
-    from pdf_ocr_app.config import CONFIG  # noqa: F401
+    get_config()
 
 
 def assert_no_missing_parameter_in_template():
@@ -0,0 +1,146 @@
+import hashlib
+import io
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from pdf_ocr_app import db
+from pdf_ocr_app.compute import OCRProcessingStep
+from pdf_ocr_app.db import (
+    _document_folder,
+    copy_pdf,
+    delete_document,
+    dump_processing_step,
+    dump_searchable_pdf,
+    dump_text,
+    input_pdf_path,
+    list_document_ids,
+    load_sample_documents,
+    migrate_flat_folders,
+    page_output_path,
+    record_nb_pages,
+    save_document,
+    save_document_stream,
+    searchable_pdf_path,
+    text_path,
+    write_file,
+)
+from pdf_ocr_app.index import DocumentStatus, get_document, list_documents
+
+
+def test_document_folders_are_sharded(documents_folder):
+    assert _document_folder('abcdefghijkl') == os.path.join(documents_folder, 'ab', 'cd', 'abcdefghijkl')
+    save_document(b'pdf', 'abcdefghijkl')
+    save_document(b'pdf', 'abcdZZZZZZZZ')
+    assert sorted(list_document_ids()) == ['abcdZZZZZZZZ', 'abcdefghijkl']
+
+
+def test_index_follows_document_lifecycle(documents_folder, tmp_path):
+    save_document(b'pdf', 'documentAAAA')
+    metadata = get_document('documentAAAA')
+    assert metadata and metadata.status == DocumentStatus.UPLOADED
+    assert metadata.sha256 == hashlib.sha256(b'pdf').hexdigest()
+    record_nb_pages('documentAAAA', 3)
+    dump_processing_step(OCRProcessingStep('OCR en cours.', 0.5, False), 'documentAAAA')
+    assert [x.document_id for x in list_documents(DocumentStatus.PROCESSING)] == ['documentAAAA']
+    dump_processing_step(OCRProcessingStep('Résultats partiels', 0.3, True, complete=False), 'documentAAAA')
+    assert [x.document_id for x in list_documents(DocumentStatus.PROCESSING)] == ['documentAAAA']
+    dump_processing_step(OCRProcessingStep(None, 1.0, True), 'documentAAAA')
+    metadata = get_document('documentAAAA')
+    assert metadata and metadata.status == DocumentStatus.DONE and metadata.nb_pages == 3 and metadata.size > 0
+
+    copy_pdf(input_pdf_path('documentAAAA'), 'documentBBBB')
+    metadata_copy = get_document('documentBBBB')
+    assert metadata_copy and metadata_copy.sha256 == metadata.sha256
+    delete_document('documentBBBB')
+    assert get_document('documentBBBB') is None
+    assert list_document_ids() == ['documentAAAA']
+
+
+def test_save_document_stream_stops_at_max_size(documents_folder):
+    # Chunked uploads have no Content-Length, the size is checked while copying.
+    with pytest.raises(ValueError):
+        save_document_stream(io.BytesIO(b'0' * (3 * 1024 * 1024)), 'documentAAAA', max_size=2 * 1024 * 1024)
+    assert list_document_ids() == [] and get_document('documentAAAA') is None
+    save_document_stream(io.BytesIO(b'%PDF-1.4'), 'documentAAAA', max_size=2 * 1024 * 1024)
+    assert list_document_ids() == ['documentAAAA']
+
+
+def test_migrate_flat_folders(documents_folder):
+    os.makedirs(os.path.join(documents_folder, 'flatdocument'))
+    with open(os.path.join(documents_folder, 'flatdocument', 'in.pdf'), 'wb') as file_:
+        file_.write(b'pdf')
+    assert migrate_flat_folders() == ['flatdocument']
+    assert list_document_ids() == ['flatdocument']
+    assert os.path.exists(input_pdf_path('flatdocument'))
+    metadata = get_document('flatdocument')
+    assert metadata and metadata.status == DocumentStatus.UPLOADED
+    assert migrate_flat_folders() == []
+
+
+def _alto_page(*lines):
+    text_lines = ''.join(
+        f'<TextLine HPOS="100" VPOS="{100 + 30 * line_nb}" WIDTH="400" HEIGHT="20">'
+        f'<String CONTENT="{line}"/></TextLine>'
+        for line_nb, line in enumerate(lines)
+    )
+    return f'<alto><Layout><Page><PrintSpace><TextBlock>{text_lines}</TextBlock></PrintSpace></Page></Layout></alto>'
+
+
+def test_dump_text_follows_requested_pages(documents_folder):
+    save_document(b'%PDF-1.4', 'documentAAAA')
+    write_file(_alto_page('first page', 'second line'), page_output_path('documentAAAA', 0, 'alto'))
+    write_file(_alto_page('third page'), page_output_path('documentAAAA', 2, 'alto'))
+    dump_text('documentAAAA', [0, 2])
+    with open(text_path('documentAAAA')) as file_:
+        assert file_.read() == 'first page\nsecond line\n\fthird page\n\f'
+
+
+def _fake_pdfunite(calls):
+    def _run(cmd, check):
+        assert cmd[0] == 'pdfunite' and check
+        calls.append(len(cmd) - 2)
+        with open(cmd[-1], 'wb') as output:
+            for path in cmd[1:-1]:
+                with open(path, 'rb') as input_:
+                    output.write(input_.read())
+
+    return _run
+
+
+def test_dump_searchable_pdf_merges_pages_in_batches(documents_folder, monkeypatch):
+    calls = []
+    monkeypatch.setattr(db, '_PDFUNITE_BATCH_SIZE', 3)
+    monkeypatch.setattr(subprocess, 'run', _fake_pdfunite(calls))
+    save_document(b'%PDF-1.4', 'documentAAAA')
+    for page_nb in range(11):
+        write_file(f'page{page_nb};', page_output_path('documentAAAA', page_nb, 'pdf'))
+    dump_searchable_pdf('documentAAAA', list(range(11)))
+    with open(searchable_pdf_path('documentAAAA')) as file_:
+        assert file_.read() == ''.join(f'page{page_nb};' for page_nb in range(11))
+    assert max(calls) <= 3
+    assert sorted(os.listdir(os.path.dirname(searchable_pdf_path('documentAAAA')))) == [
+        'in.pdf',
+        'leases',
+        'out.pdf',
+        'pages',
+    ]
+
+
+@pytest.mark.skipif(shutil.which('pdfunite') is None, reason='poppler-utils is not installed')
+def test_dump_searchable_pdf_with_pdfunite(documents_folder, monkeypatch):
+    monkeypatch.setattr(db, '_PDFUNITE_BATCH_SIZE', 2)
+    save_document(b'%PDF-1.4', 'documentAAAA')
+    sample_path = load_sample_documents()[0]
+    for page_nb in range(5):
+        shutil.copyfile(sample_path, page_output_path('documentAAAA', page_nb, 'pdf'))
+    dump_searchable_pdf('documentAAAA', list(range(5)))
+    info = subprocess.run(['pdfinfo', searchable_pdf_path('documentAAAA')], capture_output=True, text=True).stdout
+    sample_info = subprocess.run(['pdfinfo', sample_path], capture_output=True, text=True).stdout
+    assert _nb_pages(info) == 5 * _nb_pages(sample_info)
+
+
+def _nb_pages(pdfinfo_output):
+    return int(next(line.split()[-1] for line in pdfinfo_output.splitlines() if line.startswith('Pages:')))
@@ -0,0 +1,113 @@
+import numpy as np
+from scipy import ndimage
+
+from pdf_ocr_app import dedup, index
+from pdf_ocr_app.config import get_config
+from pdf_ocr_app.db import (
+    delete_document,
+    has_page_alto_xml,
+    input_pdf_path,
+    load_page_alto_xml,
+    page_output_path,
+    save_document,
+    write_file,
+)
+
+_RANDOM = np.random.RandomState(1)
+_TEXT = ' '.join(f'article {i} du présent arrêté préfectoral' for i in range(30))
+
+
+def _image(seed):
+    return np.random.RandomState(seed).randint(0, 256, (120, 90)).astype(float)
+
+
+def test_dhash_is_robust_to_noise():
+    image = _image(0)
+    noisy = np.clip(image + _RANDOM.normal(0, 2, image.shape), 0, 255)
+    assert bin(dedup.dhash(image) ^ dedup.dhash(noisy)).count('1') <= 3
+    assert bin(dedup.dhash(image) ^ dedup.dhash(_image(1))).count('1') > 10
+
+
+def test_minhash_estimates_jaccard_similarity():
+    assert dedup.minhash('trop court') is None
+    signature = dedup.minhash(_TEXT)
+    assert np.mean(signature == dedup.minhash(_TEXT.replace('article 29', 'article 31'))) > 0.8
+    assert np.mean(signature == dedup.minhash(' '.join(f'annexe {i} tableau' for i in range(60)))) < 0.1
+
+
+def _glyphs_page(glyphs):
+    # 300dpi page of 2 lines of 20 glyphs, 6 pixels wide strokes
+    ink = np.zeros((300, 690), bool)
+    for glyph_nb, glyph in enumerate(glyphs):
+        top, left = 100 + 60 * (glyph_nb // 20), 40 + 30 * (glyph_nb % 20)
+        ink[top : top + 36, left : left + 24] = np.kron(glyph, np.ones((6, 6), bool))
+    return ink
+
+
+def _scan(ink, shift=(0.0, 0.0), brightness=0.0, noise=0.0):
+    # Blurred, shifted by a fraction of a pixel, with sensor noise, then downsampled to the verification dpi.
+    gray = ndimage.shift(np.where(ink, 20.0, 235.0), shift, order=1, mode='nearest')
+    gray = ndimage.gaussian_filter(gray, 1.5) + brightness + _RANDOM.normal(0, noise, gray.shape)
+    return np.clip(gray.reshape(gray.shape[0] // 3, 3, gray.shape[1] // 3, 3).mean(axis=(1, 3)), 0, 255)
+
+
+def test_pixel_difference_ignores_rescan_noise_but_not_changed_glyphs(documents_folder):
+    glyphs = [_RANDOM.rand(6, 4) < 0.35 for _ in range(40)]
+    changed_glyphs = [*glyphs[:12], _RANDOM.rand(6, 4) < 0.35, *glyphs[13:]]
+    max_difference = get_config().dedup.max_pixel_difference
+    page = _scan(_glyphs_page(glyphs))
+    for shift, brightness, noise in [
+        ((1.3, -2.6), 0, 4),
+        ((0.5, 1.7), 40, 6),
+        ((-2.2, 0.4), -40, 6),
+        ((0.8, 0.8), 0, 25),
+    ]:
+        rescan = _scan(_glyphs_page(glyphs), shift, brightness, noise)
+        assert np.mean((page < 128) != (rescan < 128)) > 100 * max_difference
+        assert dedup.pixel_difference(page, rescan) <= max_difference
+    assert dedup.pixel_difference(page, _scan(_glyphs_page(changed_glyphs))) > max_difference
+    assert dedup.pixel_difference(page, _scan(_glyphs_page(changed_glyphs), (1.3, -2.6), 30, 6)) > max_difference
+
+
+def _stub_pdf_tools(monkeypatch, pages):
+    def _thumbnails(pdf_path, first_page, last_page, dpi):
+        return [pages[pdf_path][page_nb][0] for page_nb in range(first_page, last_page)]
+
+    def _text_layer(pdf_path, first_page, last_page):
+        return [pages[pdf_path][page_nb][1] for page_nb in range(first_page, last_page)]
+
+    monkeypatch.setattr(dedup, '_thumbnails', _thumbnails)
+    monkeypatch.setattr(dedup, '_text_layer', _text_layer)
+
+
+def test_reuse_duplicate_pages(documents_folder, monkeypatch):
+    pages = {}
+    for document_id, document_pages in [
+        ('originalDocu', [(_image(0), ''), (_image(1), _TEXT)]),
+        ('newVersionDo', [(_image(1), _TEXT), (_image(2), '')]),
+        ('blankPagesDo', [(np.full((120, 90), 255.0), ''), (np.full((120, 90), 255.0), '')]),
+    ]:
+        save_document(b'%PDF-1.4', document_id)
+        pages[input_pdf_path(document_id)] = document_pages
+    _stub_pdf_tools(monkeypatch, pages)
+
+    assert dedup.reuse_duplicate_pages('originalDocu', [0, 1], ['alto', 'txt']) == {}
+    for page_nb in range(2):
+        write_file(f'<alto page="{page_nb}"/>', page_output_path('originalDocu', page_nb, 'alto'))
+        write_file('text', page_output_path('originalDocu', page_nb, 'txt'))
+
+    assert dedup.reuse_duplicate_pages('newVersionDo', [0, 1], ['alto', 'txt']) == {0: ('originalDocu', 1)}
+    assert load_page_alto_xml('newVersionDo', 0) == '<alto page="1"/>'
+    assert not has_page_alto_xml('newVersionDo', 1)
+
+    # Blank pages all look alike, they are neither indexed nor looked up.
+    assert dedup.reuse_duplicate_pages('blankPagesDo', [0, 1], ['alto', 'txt']) == {}
+    with index.transaction() as connection:
+        blank_bands = dedup.bands(dedup.fingerprint_pages('blankPagesDo', 0, 1)[0])
+        assert index.find_candidate_pages(connection, blank_bands, 'anotherDocum', 10) == []
+
+    delete_document('originalDocu')
+    with index.transaction() as connection:
+        bands = dedup.bands(dedup.fingerprint_pages('newVersionDo', 0, 1)[0])
+        assert index.find_candidate_pages(connection, bands, 'anotherDocum', 10)[0]['document_id'] == 'newVersionDo'
+        assert index.find_candidate_pages(connection, bands, 'newVersionDo', 10) == []
@@ -0,0 +1,29 @@
+import json
+import subprocess
+import sys
+
+from pdf_ocr_app.utils import safely_replace_path_suffix
+
+_SRC_FOLDER = safely_replace_path_suffix(__file__, 'pdf_ocr_app/tests/test_import_time.py', '')
+# Import time is checked through the modules loaded: wall-clock budgets are flaky on shared CI machines.
+_HEAVY_MODULES = ['pytesseract', 'pdf2image', 'tqdm', 'alto', 'requests', 'ocr_utils', 'dash', 'numpy', 'scipy']
+
+_SCRIPT = '''
+import json, sys
+import {module}
+print(json.dumps(sorted(sys.modules)))
+'''
+
+
+def _import_in_fresh_interpreter(module: str):
+    cmd = [sys.executable, '-c', _SCRIPT.format(module=module)]
+    output = subprocess.run(cmd, cwd=_SRC_FOLDER, check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def test_worker_import_is_light():
+    modules = ['pdf_ocr_app.process', 'pdf_ocr_app.db', 'pdf_ocr_app.config', 'pdf_ocr_app.api', 'pdf_ocr_app.workers']
+    for module in modules:
+        loaded_modules = _import_in_fresh_interpreter(module)
+        loaded_heavy_modules = [name for name in _HEAVY_MODULES if name in loaded_modules]
+        assert loaded_heavy_modules == [], f'{module} imports {loaded_heavy_modules}'
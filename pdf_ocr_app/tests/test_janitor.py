@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pdf_ocr_app import index
+from pdf_ocr_app.compute import OCRProcessingStep
+from pdf_ocr_app.config import get_config
+from pdf_ocr_app.db import (
+    _step_path,
+    alto_xml_path,
+    background_lease_path,
+    compress_artifacts,
+    dump_alto_pages_xml,
+    dump_processing_step,
+    input_pdf_path,
+    list_document_ids,
+    load_alto_pages_xml,
+    save_document,
+)
+from pdf_ocr_app.janitor import run_janitor_once
+from pdf_ocr_app.leases import try_acquire
+
+_HOUR = 3600
+_MB = 1024 * 1024
+
+
+def _create_document(
+    document_id: str, last_access: float, done: bool = True, size: int = 1024, complete: bool = True
+) -> None:
+    save_document(b'0' * size, document_id)
+    dump_alto_pages_xml(['<alto></alto>' * 100], document_id)
+    dump_processing_step(OCRProcessingStep(None, 1.0 if done else 0.5, done, complete), document_id)
+    with index.transaction() as connection:
+        connection.execute('UPDATE documents SET last_access = ? WHERE document_id = ?', (last_access, document_id))
+
+
+def test_run_janitor_once_evicts_expired_documents(documents_folder, monkeypatch):
+    now = time.time()
+    monkeypatch.setenv('janitor_ttl_hours', '2')
+    _create_document('recentDocume', now)
+    _create_document('oldDocumentA', now - 3 * _HOUR)
+    report = run_janitor_once(now)
+    assert report.nb_evicted == 1
+    assert list_document_ids() == ['recentDocume']
+
+
+def test_run_janitor_once_enforces_quota_lru_but_keeps_running_jobs(documents_folder, monkeypatch):
+    now = time.time()
+    monkeypatch.setenv('janitor_quota_mb', '0')
+    _create_document('runningDocum', now - 30, done=False)
+    _create_document('lruDocumentA', now - 20)
+    _create_document('mruDocumentA', now - 10)
+    report = run_janitor_once(now)
+    assert report.nb_evicted == 2
+    assert list_document_ids() == ['runningDocum']
+
+
+def test_run_janitor_once_keeps_documents_being_completed(documents_folder, monkeypatch):
+    now = time.time()
+    monkeypatch.setenv('janitor_quota_mb', '0')
+    _create_document('partialDocum', now - 30, complete=False)
+    _create_document('backgroundDo', now - 20)
+    assert try_acquire(background_lease_path('backgroundDo'), 'worker-1', 60)
+    _create_document('completeDocu', now - 10)
+    assert run_janitor_once(now).nb_evicted == 1
+    assert sorted(list_document_ids()) == ['backgroundDo', 'partialDocum']
+
+
+def test_run_janitor_once_evicts_least_recently_used_documents_above_quota(documents_folder, monkeypatch):
+    now = time.time()
+    monkeypatch.setenv('janitor_quota_mb', '1')
+    _create_document('olderDocumen', now - 2 * _HOUR, size=_MB * 2 // 5)
+    _create_document('newerDocumen', now - _HOUR, size=_MB * 2 // 5)
+    assert run_janitor_once(now).nb_evicted == 0
+    _create_document('newestDocume', now - 60, size=_MB * 2 // 5)
+    report = run_janitor_once(now)
+    assert report.nb_evicted == 1 and report.total_size <= _MB
+    assert sorted(list_document_ids()) == ['newerDocumen', 'newestDocume']
+
+
+def test_run_janitor_once_scans_the_shared_folder(documents_folder, tmp_path_factory, monkeypatch):
+    now = time.time()
+    monkeypatch.setenv('workers_mode', 'shared')
+    monkeypatch.setenv('janitor_ttl_hours', '2')
+    monkeypatch.setenv('janitor_quota_mb', '0')
+    monkeypatch.setenv('storage_local_index_folder', str(tmp_path_factory.mktemp('worker-node')))
+    get_config.cache_clear()
+    _create_document('runningDocum', now, done=False)
+    _create_document('recentDocume', now)
+    _create_document('oldDocumentA', now - 3 * _HOUR)
+    for path in [input_pdf_path('oldDocumentA'), _step_path('oldDocumentA')]:
+        os.utime(path, (now - 3 * _HOUR, now - 3 * _HOUR))
+    monkeypatch.setenv('storage_local_index_folder', str(tmp_path_factory.mktemp('janitor-node')))
+    get_config.cache_clear()
+    report = run_janitor_once(now)
+    assert report.nb_documents == 3 and report.nb_evicted == 2
+    assert list_document_ids() == ['runningDocum']
+
+
+def test_run_janitor_once_compresses_cold_documents(documents_folder, monkeypatch):
+    now = time.time()
+    monkeypatch.setenv('janitor_compress_after_hours', '1')
+    _create_document('coldDocument', now - 2 * _HOUR)
+    report = run_janitor_once(now)
+    assert report.nb_compressed == 1
+    assert not os.path.exists(alto_xml_path('coldDocument'))
+    assert index.get_document('coldDocument').size < 3000  # type: ignore
+    assert run_janitor_once(now).nb_compressed == 0
+    assert load_alto_pages_xml('coldDocument') == ['<alto></alto>' * 100]
+    assert os.path.exists(alto_xml_path('coldDocument'))
+
+
+def test_concurrent_reads_of_a_compressed_document(documents_folder):
+    pages = ['<alto>' + 'word ' * 10**6 + '</alto>'] * 4
+    save_document(b'0', 'coldDocument')
+    dump_alto_pages_xml(pages, 'coldDocument')
+    compress_artifacts('coldDocument')
+    barrier = threading.Barrier(8)
+
+    def _load(_):
+        barrier.wait()
+        return load_alto_pages_xml('coldDocument')
+
+    with ThreadPoolExecutor(8) as executor:
+        assert list(executor.map(_load, range(8))) == [pages] * 8
+    assert os.listdir(os.path.dirname(alto_xml_path('coldDocument'))).count('out.xml') == 1
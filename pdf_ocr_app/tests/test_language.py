@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+from pdf_ocr_app.config import get_config
+from pdf_ocr_app.db import _create_document_folder, page_output_base
+from pdf_ocr_app.language import _language_path, detect_language, page_language
+
+
+def test_detect_language():
+    candidates = ['fra', 'eng', 'deu']
+    assert detect_language('Le rapport de la commission est publié dans les annexes.', candidates, 'fra') == 'fra'
+    assert (
+        detect_language('The report of the committee is published in the annex and on the site.', candidates, 'fra')
+        == 'eng'
+    )
+    assert (
+        detect_language('Der Bericht ist nicht in der Anlage und wird mit dem Text veröffentlicht.', candidates, 'fra')
+        == 'deu'
+    )
+    assert detect_language('Article 12', candidates, 'fra') == 'fra'
+
+
+def test_page_language_is_cached(documents_folder, monkeypatch):
+    monkeypatch.setenv('tesseract_detect_language', 'true')
+    monkeypatch.setenv('tesseract_candidate_langs', 'fra,eng')
+    get_config.cache_clear()
+    _create_document_folder('abcdefghijkl')
+    with open(page_output_base('abcdefghijkl', 0) + '.lang', 'w') as file_:
+        file_.write('eng')
+    assert page_language('abcdefghijkl', 0) == 'eng'
+    monkeypatch.setenv('tesseract_candidate_langs', 'deu')
+    get_config.cache_clear()
+    assert page_language('abcdefghijkl', 0) == 'deu'
+
+
+def test_page_language_detection_is_opt_in(documents_folder, monkeypatch):
+    get_config.cache_clear()
+    _create_document_folder('abcdefghijkl')
+    monkeypatch.setattr('pdf_ocr_app.language._detect_page_language', lambda *_: pytest.fail('detection is opt-in'))
+    assert page_language('abcdefghijkl', 0) == get_config().tesseract.lang
+    assert not os.path.exists(_language_path('abcdefghijkl', 0))
+
+    monkeypatch.setenv('tesseract_detect_language', 'true')
+    get_config.cache_clear()
+    monkeypatch.setattr('pdf_ocr_app.language._detect_page_language', lambda *_: 'eng')
+    assert page_language('abcdefghijkl', 0) == 'eng'
+    with open(_language_path('abcdefghijkl', 0)) as file_:
+        assert file_.read() == 'eng'
@@ -0,0 +1,54 @@
+import numpy as np
+
+from pdf_ocr_app.layout import alto_page_text, column_boundaries, reading_order
+
+_ALTO_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
+<alto xmlns="http://www.loc.gov/standards/alto/ns-v3#"><Layout><Page WIDTH="1000" HEIGHT="1400"><PrintSpace>
+{}
+</PrintSpace></Page></Layout></alto>'''
+
+
+def _block(lines):
+    text_lines = ''.join(
+        f'<TextLine HPOS="{x}" VPOS="{y}" WIDTH="{width}" HEIGHT="20"><String CONTENT="{content}"/></TextLine>'
+        for x, y, width, content in lines
+    )
+    return f'<TextBlock>{text_lines}</TextBlock>'
+
+
+def _two_column_page(offset=0):
+    # Tesseract sometimes emits one block per row, interleaving columns.
+    title = _block([(100 + offset, 50, 800, 'title')])
+    rows = [
+        _block([(100 + offset, 100 + 30 * row, 370, f'left{row}'), (530 + offset, 100 + 30 * row, 370, f'right{row}')])
+        for row in range(3)
+    ]
+    footer = _block([(100 + offset, 1300, 800, 'footer')])
+    return _ALTO_TEMPLATE.format(title + ''.join(rows) + footer)
+
+
+def test_columns_are_read_one_after_the_other():
+    paragraphs = alto_page_text(_two_column_page()).rstrip('\n\f').split('\n\n')
+    assert [paragraph.split('\n') for paragraph in paragraphs] == [
+        ['title'],
+        ['left0'],
+        ['left1'],
+        ['left2'],
+        ['right0'],
+        ['right1'],
+        ['right2'],
+        ['footer'],
+    ]
+
+
+def test_lines_of_a_block_stay_together_in_single_column_pages():
+    boxes = np.array([[100, 100, 800, 20], [100, 130, 300, 20], [100, 200, 700, 20], [100, 230, 750, 20]], float)
+    assert column_boundaries(boxes).size == 0
+    assert reading_order(boxes, np.array([0, 0, 1, 1])) == ((0, 1), (2, 3))
+    assert reading_order(np.empty((0, 4)), np.empty(0)) == ()
+
+
+def test_reading_order_does_not_depend_on_page_offset():
+    pages = [_two_column_page(offset) for offset in range(300)]  # distinct pages, not served from the cache
+    texts = [alto_page_text(page) for page in pages]
+    assert texts == [texts[0]] * 300
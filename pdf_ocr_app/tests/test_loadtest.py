@@ -0,0 +1,51 @@
+import os
+import time
+import xml.etree.ElementTree as ET
+
+from pdf_ocr_app import stub_ocr
+from pdf_ocr_app.loadtest import (
+    RequestRecord,
+    ServerMonitor,
+    _cpu_ticks_and_rss,
+    _process_tree,
+    dash_payload,
+    operation_stats,
+)
+
+
+def test_operation_stats():
+    records = [RequestRecord('poll', seconds / 100, seconds != 100) for seconds in range(1, 101)]
+    records.append(RequestRecord('upload', 2.0, True))
+    stats = operation_stats(records)
+    assert stats['poll'].count == 100 and stats['poll'].error_rate == 0.01
+    assert stats['poll'].percentiles == {'p50': 0.51, 'p90': 0.9, 'p99': 0.99} and stats['poll'].max == 1.0
+    assert stats['upload'].percentiles['p99'] == 2.0
+
+
+def test_dash_payload():
+    payload = dash_payload([('a', 'data'), ('b', 'value')], [('c', 'n_intervals', 3)], [('d', 'hidden', True)], 'c.n')
+    assert payload['output'] == '..a.data...b.value..'
+    assert payload['outputs'] == [{'id': 'a', 'property': 'data'}, {'id': 'b', 'property': 'value'}]
+    assert payload['inputs'] == [{'id': 'c', 'property': 'n_intervals', 'value': 3}]
+    assert dash_payload([('a', 'data')], [], [], 'x.y')['output'] == 'a.data'
+
+
+def test_server_monitor_reads_proc():
+    assert os.getpid() in _process_tree(os.getppid())
+    _, rss = _cpu_ticks_and_rss([os.getpid()])
+    assert rss > 0
+    with ServerMonitor(os.getpid(), interval=0.01) as monitor:
+        time.sleep(0.1)
+    cpu, rss_mb = monitor.summary()
+    assert cpu['max'] >= 0 and rss_mb['max'] > 1
+
+
+def test_stub_ocr_writes_alto_and_text(tmp_path, monkeypatch):
+    monkeypatch.setattr(stub_ocr, 'SECONDS_PER_PAGE', 0)
+    output_base = str(tmp_path / '0')
+    stub_ocr.stub_ocr_page('anyDocumentI', 0, 1654, 2339, output_base, ['alto', 'txt'])
+    root = ET.parse(output_base + '.xml').getroot()
+    assert root.find('.//{*}Page').get('HEIGHT') == '2339'
+    assert len(root.findall('.//{*}String')) == 400
+    with open(output_base + '.txt') as file_:
+        assert len(file_.read().splitlines()) == 40
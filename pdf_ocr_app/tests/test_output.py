@@ -0,0 +1,33 @@
+import pytest
+
+from pdf_ocr_app.db import save_document, searchable_pdf_path, text_path, write_file
+
+dash = pytest.importorskip('dash')
+pytest.importorskip('alto')
+
+from pdf_ocr_app.app.pages import output  # noqa: E402
+
+
+@pytest.fixture
+def client(documents_folder):
+    app = dash.Dash(__name__)
+    _, add_callbacks = output.page
+    add_callbacks(app)
+    return app.server.test_client()
+
+
+def test_download_searchable_pdf_and_text(client):
+    save_document(b'%PDF-1.4', 'documentIdAA')
+    assert client.get('/download_pdf/documentIdAA').status_code == 404
+    assert client.get('/download_txt/documentIdAA').status_code == 404
+    write_file(b'%PDF-1.4 with text', searchable_pdf_path('documentIdAA'))
+    write_file('page 1\n\f', text_path('documentIdAA'))
+
+    pdf = client.get('/download_pdf/documentIdAA')
+    assert pdf.status_code == 200 and pdf.data == b'%PDF-1.4 with text'
+    assert pdf.mimetype == 'application/pdf'
+    assert pdf.headers['Content-Disposition'] == 'attachment; filename=out.pdf'
+    text = client.get('/download_txt/documentIdAA')
+    assert text.status_code == 200 and text.data == b'page 1\n\f'
+    assert text.headers['Content-Disposition'] == 'attachment; filename=out.txt'
+    assert client.get('/download_txt/unknownDocum').status_code == 404
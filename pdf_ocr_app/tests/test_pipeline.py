@@ -0,0 +1,168 @@
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+import tracemalloc
+
+import pytest
+
+from pdf_ocr_app import db, process
+from pdf_ocr_app.db import (
+    alto_xml_path,
+    load_alto_pages_xml,
+    page_output_path,
+    save_document,
+    svg_path,
+)
+from pdf_ocr_app.pipeline import Stage, run_pipeline
+
+_PAGE_BYTES = 2**20
+_ALTO = '<alto><Page WIDTH="100" HEIGHT="150"/></alto>'
+
+
+def test_run_pipeline_processes_every_item_with_backpressure():
+    in_flight, max_in_flight, lock = [0], [0], threading.Lock()
+
+    def _produce(item):
+        with lock:
+            in_flight[0] += 1
+            max_in_flight[0] = max(max_in_flight[0], in_flight[0])
+        return item * 2
+
+    def _slow(item):
+        time.sleep(0.001)
+        return item
+
+    results = []
+    for item in run_pipeline(range(200), [Stage('produce', _produce), Stage('slow', _slow, 3)], queue_size=2):
+        results.append(item)
+        with lock:
+            in_flight[0] -= 1
+    assert sorted(results) == [2 * item for item in range(200)]
+    assert max_in_flight[0] <= 2 + 3 + 2 + 1  # two queues after the producer, 3 workers, 1 being consumed
+
+
+def test_run_pipeline_propagates_errors():
+    def _fail(item):
+        if item == 5:
+            raise ValueError('page 5')
+        return item
+
+    with pytest.raises(ValueError, match='page 5'):
+        list(run_pipeline(range(1000), [Stage('fail', _fail, 2)], queue_size=1))
+
+
+def _write_alto(document_id, page_nb, page, settings, output_base):
+    assert len(page) == _PAGE_BYTES
+    with open(page_output_path(document_id, page_nb, 'alto'), 'w') as file_:
+        file_.write(_ALTO)
+
+
+def _peak_memory(document_id, nb_pages):
+    save_document(b'%PDF-1.4', document_id)
+    page_nbs = list(range(nb_pages))
+    tracemalloc.start()
+    try:
+        assert sum(1 for _ in process._ocr_pages(document_id, page_nbs)) == nb_pages
+        process.dump_ocr_outputs(page_nbs, document_id, nb_pages)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_memory_is_flat_with_respect_to_page_count(documents_folder, monkeypatch):
+    # Rasterization and tesseract are stubbed: each rasterized page weighs 1MB, budget is 8MB.
+    monkeypatch.setenv('pipeline_memory_budget_mb', '8')
+    monkeypatch.setenv('pipeline_ocr_threads', '2')
+    monkeypatch.setenv('tesseract_renderers', 'alto')
+    monkeypatch.setenv('reocr_confidence_threshold', '0')
+    monkeypatch.setattr(process, '_raster_megabytes', lambda *_: _PAGE_BYTES / 2**20)
+    monkeypatch.setattr(process, '_rasterize', lambda *_: bytearray(_PAGE_BYTES))
+    monkeypatch.setattr(process, '_ocr_image', _write_alto)
+    monkeypatch.setattr(db, 'render_page_svg', lambda _: '<svg width="100" height="150"><rect/></svg>')
+
+    small_peak = _peak_memory('smallDocumen', 200)
+    large_peak = _peak_memory('largeDocumen', 2000)
+
+    assert large_peak < 10 * _PAGE_BYTES
+    assert large_peak < 1.2 * small_peak
+    assert len(load_alto_pages_xml('largeDocumen')) == 2000
+    with open(alto_xml_path('largeDocumen')) as file_:
+        assert json.load(file_)[-1] == _ALTO
+    with open(svg_path('largeDocumen')) as file_:
+        assert 'height="300000"' in file_.read(200)
+
+
+def test_raster_size_follows_the_largest_page(monkeypatch):
+    pdfinfo = 'Pages:          3\nPage    1 size: 595.276 x 841.89 pts (A4)\nPage    1 rot:  0\n'
+    pdfinfo += 'Page    2 size: 2384 x 3370 pts (A0)\nPage    3 size: 595.276 x 841.89 pts (A4)\n'
+    monkeypatch.setattr(process, 'nb_pages_in_pdf', lambda _: 3)
+    monkeypatch.setattr(subprocess, 'run', lambda *_, **__: subprocess.CompletedProcess([], 0, pdfinfo, ''))
+    assert process._raster_megabytes('any.pdf', 72) == pytest.approx(2384 * 3370 * 3 / 2**20)
+    monkeypatch.setattr(subprocess, 'run', lambda *_, **__: subprocess.CompletedProcess([], 1, '', 'error'))
+    assert process._raster_megabytes('any.pdf', 72) == pytest.approx(595 * 842 * 3 / 2**20)
+
+
+def _synthetic_pdf(path, nb_pages):
+    from PIL import Image, ImageDraw
+
+    # Small images at a low resolution: A4 pages in the PDF, rasterized at full size by pdftoppm.
+    pages = []
+    for page_nb in range(nb_pages):
+        page = Image.new('L', (83, 117), 255)
+        ImageDraw.Draw(page).text((10, 10), str(page_nb), fill=0)
+        pages.append(page)
+    pages[0].save(path, save_all=True, append_images=pages[1:], resolution=10)
+
+
+def _rss_bytes():
+    with open('/proc/self/statm') as file_:
+        return int(file_.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def _peak_rss_growth(documents_folder, document_id, nb_pages):
+    path = os.path.join(documents_folder, f'{document_id}.pdf')
+    _synthetic_pdf(path, nb_pages)
+    with open(path, 'rb') as file_:
+        save_document(file_.read(), document_id)
+    baseline, peak, stopped = _rss_bytes(), [0], threading.Event()
+
+    def _sample():
+        while not stopped.wait(0.005):
+            peak[0] = max(peak[0], _rss_bytes())
+
+    sampler = threading.Thread(target=_sample, daemon=True)
+    sampler.start()
+    try:
+        assert sum(1 for _ in process._ocr_pages(document_id, list(range(nb_pages)))) == nb_pages
+    finally:
+        stopped.set()
+        sampler.join()
+    return peak[0] - baseline
+
+
+@pytest.mark.skipif(
+    not shutil.which('pdftoppm') or not os.path.exists('/proc/self/statm'), reason='poppler and procfs needed'
+)
+def test_peak_rss_is_flat_with_respect_to_page_count(documents_folder, monkeypatch):
+    # Real rasterization of A4 pages at 200dpi (11MB each), with the stub OCR backend.
+    pytest.importorskip('PIL')
+    pytest.importorskip('pdf2image')
+    from pdf_ocr_app import stub_ocr
+
+    budget_mb = 96
+    monkeypatch.setenv('pipeline_memory_budget_mb', str(budget_mb))
+    monkeypatch.setenv('pipeline_ocr_threads', '2')
+    monkeypatch.setenv('tesseract_backend', 'stub')
+    monkeypatch.setenv('tesseract_renderers', 'alto')
+    monkeypatch.setenv('blank_enabled', 'false')
+    monkeypatch.setenv('reocr_confidence_threshold', '0')
+    monkeypatch.setattr(stub_ocr, 'SECONDS_PER_PAGE', 0)
+
+    small_growth = _peak_rss_growth(documents_folder, 'smallDocumen', 10)
+    large_growth = _peak_rss_growth(documents_folder, 'largeDocumen', 80)
+
+    assert large_growth < 1.5 * budget_mb * 2**20  # decoding copies come on top of the rasterized pages
+    assert large_growth < small_growth + budget_mb / 4 * 2**20
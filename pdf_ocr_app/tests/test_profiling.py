@@ -0,0 +1,94 @@
+import json
+import os
+import pstats
+import subprocess
+import threading
+import time
+
+from pdf_ocr_app.config import get_config
+from pdf_ocr_app.db import profiles_folder
+from pdf_ocr_app.pipeline import Stage, run_pipeline
+from pdf_ocr_app.profiling import profile_job, profiled_callback
+
+
+def _busy_loop(seconds: float) -> None:
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def _job() -> None:
+    _busy_loop(0.2)
+    subprocess.run(['sleep', '0.1'], check=True)
+
+
+def _profile_files(document_id, extension):
+    folder = profiles_folder(document_id)
+    return [os.path.join(folder, filename) for filename in os.listdir(folder) if filename.endswith(extension)]
+
+
+def _set_mode(monkeypatch, mode):
+    monkeypatch.setattr(subprocess, 'Popen', subprocess.Popen)  # restored once the test is done
+    monkeypatch.setenv('profiling_mode', mode)
+    get_config.cache_clear()
+
+
+def test_profiling_off_changes_nothing(documents_folder, monkeypatch):
+    _set_mode(monkeypatch, 'off')
+    assert profiled_callback('job', 0)(_job) is _job
+    with profile_job('documentIdAA', 'job'):
+        _job()
+    assert not os.path.exists(profiles_folder('documentIdAA'))
+
+
+def _other_request(stopped):
+    while not stopped.is_set():
+        subprocess.run(['true'], check=True)
+
+
+def test_sampling_profile(documents_folder, monkeypatch):
+    _set_mode(monkeypatch, 'sampling')
+    original_popen = subprocess.Popen
+    stopped = threading.Event()
+    other_request = threading.Thread(target=_other_request, args=(stopped,), name='other-request')
+    other_request.start()
+    try:
+        profiled_callback('job', 0)(lambda document_id: _job())('documentIdAA')
+    finally:
+        stopped.set()
+        other_request.join()
+    assert subprocess.Popen is original_popen
+
+    (folded,) = _profile_files('documentIdAA', '.folded')
+    with open(folded) as file_:
+        stacks = [line.rsplit(' ', 1) for line in file_]
+    busy_samples = sum(int(count) for stack, count in stacks if '_busy_loop' in stack)
+    assert busy_samples >= 10
+    assert all(stack.startswith('MainThread;') for stack, _ in stacks)
+
+    (summary_path,) = _profile_files('documentIdAA', '.json')
+    with open(summary_path) as file_:
+        summary = json.load(file_)
+    assert summary['wall_seconds'] >= 0.3
+    assert summary['subprocesses']['sleep']['count'] == 1
+    assert summary['subprocesses']['sleep']['total_seconds'] >= 0.1
+    assert 'true' not in summary['subprocesses']
+
+
+def test_sampling_profile_follows_pipeline_threads(documents_folder, monkeypatch):
+    _set_mode(monkeypatch, 'sampling')
+    with profile_job('documentIdAA', 'job'):
+        assert list(run_pipeline(range(2), [Stage('busy', lambda _: _busy_loop(0.1), 2)], queue_size=1)) == [None] * 2
+    (folded,) = _profile_files('documentIdAA', '.folded')
+    with open(folded) as file_:
+        stacks = [line.rsplit(' ', 1)[0] for line in file_]
+    assert any(stack.startswith('MainThread/busy;') and '_busy_loop' in stack for stack in stacks)
+
+
+def test_cprofile_profile(documents_folder, monkeypatch):
+    _set_mode(monkeypatch, 'cprofile')
+    with profile_job('documentIdAA', 'job'):
+        _job()
+    (prof,) = _profile_files('documentIdAA', '.prof')
+    functions = {function for _, _, function in pstats.Stats(prof).stats}
+    assert {'_busy_loop', '_job'} <= functions
@@ -0,0 +1,67 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pdf_ocr_app import reocr
+from pdf_ocr_app.db import load_page_alto_xml, page_output_path, pages_folder, save_document, write_file
+from pdf_ocr_app.process import OCRSettings
+from pdf_ocr_app.reocr import ALTERNATIVE_SETTINGS, PageConfidence, _best_alternative, is_weak, page_confidences
+
+_ALTO_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8"?>
+<alto xmlns="http://www.loc.gov/standards/alto/ns-v3#">
+  <Layout><Page WIDTH="100" HEIGHT="100" PHYSICAL_IMG_NR="0" ID="page_0"><PrintSpace>
+    <TextBlock><TextLine>{}</TextLine></TextBlock>
+  </PrintSpace></Page></Layout>
+</alto>'''
+
+
+def _alto(confidences):
+    return _ALTO_TEMPLATE.format(''.join(f'<String CONTENT="w" WC="{wc}"/>' for wc in confidences))
+
+
+def test_page_confidences():
+    result = page_confidences({3: _alto([0.9, 0.3]), 5: _alto([]), 8: _alto([1.0])})
+    assert [page.page_nb for page in result] == [3, 5, 8]
+    assert [page.nb_words for page in result] == [2, 0, 1]
+    assert abs(result[0].mean - 0.6) < 1e-9 and result[0].low_ratio == 0.5
+    assert result[1].mean == 1.0 and result[2].mean == 1.0
+    assert page_confidences({}) == []
+
+
+def test_best_alternative():
+    weak_page = PageConfidence(0, 10, 0.5, 0.4)
+    results = {
+        (0, 0): PageConfidence(0, 10, 0.6, 0.1),
+        (0, 1): PageConfidence(0, 2, 0.99, 0.0),
+        (0, 2): None,
+        (1, 0): PageConfidence(1, 10, 0.9, 0.0),
+    }
+    assert _best_alternative(weak_page, results) == (0.6, 0)
+    assert _best_alternative(PageConfidence(0, 10, 0.7, 0.0), results) is None
+    assert OCRSettings().dpi == 200
+
+
+def test_is_weak():
+    assert is_weak(PageConfidence(0, 10, 0.6, 0.1), 0.75)
+    assert is_weak(PageConfidence(0, 10, 0.8, 0.3), 0.75)  # most words are fine, a whole area is not
+    assert not is_weak(PageConfidence(0, 10, 0.8, 0.1), 0.75)
+    assert not is_weak(PageConfidence(0, 0, 1.0, 0.0), 0.75)
+
+
+def test_concurrent_reviews_of_a_page_do_not_mix_alternatives(documents_folder, monkeypatch):
+    save_document(b'%PDF-1.4', 'documentIdAA')
+    write_file(_alto([0.3, 0.4]), page_output_path('documentIdAA', 0, 'alto'))
+    both_runs_started = threading.Barrier(2)
+
+    def _ocr_page(document_id, page_nb, settings, output_base):
+        if settings is ALTERNATIVE_SETTINGS[0]:
+            both_runs_started.wait(timeout=5)
+        confidence = 0.9 if settings is ALTERNATIVE_SETTINGS[1] else 0.6
+        write_file(_alto([confidence, confidence]), output_base + '.xml')
+
+    monkeypatch.setattr(reocr, 'ocr_page', _ocr_page)
+    with ThreadPoolExecutor(2) as executor:
+        runs = list(executor.map(lambda _: reocr.improve_weak_pages('documentIdAA', [0]), range(2)))
+    assert [[improvement.after for improvement in improvements] for improvements in runs] == [[0.9], [0.9]]
+    assert page_confidences({0: load_page_alto_xml('documentIdAA', 0)})[0].mean == 0.9
+    assert sorted(os.listdir(pages_folder('documentIdAA'))) == ['0.reviewed', '0.xml']
@@ -0,0 +1,125 @@
+import gzip
+import json
+import os
+
+import pytest
+from flask import Flask, Response, jsonify
+
+from pdf_ocr_app import responses
+from pdf_ocr_app.compute import OCRProcessingStep
+from pdf_ocr_app.db import (
+    compress_artifacts,
+    dump_ocr_page_numbers,
+    dump_processing_step,
+    is_document_complete,
+    record_nb_pages,
+    save_document,
+    svg_path,
+)
+from pdf_ocr_app.responses import compress_response, conditional_response, send_artifact
+
+_SVG = '<svg>' + '<rect width="10" height="10"/>' * 1000 + '</svg>'
+
+
+@pytest.fixture
+def client(documents_folder):
+    save_document(b'%PDF-1.4', 'documentIdAA')
+    with open(svg_path('documentIdAA'), 'w') as file_:
+        file_.write(_SVG)
+    app = Flask(__name__)
+    app.after_request(compress_response)
+    app.add_url_rule(
+        '/svg/<int:immutable>', 'svg', lambda immutable: send_artifact(svg_path('documentIdAA'), immutable)
+    )
+    app.add_url_rule('/payload/<int:size>', 'payload', lambda size: jsonify({'data': 'x' * size}))
+    app.add_url_rule(
+        '/conditional', 'conditional', lambda: conditional_response(Response(_SVG, mimetype='image/svg+xml'), True)
+    )
+    return app.test_client()
+
+
+def test_artifacts_are_conditional_and_range_capable(client):
+    response = client.get('/svg/0')
+    assert response.data.decode() == _SVG and 'Content-Encoding' not in response.headers
+    assert response.headers['Cache-Control'] == 'no-cache'
+    etag = response.headers['ETag']
+    assert not etag.startswith('W/')
+    assert client.get('/svg/0', headers={'If-None-Match': etag}).status_code == 304
+
+    partial = client.get('/svg/0', headers={'Range': 'bytes=5-34'})
+    assert partial.status_code == 206
+    assert partial.data.decode() == _SVG[5:35]
+    assert partial.headers['Content-Range'] == f'bytes 5-34/{len(_SVG)}'
+
+
+def test_fresh_artifacts_are_compressed_on_the_fly(client):
+    response = client.get('/svg/0', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip' and 'Accept-Encoding' in response.headers['Vary']
+    assert len(response.data) < len(_SVG) / 10
+    assert gzip.decompress(response.data).decode() == _SVG
+    etag = response.headers['ETag']
+    assert etag != client.get('/svg/0').headers['ETag']
+    assert client.get('/svg/0', headers={'Accept-Encoding': 'gzip'}).data == response.data
+    assert client.get('/svg/0', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag}).status_code == 304
+    assert not os.path.exists(svg_path('documentIdAA') + '.gz')  # compression on disk is left to the janitor
+
+    partial = client.get('/svg/0', headers={'Accept-Encoding': 'gzip', 'Range': 'bytes=5-34'})
+    assert partial.status_code == 206 and 'Content-Encoding' not in partial.headers
+    assert partial.data.decode() == _SVG[5:35]
+
+
+def test_artifacts_are_sent_as_stored(client):
+    client.get('/svg/1', headers={'Accept-Encoding': 'gzip'})
+    assert not os.path.exists(svg_path('documentIdAA') + '.gz')  # compression is left to the janitor
+    compress_artifacts('documentIdAA')
+
+    response = client.get('/svg/1', headers={'Accept-Encoding': 'gzip, br;q=0'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert len(response.data) < len(_SVG) / 10
+    assert gzip.decompress(response.data).decode() == _SVG
+    etag = response.headers['ETag']
+    assert client.get('/svg/1', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag}).status_code == 304
+
+    identity = client.get('/svg/1', headers={'Accept-Encoding': 'identity'})
+    assert identity.data.decode() == _SVG and 'Content-Encoding' not in identity.headers
+    assert identity.headers['ETag'] != etag
+    assert not os.path.exists(svg_path('documentIdAA'))  # decompressed on the fly, not on disk
+    assert os.path.exists(svg_path('documentIdAA') + '.gz')
+
+
+def test_unsatisfiable_ranges_close_the_file(client, monkeypatch):
+    opened = []
+
+    def _open(*args, **kwargs):
+        opened.append(open(*args, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr(responses, 'open', _open, raising=False)
+    assert client.get('/svg/0', headers={'Range': f'bytes={len(_SVG) + 10}-'}).status_code == 416
+    assert len(opened) == 1 and opened[0].closed
+
+
+def test_dynamic_payloads_are_compressed(client):
+    response = client.get('/payload/5000', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(response.data)) == {'data': 'x' * 5000}
+    assert 'Content-Encoding' not in client.get('/payload/10', headers={'Accept-Encoding': 'gzip'}).headers
+    assert 'Content-Encoding' not in client.get('/payload/5000').headers
+
+    conditional = client.get('/conditional', headers={'Accept-Encoding': 'gzip'})
+    assert conditional.headers['Content-Encoding'] == 'gzip'
+    headers = {'Accept-Encoding': 'gzip', 'If-None-Match': conditional.headers['ETag']}
+    assert client.get('/conditional', headers=headers).status_code == 304
+
+
+def test_is_document_complete(documents_folder):
+    save_document(b'%PDF-1.4', 'documentIdAA')
+    record_nb_pages('documentIdAA', 2)
+    dump_ocr_page_numbers([0, 1], 'documentIdAA')
+    dump_processing_step(OCRProcessingStep('OCR en cours.', 0.5, False), 'documentIdAA')
+    assert not is_document_complete('documentIdAA')
+    dump_processing_step(OCRProcessingStep(None, 1.0, True), 'documentIdAA')
+    assert is_document_complete('documentIdAA')
+    dump_ocr_page_numbers([0], 'documentIdAA')
+    assert not is_document_complete('documentIdAA')
@@ -0,0 +1,183 @@
+import json
+import subprocess
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from pdf_ocr_app import process
+from pdf_ocr_app.db import load_page_alto_xml, page_output_path, save_document
+from pdf_ocr_app.tiling import is_tiled_page, merge_alto_tiles, page_tiles
+
+_ALTO = '''<?xml version="1.0" encoding="UTF-8"?>
+<alto xmlns="http://www.loc.gov/standards/alto/ns-v3#" xmlns:xlink="http://www.w3.org/1999/xlink">
+<Description><MeasurementUnit>pixel</MeasurementUnit></Description>
+<Layout><Page WIDTH="{width}" HEIGHT="{height}" PHYSICAL_IMG_NR="0" ID="page_0">
+<PrintSpace HPOS="0" VPOS="0" WIDTH="{width}" HEIGHT="{height}">
+<TextBlock ID="block_0" HPOS="0" VPOS="0" WIDTH="{width}" HEIGHT="{height}">{lines}</TextBlock>
+</PrintSpace></Page></Layout>
+</alto>
+'''
+
+
+def _page_words(width, height, word_width):
+    random = np.random.RandomState(0)
+    words = []
+    for top in range(20, height - 60, 45):
+        left = int(random.randint(0, 40))
+        while left + word_width < width:
+            words.append((f'w{len(words)}', left, top, int(random.randint(word_width // 2, word_width)), 30))
+            left += words[-1][3] + int(random.randint(10, 30))
+    return words
+
+
+def _tile_alto(words, box, jitter):
+    # What tesseract would read on a tile: words cut by the tile border come out truncated, boxes vary a bit.
+    left, top, right, bottom = box
+    lines = {}
+    for content, hpos, vpos, width, height in words:
+        start, end = max(hpos, left), min(hpos + width, right)
+        if end <= start or vpos < top or vpos + height > bottom:
+            continue
+        if (start, end) != (hpos, hpos + width):
+            content = content[: max(1, len(content) * (end - start) // width)] + '~'
+        shift = int(jitter.randint(-3, 4))
+        lines.setdefault(vpos, []).append(
+            f'<String ID="string_{len(lines)}_{start}" HPOS="{start - left + shift}" VPOS="{vpos - top}" '
+            f'WIDTH="{end - start}" HEIGHT="{height}" WC="0.9" CONTENT="{content}"/><SP WIDTH="10" VPOS="0" HPOS="0"/>'
+        )
+    xml_lines = ''.join(
+        f'<TextLine ID="line_{vpos}" HPOS="0" VPOS="{vpos - top}" WIDTH="{right - left}" HEIGHT="30">'
+        + ''.join(strings)
+        + '</TextLine>'
+        for vpos, strings in lines.items()
+    )
+    return _ALTO.format(width=right - left, height=bottom - top, lines=xml_lines)
+
+
+def _merged_strings(alto_xml):
+    root = ET.fromstring(alto_xml.encode())
+    return [
+        (string.get('CONTENT'), int(string.get('HPOS')), int(string.get('VPOS')))
+        for string in root.iterfind('.//{*}String')
+    ]
+
+
+def test_page_tiles_cover_the_page_with_overlaps():
+    tiles = page_tiles(10000, 7000, 4000, 300)
+    assert len(tiles) == 3 * 2
+    assert all(right - left <= 4000 and bottom - top <= 4000 for left, top, right, bottom in (t.box for t in tiles))
+    assert tiles[1].box[0] <= tiles[0].box[2] - 300 and tiles[3].box[1] <= tiles[0].box[3] - 300
+    points = np.random.RandomState(0).uniform(0, [10000, 7000], (1000, 2))
+    owners = [[t.core[0] <= x < t.core[2] and t.core[1] <= y < t.core[3] for t in tiles] for x, y in points]
+    assert all(sum(owner) == 1 for owner in owners)
+    assert page_tiles(1000, 800, 4000, 300)[0].box == (0, 0, 1000, 800)
+
+
+def test_merge_keeps_each_word_once():
+    words = _page_words(10000, 7000, 250)
+    tiles = page_tiles(10000, 7000, 4000, 300)
+    jitter = np.random.RandomState(1)
+    merged = merge_alto_tiles([_tile_alto(words, tile.box, jitter) for tile in tiles], tiles, 10000, 7000, 300)
+
+    strings = _merged_strings(merged)
+    assert sorted(content for content, _, _ in strings) == sorted(content for content, *_ in words)
+    positions = {content: (hpos, vpos) for content, hpos, vpos, *_ in words}
+    assert all(
+        abs(hpos - positions[content][0]) <= 3 and vpos == positions[content][1] for content, hpos, vpos in strings
+    )
+    root = ET.fromstring(merged.encode())
+    assert root.tag == '{http://www.loc.gov/standards/alto/ns-v3#}alto'
+    assert root.find('.//{*}Page').get('WIDTH') == '10000'
+    assert max(Counter(element.get('ID') for element in root.iter() if element.get('ID')).values()) == 1
+    for line in root.iterfind('.//{*}TextLine'):
+        first, last = line[0], line[-1]
+        assert first.tag.endswith('String') and last.tag.endswith('String')
+        assert int(line.get('HPOS')) == int(first.get('HPOS'))
+
+
+class _Page:
+    def __init__(self, width, height, origin=(0, 0)):
+        self.size, self.origin = (width, height), origin
+
+    def convert(self, mode):
+        return np.zeros((1, 1))
+
+    def crop(self, box):
+        return _Page(box[2] - box[0], box[3] - box[1], box[:2])
+
+    def save(self, path):
+        with open(path, 'w') as file_:
+            json.dump([*self.origin, *self.size], file_)
+
+
+def test_oversized_pages_are_ocred_by_tiles(documents_folder, monkeypatch):
+    for key, value in [('max_pixels', 10**6), ('tile_size', 500), ('overlap', 100)]:
+        monkeypatch.setenv(f'tiling_{key}', str(value))
+    monkeypatch.setenv('pipeline_tesseract_processes', '3')
+    monkeypatch.setenv('tesseract_renderers', 'alto,txt,tsv,pdf')
+    monkeypatch.setenv('blank_enabled', 'false')
+    words = _page_words(1200, 900, 80)
+    jitter = np.random.RandomState(2)
+
+    running, max_running, lock = [0], [0], threading.Lock()
+
+    def _tesseract(image_path, output_base, settings, lang, renderers=None):
+        assert renderers == ['alto']
+        with lock:
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        with open(image_path) as file_:
+            left, top, width, height = json.load(file_)
+        with open(output_base + '.xml', 'w') as file_:
+            file_.write(_tile_alto(words, (left, top, left + width, top + height), jitter))
+
+    monkeypatch.setattr(process, '_tesseract', _tesseract)
+    monkeypatch.setattr('pdf_ocr_app.tiling.extract_page_pdf', lambda *_: None)
+    save_document(b'%PDF-1.4', 'documentIdAA')
+    process._ocr_image('documentIdAA', 0, _Page(1200, 900), process.OCRSettings(lang='fra'), None)
+
+    strings = _merged_strings(load_page_alto_xml('documentIdAA', 0))
+    assert sorted(content for content, _, _ in strings) == sorted(content for content, *_ in words)
+    with open(page_output_path('documentIdAA', 0, 'tsv')) as file_:
+        assert len(file_.read().splitlines()) == 2 + len(words)
+    with open(page_output_path('documentIdAA', 0, 'txt')) as file_:
+        assert file_.read().split() == [content for content, *_ in words]
+    assert 1 < max_running[0] <= 3  # in parallel, even with a single pipeline OCR thread
+    assert is_tiled_page('documentIdAA', 0)
+    assert process._tiled_pages_note('documentIdAA', [0]) == 'Pages sans couche texte dans le PDF (OCR par tuiles) : 1.'
+
+
+def test_tesseract_runs_share_the_job_tesseract_processes(documents_folder, monkeypatch):
+    pytest.importorskip('pytesseract')
+    monkeypatch.setenv('pipeline_tesseract_processes', '2')
+    running, max_running, lock = [0], [0], threading.Lock()
+
+    def _run(*_, **__):
+        with lock:
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+
+    monkeypatch.setattr(subprocess, 'run', _run)
+    settings = process.OCRSettings()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda _: process._tesseract('tile.png', 'tile', settings, 'fra', ['alto']), range(16)))
+    assert max_running[0] == 2
+
+
+def test_tesseract_gets_the_raster_dpi(documents_folder, monkeypatch):
+    pytest.importorskip('pytesseract')
+    commands = []
+    monkeypatch.setattr(subprocess, 'run', lambda cmd, **_: commands.append(cmd))
+    process._tesseract('tile.png', 'tile', process.OCRSettings(dpi=300), 'fra', ['alto'])
+    assert commands[0][commands[0].index('--dpi') + 1] == '300'
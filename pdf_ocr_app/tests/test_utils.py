@@ -1,6 +1,19 @@
-from pdf_ocr_app.utils import safely_replace_path_suffix
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from pdf_ocr_app.utils import safely_replace_path_suffix, write_json
 
 
 def test_safely_replace_path_suffix():
     assert safely_replace_path_suffix('', '', '') == ''
     assert safely_replace_path_suffix('a/b/c', 'c', 'd') == 'a/b/d'
+
+
+def test_write_json_from_concurrent_threads(tmp_path):
+    filename = str(tmp_path / 'step.json')
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda value: write_json({'value': value}, filename), range(200)))
+    with open(filename) as file_:
+        assert json.load(file_)['value'] in range(200)
+    assert os.listdir(tmp_path) == ['step.json']
@@ -0,0 +1,148 @@
+import multiprocessing
+import os
+import socket
+import threading
+import time
+
+from pdf_ocr_app import workers
+from pdf_ocr_app.config import get_config
+from pdf_ocr_app.db import (
+    enqueue_document,
+    load_nb_pages,
+    load_processing_step,
+    queued_document_ids,
+    record_nb_pages,
+    save_document,
+)
+from pdf_ocr_app.index import DocumentStatus, get_document, index_path
+from pdf_ocr_app.leases import Heartbeat, is_held, local_owner, release, try_acquire
+
+_NB_PAGES = 23
+
+
+def test_leases(tmp_path):
+    path = str(tmp_path / 'task.lease')
+    lease = try_acquire(path, 'worker-1', 10)
+    assert lease and is_held(path, 10)
+    assert try_acquire(path, 'worker-2', 10) is None
+    release(lease)
+    assert try_acquire(path, 'worker-2', 10)
+    old = time.time() - 20
+    os.utime(path, (old, old))
+    assert not is_held(path, 10)
+    stolen = try_acquire(path, 'worker-3', 10)
+    assert stolen and stolen.owner == 'worker-3'
+    assert sorted(os.listdir(tmp_path)) == ['task.lease']  # clock probes are removed
+
+
+def test_lease_age_is_measured_with_the_file_server_clock(tmp_path, monkeypatch):
+    path = str(tmp_path / 'task.lease')
+    assert try_acquire(path, 'worker-1', 10)
+    monkeypatch.setattr(time, 'time', lambda: os.path.getmtime(path) + 3600)  # a worker with a drifting clock
+    assert is_held(path, 10)
+    assert try_acquire(path, 'worker-2', 10) is None
+
+
+def test_heartbeat_reports_lost_leases(tmp_path):
+    path = str(tmp_path / 'task.lease')
+    lease = try_acquire(path, 'worker-1', 0.15)
+    assert lease
+    with Heartbeat([lease]) as heartbeat:
+        time.sleep(0.1)
+        assert not heartbeat.lost
+        os.remove(path)
+        assert try_acquire(path, 'worker-2', 0.15)
+        time.sleep(0.15)
+    assert heartbeat.lost
+
+
+def test_local_owners_differ_across_threads_and_machines():
+    owners = [local_owner()]
+    thread = threading.Thread(target=lambda: owners.append(local_owner()))
+    thread.start()
+    thread.join()
+    assert owners[0] != owners[1]
+    assert all(owner.startswith(f'{socket.gethostname()}-{os.getpid()}-') for owner in owners)
+
+
+def test_shared_mode_keeps_the_index_out_of_the_shared_folder(documents_folder, tmp_path_factory, monkeypatch):
+    monkeypatch.setenv('workers_mode', 'shared')
+    get_config.cache_clear()
+    save_document(b'pdf', 'documentAAAA')
+    record_nb_pages('documentAAAA', _NB_PAGES)
+    assert os.path.dirname(index_path()) != documents_folder and os.path.exists(index_path())
+    assert 'index.sqlite3' not in os.listdir(documents_folder)
+    monkeypatch.setenv('storage_local_index_folder', str(tmp_path_factory.mktemp('other-node')))
+    get_config.cache_clear()
+    assert get_document('documentAAAA') is None and load_nb_pages('documentAAAA') == _NB_PAGES
+
+
+def _log(log_path: str, line: str) -> None:
+    with open(log_path, 'a') as file_:
+        file_.write(line + '\n')
+
+
+def test_workers_share_pages_of_queued_documents(documents_folder, monkeypatch):
+    log_path = os.path.join(documents_folder, 'log.txt')
+    monkeypatch.setenv('workers_pages_per_task', '2')
+    monkeypatch.setenv('workers_poll_seconds', '0.01')
+    monkeypatch.setattr(workers, 'nb_pages_in_pdf', lambda _: _log(log_path, 'pdfinfo') or _NB_PAGES)
+    monkeypatch.setattr(workers, 'ensure_tessdata', lambda: None)
+    monkeypatch.setattr(workers, 'ocr_page', lambda document_id, page_nb: _log(log_path, f'{document_id} {page_nb}'))
+    monkeypatch.setattr(workers, 'improve_weak_pages', lambda *_: None)
+    monkeypatch.setattr(workers, 'reuse_duplicate_pages', lambda document_id, _: _log(log_path, f'{document_id} dedup'))
+    monkeypatch.setattr(workers, 'merge_document', lambda document_id, _: _log(log_path, f'{document_id} merge'))
+    document_ids = ['documentAAAA', 'documentBBBB']
+    for document_id in document_ids:
+        save_document(b'pdf', document_id)
+        enqueue_document(document_id)
+
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=workers.run_worker, args=(f'worker-{i}', True)) for i in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=30)
+        assert process.exitcode == 0
+
+    with open(log_path) as file_:
+        lines = file_.read().splitlines()
+    assert lines.count('pdfinfo') <= len(processes) * len(document_ids)  # not once per poll, read from the index
+    lines = [line for line in lines if line != 'pdfinfo']
+    expected = [f'{document_id} {page_nb}' for document_id in document_ids for page_nb in range(_NB_PAGES)]
+    expected += [f'{document_id} {task}' for document_id in document_ids for task in ('dedup', 'merge')]
+    assert sorted(lines) == sorted(expected)
+    assert queued_document_ids() == []
+
+
+def test_workers_ocr_the_queued_priority_range_first(documents_folder, monkeypatch):
+    ocred_pages = []
+    monkeypatch.setenv('workers_pages_per_task', '2')
+    monkeypatch.setattr(workers, 'nb_pages_in_pdf', lambda _: _NB_PAGES)
+    monkeypatch.setattr(workers, 'ocr_page', lambda _, page_nb: ocred_pages.append(page_nb))
+    monkeypatch.setattr(workers, 'improve_weak_pages', lambda *_: None)
+    monkeypatch.setattr(workers, 'reuse_duplicate_pages', lambda *_: None)
+    monkeypatch.setattr(workers, 'merge_document', lambda *_: None)
+    save_document(b'pdf', 'documentAAAA')
+    enqueue_document('documentAAAA', (11, 14))
+    workers._process_queue('worker-1')
+    assert ocred_pages[:4] == [10, 11, 12, 13] and sorted(ocred_pages) == list(range(_NB_PAGES))
+    assert queued_document_ids() == []
+
+
+def test_failing_documents_are_given_up_after_a_few_attempts(documents_folder, monkeypatch):
+    def _fail(document_id, worker_id):
+        raise ValueError('broken pdf')
+
+    monkeypatch.setattr(workers, 'process_document', _fail)
+    save_document(b'pdf', 'documentAAAA')
+    enqueue_document('documentAAAA')
+    enqueue_document('deletedDocum')
+    for _ in range(workers._MAX_ATTEMPTS - 1):
+        workers._process_queue('worker-1')
+    assert queued_document_ids() == ['documentAAAA']
+    workers._process_queue('worker-1')
+    assert queued_document_ids() == []
+    step = load_processing_step('documentAAAA')
+    assert not step.done and 'Échec' in (step.messsage or '')
+    assert get_document('documentAAAA').status == DocumentStatus.FAILED  # type: ignore
@@ -0,0 +1,264 @@
+# OCR of oversized pages (plans, maps) by overlapping tiles processed in parallel. Tile ALTO outputs are merged at
+# the XML level: coordinates are shifted to the page, each tile keeps the elements centered in (or close to) its core
+# area (the tile minus half of the overlaps with its neighbours) and not cut by its border, then strings read by two
+# tiles are dropped once. Tiles share the Tesseract processes of the job (pipeline.tesseract_processes). Tesseract
+# cannot render a text layer from the merged ALTO: tiled pages are kept as is in the searchable PDF, and flagged.
+import math
+import os
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, List, Optional, Tuple
+
+import numpy as np
+
+from pdf_ocr_app.config import get_config
+from pdf_ocr_app.db import RENDERER_EXTENSIONS, extract_page_pdf, page_output_base, write_file
+
+_XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>\n'
+_CONTAINERS = ('ComposedBlock', 'TextBlock', 'TextLine')
+_SPACES = ('SP', 'HYP')
+_BOX_ATTRIBUTES = ('HPOS', 'VPOS', 'WIDTH', 'HEIGHT')
+_MIN_DUPLICATE_IOU = 0.5
+_EDGE_MARGIN = 2  # pixels
+_CENTER_TOLERANCE_RATIO = 0.25
+
+Box = Tuple[int, int, int, int]
+
+
+@dataclass
+class Tile:
+    box: Box  # left, top, right, bottom in page pixels
+    core: Tuple[float, float, float, float]  # same, half-open, the tiles cores partition the page
+
+
+def _starts(length: int, tile_size: int, overlap: int) -> List[int]:
+    if length <= tile_size:
+        return [0]
+    nb_tiles = math.ceil((length - overlap) / (tile_size - overlap))
+    step = (length - tile_size) / (nb_tiles - 1)
+    return [round(index * step) for index in range(nb_tiles)]
+
+
+def _cuts(starts: List[int], tile_size: int) -> List[float]:
+    middles = [(start + previous_start + tile_size) / 2 for previous_start, start in zip(starts, starts[1:])]
+    return [-math.inf, *middles, math.inf]
+
+
+def page_tiles(width: int, height: int, tile_size: int, overlap: int) -> List[Tile]:
+    lefts, tops = _starts(width, tile_size, overlap), _starts(height, tile_size, overlap)
+    x_cuts, y_cuts = _cuts(lefts, tile_size), _cuts(tops, tile_size)
+    return [
+        Tile(
+            (left, top, min(left + tile_size, width), min(top + tile_size, height)),
+            (x_cuts[column], y_cuts[row], x_cuts[column + 1], y_cuts[row + 1]),
+        )
+        for row, top in enumerate(tops)
+        for column, left in enumerate(lefts)
+    ]
+
+
+def _local_name(element: ET.Element) -> str:
+    return element.tag.rsplit('}', 1)[-1]
+
+
+def _box(element: ET.Element) -> Optional[Tuple[float, float, float, float]]:
+    if element.get('HPOS') is None:
+        return None
+    return tuple(float(element.get(attribute, 0)) for attribute in _BOX_ATTRIBUTES)  # type: ignore
+
+
+def _shift_tile(print_space: ET.Element, tile_nb: int, tile: Tile) -> None:
+    left, top = tile.box[:2]
+    for element in print_space.iter():
+        if element.get('ID'):
+            element.set('ID', f'tile{tile_nb}_{element.get("ID")}')
+        if element.get('HPOS') is not None:
+            element.set('HPOS', str(int(float(element.get('HPOS', 0))) + left))
+            element.set('VPOS', str(int(float(element.get('VPOS', 0))) + top))
+
+
+def _kept_by_tile(element: ET.Element, tile: Tile, tolerance: float) -> bool:
+    # Words cut by an inner tile border are read whole by the neighbour tile. Whole words in the overlap are kept by
+    # both tiles when close to the middle of the overlap, as boxes differ slightly between tiles: duplicates are
+    # removed afterwards rather than risking losing them.
+    hpos, vpos, width, height = _box(element)  # type: ignore
+    left, top, right, bottom = tile.box
+    cut = (
+        (math.isfinite(tile.core[0]) and hpos <= left + _EDGE_MARGIN)
+        or (math.isfinite(tile.core[1]) and vpos <= top + _EDGE_MARGIN)
+        or (math.isfinite(tile.core[2]) and hpos + width >= right - _EDGE_MARGIN)
+        or (math.isfinite(tile.core[3]) and vpos + height >= bottom - _EDGE_MARGIN)
+    )
+    return not cut and _near_core(element, tile, tolerance)
+
+
+def _near_core(element: ET.Element, tile: Tile, tolerance: float) -> bool:
+    hpos, vpos, width, height = _box(element)  # type: ignore
+    center_x, center_y = hpos + width / 2, vpos + height / 2
+    core_left, core_top, core_right, core_bottom = tile.core
+    return (
+        core_left - tolerance <= center_x < core_right + tolerance
+        and core_top - tolerance <= center_y < core_bottom + tolerance
+    )
+
+
+def _prune(element: ET.Element, keep: Callable[[ET.Element], bool]) -> bool:
+    # Removes the leaves (strings, spaces, illustrations) not to keep, then the containers left without content,
+    # and fits the boxes of the remaining containers to their content. Returns whether element is to be kept.
+    for child in list(element):
+        if _local_name(child) in _CONTAINERS:
+            kept = _prune(child, keep)
+        else:
+            kept = _box(child) is None or keep(child)
+        if not kept:
+            element.remove(child)
+    if _local_name(element) == 'TextLine':
+        children = list(element)
+        while children and _local_name(children[-1]) in _SPACES:
+            element.remove(children.pop())
+        while children and _local_name(children[0]) in _SPACES:
+            element.remove(children.pop(0))
+    if _local_name(element) not in _CONTAINERS:
+        return True
+    boxes = [_box(child) for child in element if _box(child) and _local_name(child) not in _SPACES]
+    if not boxes:
+        return False
+    array = np.array(boxes)
+    left, top = array[:, 0].min(), array[:, 1].min()
+    right, bottom = (array[:, 0] + array[:, 2]).max(), (array[:, 1] + array[:, 3]).max()
+    for attribute, value in zip(_BOX_ATTRIBUTES, (left, top, right - left, bottom - top)):
+        element.set(attribute, str(int(value)))
+    return True
+
+
+def _duplicate_strings(tile_strings: List[List[ET.Element]], tiles: List[Tile], tolerance: float) -> List[ET.Element]:
+    # Only strings close to a cut can have a twin, compared whatever their content: tiles may read them differently.
+    candidates = [
+        (tile_nb, string)
+        for tile_nb, (strings, tile) in enumerate(zip(tile_strings, tiles))
+        for string in strings
+        if not _near_core(string, tile, -2 * tolerance)  # a string kept by two tiles is within tolerance of a cut
+    ]
+    if len(candidates) < 2:
+        return []
+    tile_nbs = np.array([tile_nb for tile_nb, _ in candidates])
+    boxes = np.array([_box(string) for _, string in candidates])
+    lefts, tops = boxes[:, 0], boxes[:, 1]
+    rights, bottoms = lefts + boxes[:, 2], tops + boxes[:, 3]
+    widths = np.clip(np.minimum(rights[:, None], rights) - np.maximum(lefts[:, None], lefts), 0, None)
+    heights = np.clip(np.minimum(bottoms[:, None], bottoms) - np.maximum(tops[:, None], tops), 0, None)
+    intersections = widths * heights
+    areas = boxes[:, 2] * boxes[:, 3]
+    ious = intersections / np.maximum(areas[:, None] + areas - intersections, 1)
+    # the later string of a pair read by different tiles is the duplicate
+    other_tile = tile_nbs[:, None] != tile_nbs
+    pairs = (ious >= _MIN_DUPLICATE_IOU) & other_tile & np.tri(len(candidates), k=-1, dtype=bool)
+    return [candidates[index][1] for index in np.flatnonzero(pairs.any(axis=1))]
+
+
+def merge_alto_tiles(tile_xmls: List[str], tiles: List[Tile], width: int, height: int, overlap: int) -> str:
+    tolerance = overlap * _CENTER_TOLERANCE_RATIO
+    root = ET.fromstring(tile_xmls[0].encode())
+    namespace = root.tag[1:].split('}')[0] if root.tag.startswith('{') else ''
+    if namespace:
+        ET.register_namespace('', namespace)  # keeps tesseract's default namespace instead of ns0 prefixes
+    page = root.find('.//{*}Page')
+    print_space = page.find('{*}PrintSpace')  # type: ignore
+    page.set('WIDTH', str(width))  # type: ignore
+    page.set('HEIGHT', str(height))  # type: ignore
+    for attribute, value in zip(_BOX_ATTRIBUTES, (0, 0, width, height)):
+        print_space.set(attribute, str(value))  # type: ignore
+    for child in list(print_space):  # type: ignore
+        print_space.remove(child)  # type: ignore
+    tile_strings = []
+    for tile_nb, (tile_xml, tile) in enumerate(zip(tile_xmls, tiles)):
+        tile_print_space = ET.fromstring(tile_xml.encode()).find('.//{*}PrintSpace')
+        if tile_print_space is None:
+            tile_strings.append([])
+            continue
+        _shift_tile(tile_print_space, tile_nb, tile)
+        _prune(tile_print_space, lambda element: _kept_by_tile(element, tile, tolerance))
+        tile_strings.append(list(tile_print_space.iter(f'{{{namespace}}}String' if namespace else 'String')))
+        print_space.extend(tile_print_space)  # type: ignore
+    duplicates = set(_duplicate_strings(tile_strings, tiles, tolerance))
+    if duplicates:
+        _prune(print_space, lambda element: element not in duplicates)  # type: ignore
+    return _XML_DECLARATION + ET.tostring(root, encoding='unicode')
+
+
+def _alto_words(alto_xml: str) -> List[Tuple[int, int, int, Tuple[float, float, float, float], str, str]]:
+    root = ET.fromstring(alto_xml.encode())
+    return [
+        (block_nb, line_nb, word_nb, _box(string), string.get('WC', '0'), string.get('CONTENT', ''))  # type: ignore
+        for block_nb, block in enumerate(root.iterfind('.//{*}TextBlock'), 1)
+        for line_nb, line in enumerate(block.iterfind('{*}TextLine'), 1)
+        for word_nb, string in enumerate(line.iterfind('{*}String'), 1)
+    ]
+
+
+def _tsv(alto_xml: str, width: int, height: int) -> str:
+    rows = ['level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext']
+    rows.append(f'1\t1\t0\t0\t0\t0\t0\t0\t{width}\t{height}\t-1\t')
+    for block_nb, line_nb, word_nb, box, confidence, content in _alto_words(alto_xml):
+        ids = f'{block_nb}\t1\t{line_nb}\t{word_nb}'
+        coordinates = '\t'.join(str(int(value)) for value in box)
+        rows.append(f'5\t1\t{ids}\t{coordinates}\t{float(confidence) * 100:.0f}\t{content}')
+    return '\n'.join(rows) + '\n'
+
+
+def _hocr(alto_xml: str, width: int, height: int) -> str:
+    from xml.sax.saxutils import escape
+
+    words = ''.join(
+        f'<span class="ocrx_word" id="word_{block_nb}_{line_nb}_{word_nb}" '
+        f'title="bbox {int(box[0])} {int(box[1])} {int(box[0] + box[2])} {int(box[1] + box[3])}; '
+        f'x_wconf {float(confidence) * 100:.0f}">{escape(content)}</span>\n'
+        for block_nb, line_nb, word_nb, box, confidence, content in _alto_words(alto_xml)
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n<html xmlns="http://www.w3.org/1999/xhtml">\n'
+        '<head><title></title><meta http-equiv="Content-Type" content="text/html;charset=utf-8"/></head>\n'
+        f'<body><div class="ocr_page" id="page_1" title="bbox 0 0 {width} {height}; ppageno 0">\n{words}</div></body>\n'
+        '</html>\n'
+    )
+
+
+def tiled_marker_path(document_id: str, page_nb: int) -> str:
+    return page_output_base(document_id, page_nb) + '.tiled'
+
+
+def is_tiled_page(document_id: str, page_nb: int) -> bool:
+    return os.path.exists(tiled_marker_path(document_id, page_nb))
+
+
+def ocr_tiled_page(
+    document_id: str,
+    page_nb: int,
+    page: Any,
+    output_base: str,
+    renderers: List[str],
+    ocr_tile: Callable[[Any], str],
+) -> None:
+    config = get_config().tiling
+    width, height = page.size
+    tiles = page_tiles(width, height, config.tile_size, config.overlap)
+    with ThreadPoolExecutor(max_workers=get_config().pipeline.tesseract_processes) as executor:
+        tile_xmls = list(executor.map(lambda tile: ocr_tile(page.crop(tile.box)), tiles))
+    alto_xml = merge_alto_tiles(tile_xmls, tiles, width, height, config.overlap)
+    if 'pdf' in renderers and output_base == page_output_base(document_id, page_nb):
+        write_file('', tiled_marker_path(document_id, page_nb))
+    for renderer in sorted(renderers, key=lambda renderer: renderer == 'alto'):  # ALTO last: marks the page as done
+        path = f'{output_base}.{RENDERER_EXTENSIONS[renderer]}'
+        if renderer == 'alto':
+            write_file(alto_xml, path)
+        elif renderer == 'txt':
+            from pdf_ocr_app.layout import alto_page_text
+
+            write_file(alto_page_text(alto_xml), path)
+        elif renderer == 'tsv':
+            write_file(_tsv(alto_xml, width, height), path)
+        elif renderer == 'hocr':
+            write_file(_hocr(alto_xml, width, height), path)
+        else:  # tesseract cannot render a text layer from the merged ALTO, the page is kept as is
+            extract_page_pdf(document_id, page_nb, path)
@@ -1,5 +1,6 @@
 import json
 import os
+import uuid
 
 
 def safely_replace_path_suffix(path: str, to_replace: str, with_: str) -> str:
@@ -9,10 +10,11 @@ def safely_replace_path_suffix(path: str, to_replace: str, with_: str) -> str:
 
 
 def create_folder_if_inexistent(folder: str) -> None:
-    if not os.path.exists(folder):
-        os.mkdir(folder)
+    os.makedirs(folder, exist_ok=True)
 
 
 def write_json(obj, filename: str) -> None:
-    with open(filename, 'w') as file_:
+    tmp_filename = f'{filename}.{uuid.uuid4().hex}.tmp'  # threads of a process share the pid
+    with open(tmp_filename, 'w') as file_:
         json.dump(obj, file_, indent=4)
+    os.replace(tmp_filename, filename)  # readers never see a partially written file
@@ -0,0 +1,217 @@
+import argparse
+import os
+import socket
+import time
+import traceback
+from typing import List, Optional, Tuple
+
+from pdf_ocr_app.compute import OCRProcessingStep, PageRange
+from pdf_ocr_app.config import get_config
+from pdf_ocr_app.db import (
+    dequeue_document,
+    dump_processing_step,
+    has_page_alto_xml,
+    input_pdf_path,
+    leases_folder,
+    load_nb_pages,
+    mark_document_failed,
+    queued_document_ids,
+    queued_priority_range,
+    record_nb_pages,
+    write_file,
+)
+from pdf_ocr_app.leases import Heartbeat
+from pdf_ocr_app.leases import release as release_lease
+from pdf_ocr_app.leases import try_acquire
+from pdf_ocr_app.process import (
+    dump_ocr_outputs,
+    improve_weak_pages,
+    nb_pages_in_pdf,
+    ocr_page,
+    report_blank_pages,
+    reuse_duplicate_pages,
+)
+from pdf_ocr_app.profiling import profile_job
+from pdf_ocr_app.provision import ensure_tessdata
+
+_MERGE_TASK = 'merge'
+_DEDUP_TASK = 'dedup'
+_MAX_ATTEMPTS = 3
+
+
+def _page_ranges(nb_pages: int, pages_per_task: int) -> List[PageRange]:
+    return [(start, min(start + pages_per_task, nb_pages)) for start in range(0, nb_pages, pages_per_task)]
+
+
+def _task_name(page_range: PageRange) -> str:
+    return f'{page_range[0]}-{page_range[1]}'
+
+
+def _lease_path(document_id: str, task: str) -> str:
+    return os.path.join(leases_folder(document_id), task + '.lease')
+
+
+def _done_path(document_id: str, task: str) -> str:
+    return os.path.join(leases_folder(document_id), task + '.done')
+
+
+def _is_done(document_id: str, task: str) -> bool:
+    return os.path.exists(_done_path(document_id, task))
+
+
+def _run_task(document_id: str, task: str, worker_id: str, pages: List[int]) -> bool:
+    config = get_config().workers
+    if _is_done(document_id, task):
+        return False
+    lease = try_acquire(_lease_path(document_id, task), worker_id, config.lease_seconds)
+    if not lease:
+        return False
+    try:
+        if _is_done(document_id, task):  # finished by another worker between our check and our claim
+            return False
+        with Heartbeat([lease]) as heartbeat, profile_job(document_id, task):
+            for page_nb in pages:
+                if not has_page_alto_xml(document_id, page_nb):  # reused from a near-duplicate document
+                    ocr_page(document_id, page_nb)
+            report_blank_pages(document_id, pages)
+            improve_weak_pages(document_id, pages)
+        if heartbeat.lost:  # another worker took the task over, it will mark it as done
+            return False
+        write_file(worker_id, _done_path(document_id, task))
+        return True
+    finally:
+        release_lease(lease)
+
+
+def _prioritized(ranges: List[PageRange], priority_range: Optional[PageRange]) -> List[PageRange]:
+    # Only the order changes: task names, shared by all workers, do not depend on the priority range.
+    if not priority_range:
+        return ranges
+    first, last = priority_range
+    return sorted(ranges, key=lambda page_range: not (page_range[0] < last and first < page_range[1]))
+
+
+def _report_progress(document_id: str, ranges: List[PageRange]) -> None:
+    nb_pages = ranges[-1][1]
+    nb_done = sum(end - start for start, end in ranges if _is_done(document_id, _task_name((start, end))))
+    msg = f'OCR en cours ({nb_done}/{nb_pages} pages)'
+    dump_processing_step(OCRProcessingStep(msg, min(0.1 + 0.85 * nb_done / nb_pages, 0.95), False), document_id)
+
+
+def merge_document(document_id: str, nb_pages: int) -> None:
+    dump_ocr_outputs(list(range(nb_pages)), document_id, nb_pages)
+
+
+def _deduplicate(document_id: str, worker_id: str, nb_pages: int) -> bool:
+    if _is_done(document_id, _DEDUP_TASK):
+        return True
+    lease = try_acquire(_lease_path(document_id, _DEDUP_TASK), worker_id, get_config().workers.lease_seconds)
+    if not lease:
+        return False
+    try:
+        if not _is_done(document_id, _DEDUP_TASK):
+            with Heartbeat([lease]) as heartbeat, profile_job(document_id, _DEDUP_TASK):
+                reuse_duplicate_pages(document_id, list(range(nb_pages)))
+            if heartbeat.lost:
+                return False
+            write_file(worker_id, _done_path(document_id, _DEDUP_TASK))
+        return True
+    finally:
+        release_lease(lease)
+
+
+def _nb_pages(document_id: str) -> int:
+    # Read from the index or the document folder once known: documents are polled by every worker until merged.
+    recorded_nb_pages = load_nb_pages(document_id)
+    if recorded_nb_pages:
+        return recorded_nb_pages
+    nb_pages = nb_pages_in_pdf(input_pdf_path(document_id))
+    record_nb_pages(document_id, nb_pages)
+    return nb_pages
+
+
+def process_document(document_id: str, worker_id: str) -> bool:
+    nb_pages = _nb_pages(document_id)
+    if not _deduplicate(document_id, worker_id, nb_pages):
+        return False  # another worker is looking for pages to reuse, page tasks start once it is done
+    ranges = _page_ranges(nb_pages, get_config().workers.pages_per_task)
+    did_work = False
+    for page_range in _prioritized(ranges, queued_priority_range(document_id)):
+        if _run_task(document_id, _task_name(page_range), worker_id, list(range(*page_range))):
+            did_work = True
+            _report_progress(document_id, ranges)
+    if not all(_is_done(document_id, _task_name(page_range)) for page_range in ranges):
+        return did_work
+    merge_lease = try_acquire(_lease_path(document_id, _MERGE_TASK), worker_id, get_config().workers.lease_seconds)
+    if not merge_lease:
+        return did_work
+    try:
+        if not _is_done(document_id, _MERGE_TASK):
+            with Heartbeat([merge_lease]) as heartbeat, profile_job(document_id, _MERGE_TASK):
+                merge_document(document_id, nb_pages)
+            if heartbeat.lost:
+                return True  # the worker that took the merge over dequeues the document
+            write_file(worker_id, _done_path(document_id, _MERGE_TASK))
+            did_work = True
+        dequeue_document(document_id)
+    finally:
+        release_lease(merge_lease)
+    return did_work
+
+
+def _failures_path(document_id: str) -> str:
+    return os.path.join(leases_folder(document_id), 'failures')
+
+
+def _record_failure(document_id: str) -> int:
+    path = _failures_path(document_id)
+    nb_failures = 1
+    if os.path.exists(path):
+        with open(path) as file_:
+            nb_failures += int(file_.read() or 0)
+    write_file(str(nb_failures), path)
+    return nb_failures
+
+
+def _handle_failure(document_id: str) -> None:
+    if not os.path.exists(input_pdf_path(document_id)):
+        dequeue_document(document_id)  # deleted while queued
+        return
+    if _record_failure(document_id) >= _MAX_ATTEMPTS:
+        mark_document_failed(document_id, f'Échec de l\'OCR après {_MAX_ATTEMPTS} tentatives.')
+        dequeue_document(document_id)
+
+
+def _process_queue(worker_id: str) -> Tuple[bool, bool]:
+    document_ids = queued_document_ids()
+    did_work = False
+    for document_id in document_ids:
+        try:
+            did_work = process_document(document_id, worker_id) or did_work
+        except Exception:
+            print(f'Error while processing document {document_id}:\n{traceback.format_exc()}')
+            _handle_failure(document_id)
+    return bool(document_ids), did_work
+
+
+def run_worker(worker_id: str, exit_when_idle: bool = False) -> None:
+    ensure_tessdata()
+    while True:
+        has_documents, did_work = _process_queue(worker_id)
+        if exit_when_idle and not has_documents:
+            return
+        if not did_work:
+            time.sleep(get_config().workers.poll_seconds)
+
+
+def _default_worker_id() -> str:
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='OCR worker processing documents queued in the shared storage.')
+    parser.add_argument('--worker-id', default=None)
+    parser.add_argument('--exit-when-idle', action='store_true')
+    args = parser.parse_args()
+    worker_id: Optional[str] = args.worker_id
+    run_worker(worker_id or _default_worker_id(), args.exit_when_idle)